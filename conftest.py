@@ -0,0 +1 @@
+# Lets the tests under tests/ import the group_5_* modules from the repo root
@@ -0,0 +1,242 @@
+import json
+import math
+import time
+import random
+import argparse
+
+# Derived topics are '<sensor>/agg/<window>', plus '/sliding' for sliding
+# windows; subscribers skip topics containing this
+DERIVED = '/agg/'
+UNITS = {'ms': 1, 's': 1000, 'm': 60000, 'h': 3600000}
+# Tumbling 1s, 1m and 1h; the last minute every second and the last hour
+# every minute
+DEFAULT_WINDOWS = ['1s', '1m', '1h', '1m/1s', '1h/1m']
+
+def parse_duration(text):
+    """Milliseconds in a duration such as '500ms', '1s', '1m' or '1h'."""
+    for unit in ('ms', 's', 'm', 'h'):
+        if text.endswith(unit) and text[:-len(unit)].isdigit():
+            return int(text[:-len(unit)]) * UNITS[unit]
+    raise ValueError(f'Bad duration: {text!r}')
+
+def parse_window(spec):
+    """
+    A window spec: 'size' for a tumbling window, 'size/hop' for a sliding
+    one, e.g. '1m' or '1h/1m'.
+
+    Returns:
+    tuple: (name, size in ms, hop in ms or None for tumbling).
+    """
+    size, _, hop = spec.partition('/')
+    size_ms = parse_duration(size)
+    if not hop:
+        return size, size_ms, None
+    hop_ms = parse_duration(hop)
+    if size_ms % hop_ms:
+        raise ValueError(f'Window {size} is not a whole number of {hop} hops')
+    return size, size_ms, hop_ms
+
+class Moments:
+    """Count, min, max, mean and variance of a stream, updated in O(1)."""
+    __slots__ = ('count', 'low', 'high', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.low = math.inf
+        self.high = -math.inf
+        self.mean = 0.0
+        # Sum of squared differences from the mean (Welford), which stays
+        # accurate where a sum of squares would cancel out
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.low:
+            self.low = value
+        if value > self.high:
+            self.high = value
+
+    def merge(self, other):
+        # Chan et al.'s pairwise update, exact whatever the two counts
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.low = min(self.low, other.low)
+        self.high = max(self.high, other.high)
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.m2 / self.count) if self.count > 1 else 0.0
+
+class TumblingWindow:
+    __slots__ = ('name', 'size', 'start', 'moments')
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.start = None
+        self.moments = Moments()
+
+    def add(self, ts, value):
+        """Add a reading; returns (start, end, Moments) of the window it closed, if any."""
+        start = ts - ts % self.size
+        closed = None
+        if start != self.start:
+            if self.start is not None and self.moments.count:
+                closed = (self.start, self.start + self.size, self.moments)
+                self.moments = Moments()
+            self.start = start
+        self.moments.add(value)
+        return closed
+
+class SlidingWindow:
+    __slots__ = ('name', 'size', 'hop', 'start', 'pane', 'front', 'back', 'back_moments')
+
+    def __init__(self, name, size, hop):
+        """
+        The last `size` ms of readings, reported every `hop` ms.
+
+        Readings go into one Moments per hop (a pane). Closed panes are kept
+        on two stacks, so the window's summary is one merge of the older
+        stack's running suffix and the newer stack's running total; min and
+        max cannot be subtracted back out, so panes are never removed from a
+        running total. Each reading and each report cost O(1) amortized,
+        whatever the window's length.
+        """
+        self.name = name
+        self.size = size
+        self.hop = hop
+        self.start = None
+        self.pane = Moments()
+        # Oldest panes last, each with everything from it to the newest in front
+        self.front = []
+        # Newer panes in order, and their merged Moments
+        self.back = []
+        self.back_moments = Moments()
+
+    def add(self, ts, value):
+        start = ts - ts % self.hop
+        closed = None
+        if start != self.start:
+            if self.start is not None:
+                # Report the window that ended with the last full hop
+                end = self.start + self.hop
+                self.back.append((self.start, self.pane))
+                self.back_moments.merge(self.pane)
+                closed = (end - self.size, end, self.__window(end - self.size))
+                self.pane = Moments()
+            self.start = start
+        self.pane.add(value)
+        return closed
+
+    def __window(self, start):
+        if not self.front or self.front[-1][0] < start:
+            self.__evict(start)
+        merged = Moments()
+        if self.front:
+            merged.merge(self.front[-1][1])
+        merged.merge(self.back_moments)
+        return merged
+
+    def __evict(self, start):
+        while True:
+            while self.front and self.front[-1][0] < start:
+                self.front.pop()
+            if self.front or not self.back or self.back[0][0] >= start:
+                return
+            # Flip the newer stack over, building each pane's suffix once
+            suffix = Moments()
+            for pane_start, moments in reversed(self.back):
+                merged = Moments()
+                merged.merge(moments)
+                merged.merge(suffix)
+                suffix = merged
+                self.front.append((pane_start, merged))
+            self.back = []
+            self.back_moments = Moments()
+
+class Aggregator:
+    def __init__(self, windows=DEFAULT_WINDOWS, publish=None, history_size=10000):
+        """
+        Per-sensor summaries of a reading stream over time windows.
+
+        Every reading updates each window's count, min, max, mean and
+        standard deviation in O(1). When a window closes, on the first
+        reading past its end, its summary goes to `history` under the
+        derived topic, as the window's mean at its start time, and to
+        publish(topic, payload) as JSON. A dashboard that only wants one
+        value a minute reads <sensor>/agg/1m instead of every reading.
+
+        Parameters:
+        windows (list): Window specs, see parse_window.
+        publish (callable): Called as publish(topic, payload) for each
+            summary; None to keep them in the history only.
+        history_size (int): Summaries kept per derived topic.
+        """
+        from group_5_history import HistoryStore
+
+        self.windows = [parse_window(spec) for spec in windows]
+        self.publish = publish
+        self.history = HistoryStore(history_size)
+        self.emitted = 0
+        self.__sensors = {}
+
+    @staticmethod
+    def is_derived(topic):
+        return DERIVED in topic
+
+    def add(self, sensor, ts, value):
+        windows = self.__sensors.get(sensor)
+        if windows is None:
+            windows = self.__sensors[sensor] = [
+                TumblingWindow(name, size) if hop is None else SlidingWindow(name, size, hop)
+                for name, size, hop in self.windows]
+        for window in windows:
+            closed = window.add(ts, value)
+            if closed is not None:
+                self.__emit(sensor, window, *closed)
+
+    def __emit(self, sensor, window, start, end, moments):
+        topic = f'{sensor}{DERIVED}{window.name}'
+        if isinstance(window, SlidingWindow):
+            topic += '/sliding'
+        self.emitted += 1
+        self.history.append(topic, start, moments.mean)
+        if self.publish is not None:
+            self.publish(topic, json.dumps({
+                "name": sensor, "window": window.name, "start": start, "end": end,
+                "count": moments.count, "min": moments.low, "max": moments.high,
+                "mean": moments.mean, "stddev": moments.stddev, "sentAt": time.time()
+            }, separators=(',', ':')).encode())
+
+    def clear(self):
+        self.__sensors.clear()
+        self.history.clear()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cost of aggregating readings over windows')
+    parser.add_argument("--readings", default=200000, type=int)
+    parser.add_argument("--sensors", default=10, type=int)
+    parser.add_argument("--interval", help="ms between readings of a sensor", default=250, type=int)
+    parser.add_argument("--windows", nargs='+', default=DEFAULT_WINDOWS)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    payloads = []
+    aggregator = Aggregator(args.windows, publish=lambda topic, payload: payloads.append(payload))
+    readings = [(f'sensor{i % args.sensors}', (i // args.sensors) * args.interval, rng.gauss(20, 2))
+                for i in range(args.readings)]
+    start = time.perf_counter()
+    for sensor, ts, value in readings:
+        aggregator.add(sensor, ts, value)
+    elapsed = time.perf_counter() - start
+    print(f'{elapsed / args.readings * 1e6:.2f} us/reading for {len(args.windows)} windows, '
+          f'{aggregator.emitted} summaries for {args.readings} readings '
+          f'({args.readings / max(aggregator.emitted, 1):.0f}x fewer messages)')
@@ -0,0 +1,333 @@
+import os
+import time
+import queue
+import argparse
+import logging
+import threading
+import socketserver
+
+logger = logging.getLogger(__name__)
+
+class SmtpSender:
+    def __init__(self, host=None, port=None, use_ssl=None, sender=None, receiver=None,
+                 password=None, pool_size=1, timeout=10):
+        """
+        Send emails over a small pool of persistent SMTP connections.
+
+        Connections are opened and logged in on first use, then reused; a
+        connection the server has dropped is reopened once and the send
+        retried. Unset parameters are read from the environment (SMTP_HOST,
+        SMTP_PORT, SMTP_SSL, SENDER_EMAIL, RECEIVER_EMAIL, EMAIL_PASSWORD),
+        defaulting to Gmail over SSL.
+
+        Parameters:
+        host (str): SMTP server host.
+        port (int): SMTP server port.
+        use_ssl (bool): Connect with SMTP_SSL rather than plain SMTP.
+        sender (str): From address, also the login user.
+        receiver (str): To address.
+        password (str): Login password; no login is done when empty.
+        pool_size (int): Number of connections kept open.
+        timeout (float): Socket timeout in seconds.
+        """
+        self.host = host or os.getenv('SMTP_HOST', 'smtp.gmail.com')
+        self.port = int(port or os.getenv('SMTP_PORT', 465))
+        self.use_ssl = use_ssl if use_ssl is not None else os.getenv('SMTP_SSL', '1') == '1'
+        self.sender = sender or os.getenv('SENDER_EMAIL')
+        self.receiver = receiver or os.getenv('RECEIVER_EMAIL')
+        self.password = password if password is not None else os.getenv('EMAIL_PASSWORD')
+        self.timeout = timeout
+        self.connects = 0
+        self.__pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            self.__pool.put(None)
+
+    def __connect(self):
+        import smtplib
+
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        server = smtp_class(self.host, self.port, timeout=self.timeout)
+        if self.password:
+            server.login(self.sender, self.password)
+        self.connects += 1
+        return server
+
+    def send(self, subject, message):
+        # Only processes that email pay for importing smtplib and email
+        import smtplib
+        from email.mime.text import MIMEText
+
+        msg = MIMEText(message)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = self.receiver
+
+        server = self.__pool.get()
+        try:
+            if server is None:
+                server = self.__connect()
+            try:
+                server.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self.__discard(server)
+                server = None
+                server = self.__connect()
+                server.send_message(msg)
+        except (smtplib.SMTPException, OSError):
+            self.__discard(server)
+            server = None
+            raise
+        finally:
+            self.__pool.put(server)
+        logger.info("Email sent: %s", subject)
+
+    def __discard(self, server):
+        if server is not None:
+            try:
+                server.close()
+            except OSError:
+                pass
+
+    def close(self):
+        servers = []
+        while True:
+            try:
+                servers.append(self.__pool.get_nowait())
+            except queue.Empty:
+                break
+        for server in servers:
+            if server is not None:
+                try:
+                    server.quit()
+                except OSError:
+                    # SMTPException is an OSError
+                    self.__discard(server)
+            self.__pool.put(None)
+
+class AlertDispatcher:
+    def __init__(self, sender, window=30, max_per_minute=6, queue_size=10000, on_error=None, samples=5):
+        """
+        Deliver alerts from a background thread as per-sensor digest emails.
+
+        submit never blocks: alerts go on a bounded queue and are dropped
+        (and counted) when it is full. The worker groups alerts per sensor
+        for `window` seconds after the first one, then sends one digest
+        with a count per kind and at most `samples` distinct messages of
+        each, identical ones collapsed into a count, so a digest stays the
+        same size however many alerts it absorbs. Digests are limited to
+        max_per_minute by a token bucket; a digest over the limit stays
+        pending and absorbs further alerts until a token is free. A
+        max_per_minute of 0 disables digests: alerts are counted and dropped.
+
+        Parameters:
+        sender (SmtpSender): Object with a send(subject, message) method.
+        window (float): Seconds alerts for one sensor are collected.
+        max_per_minute (float): Most digest emails sent per minute; 0 sends none.
+        queue_size (int): Capacity of the alert queue.
+        on_error (callable): Called as on_error(exception) when a send fails.
+        samples (int): Distinct messages kept per kind in a digest.
+        """
+        if max_per_minute < 0:
+            raise ValueError(f'max_per_minute must be 0 or more, not {max_per_minute}')
+        self.sender = sender
+        self.window = window
+        self.max_per_minute = max_per_minute
+        self.on_error = on_error
+        self.samples = samples
+        self.submitted = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__pending = {}
+        self.__tokens = max_per_minute
+        self.__refilled = time.monotonic()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='alerts', daemon=True)
+
+    def start(self):
+        self.__thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop the worker after sending every pending digest."""
+        self.__stop.set()
+        self.__thread.join(timeout)
+
+    def submit(self, sensor, kind, message):
+        self.submitted += 1
+        if not self.max_per_minute:
+            self.dropped += 1
+            return
+        try:
+            self.__queue.put_nowait((time.monotonic(), sensor, kind, message))
+        except queue.Full:
+            self.dropped += 1
+
+    def __run(self):
+        while not self.__stop.is_set() or not self.__queue.empty():
+            due = min((d['due'] for d in self.__pending.values()), default=None)
+            timeout = 0.5
+            if due is not None:
+                # An overdue digest waits for the next token, not a busy loop
+                token_wait = (1 - self.__tokens) * 60 / self.max_per_minute
+                timeout = min(max(due - time.monotonic(), token_wait, 0), 0.5)
+            try:
+                self.__collect(*self.__queue.get(timeout=timeout))
+                while True:
+                    self.__collect(*self.__queue.get_nowait())
+            except queue.Empty:
+                pass
+            self.__flush(force=False)
+        self.__flush(force=True)
+
+    def __collect(self, received, sensor, kind, message):
+        digest = self.__pending.get(sensor)
+        if digest is None:
+            digest = self.__pending[sensor] = {'due': received + self.window, 'kinds': {}}
+        # Messages carry packet ids and temperatures, so they rarely repeat:
+        # count every alert, keep only the first few messages
+        entry = digest['kinds'].get(kind)
+        if entry is None:
+            entry = digest['kinds'][kind] = [0, {}]
+        entry[0] += 1
+        sampled = entry[1]
+        if message in sampled or len(sampled) < self.samples:
+            sampled[message] = sampled.get(message, 0) + 1
+
+    def __take_token(self):
+        now = time.monotonic()
+        self.__tokens = min(self.max_per_minute,
+                            self.__tokens + (now - self.__refilled) * self.max_per_minute / 60)
+        self.__refilled = now
+        if self.__tokens >= 1:
+            self.__tokens -= 1
+            return True
+        return False
+
+    def __flush(self, force):
+        now = time.monotonic()
+        for sensor in list(self.__pending):
+            digest = self.__pending[sensor]
+            if not force and (digest['due'] > now or not self.__take_token()):
+                continue
+            del self.__pending[sensor]
+            subject, body = self.format_digest(sensor, digest['kinds'])
+            try:
+                self.sender.send(subject, body)
+                self.sent += 1
+            except OSError as e:
+                # SMTPException included, without importing smtplib here
+                self.failed += 1
+                logger.error("SMTP error occurred: %s", e)
+                if self.on_error is not None:
+                    self.on_error(e)
+
+    @staticmethod
+    def format_digest(sensor, kinds):
+        """
+        Subject and body of one digest.
+
+        Parameters:
+        sensor (str): Sensor the alerts are about.
+        kinds (dict): kind -> (count, {message: count}) of sampled messages.
+        """
+        subject = f'{sensor}: ' + ', '.join(f'{kind} x{count}' for kind, (count, _) in kinds.items())
+        lines = []
+        for kind, (count, sampled) in kinds.items():
+            lines.extend(f'{kind}: {message}' + (f' (x{n})' if n > 1 else '') for message, n in sampled.items())
+            others = count - sum(sampled.values())
+            if others:
+                lines.append(f'{kind}: {others} more')
+        return subject, '\n'.join(lines)
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost stand-in SMTP')
+        for raw in self.rfile:
+            command = raw.decode(errors='replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 AUTH PLAIN')
+            elif verb == 'AUTH':
+                self.reply('235 Authentication successful')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data in self.rfile:
+                    if data.rstrip(b'\r\n') == b'.':
+                        break
+                    lines.append(data)
+                self.server.received(b''.join(lines))
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            elif verb in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            else:
+                self.reply('502 Command not implemented')
+
+class LocalSmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        Minimal plain-text SMTP server that accepts and counts every message.
+
+        Stands in for the real mail server so the alert pipeline can be run
+        and measured offline. Any login is accepted.
+        """
+        super().__init__((host, port), _SmtpHandler)
+        self.messages = 0
+        self.last_message = None
+        self.__lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def received(self, data):
+        with self.__lock:
+            self.messages += 1
+            self.last_message = data
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='smtp-stand-in', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Push alerts through the pipeline into a local SMTP stand-in')
+    parser.add_argument("--alerts", help="Alerts to submit", default=100000, type=int)
+    parser.add_argument("--sensors", help="Distinct sensors", default=100, type=int)
+    parser.add_argument("--window", help="Digest window in seconds", default=1, type=float)
+    parser.add_argument("--rate", help="Digest emails per minute", default=6000, type=float)
+    args = parser.parse_args()
+
+    server = LocalSmtpServer().start()
+    sender = SmtpSender(host='127.0.0.1', port=server.port, use_ssl=False,
+                        sender='sensor@localhost', receiver='ops@localhost', password='x')
+    dispatcher = AlertDispatcher(sender, window=args.window, max_per_minute=args.rate).start()
+    start = time.perf_counter()
+    for i in range(args.alerts):
+        dispatcher.submit(f'sensor{i % args.sensors}', 'Wild', f'Temperature: {i % 7 * 10}')
+    submit_time = time.perf_counter() - start
+    dispatcher.stop()
+    total_time = time.perf_counter() - start
+    sender.close()
+    server.stop()
+    print(f'submitted {dispatcher.submitted} in {submit_time:.3f}s '
+          f'({submit_time / max(args.alerts, 1) * 1e6:.2f} us/alert), '
+          f'dropped {dispatcher.dropped}, emails {dispatcher.sent} '
+          f'(received {server.messages}, failed {dispatcher.failed}), '
+          f'connections {sender.connects}, total {total_time:.3f}s')
@@ -0,0 +1,257 @@
+import os
+import time
+import threading
+from urllib.parse import quote, unquote
+import numpy as np
+
+# Reading flags stored alongside each reading
+FLAG_WILD = 0x01
+FLAG_GAP = 0x02     # a missing packet was detected just before this reading
+
+COLUMNS = (('ts', np.int64), ('temp', np.float64), ('flags', np.uint8))
+
+class _SensorColumns:
+    def __init__(self, path, index_every, buffer_size):
+        self.path = path
+        self.index_every = index_every
+        os.makedirs(path, exist_ok=True)
+
+        # Columns can differ in length after a crash mid-flush; the shortest
+        # one is the last complete record, so trim the others to it.
+        sizes = [os.path.getsize(self.__file(name)) // np.dtype(dtype).itemsize
+                 if os.path.exists(self.__file(name)) else 0 for name, dtype in COLUMNS]
+        self.count = min(sizes)
+        self.__files = {}
+        for name, dtype in COLUMNS:
+            f = open(self.__file(name), 'ab')
+            f.truncate(self.count * np.dtype(dtype).itemsize)
+            self.__files[name] = f
+
+        self.__buffer = {name: np.empty(buffer_size, dtype=dtype) for name, dtype in COLUMNS}
+        self.__buffered = 0
+        self.__maps = None
+        self.__mapped = -1
+
+        index_path = os.path.join(path, 'index.i64')
+        if os.path.exists(index_path):
+            self.index = np.fromfile(index_path, dtype=np.int64)
+        else:
+            self.index = np.empty(0, dtype=np.int64)
+        if len(self.index) != (self.count + index_every - 1) // index_every:
+            self.index = np.array(self.columns()['ts'][::index_every])
+            self.index.tofile(index_path)
+        self.__index_file = open(index_path, 'ab')
+        self.__index_pending = []
+
+    def __file(self, name):
+        return os.path.join(self.path, f'{name}.col')
+
+    def append(self, ts, temp, flags):
+        i = self.__buffered
+        self.__buffer['ts'][i] = ts
+        self.__buffer['temp'][i] = temp
+        self.__buffer['flags'][i] = flags
+        if (self.count + i) % self.index_every == 0:
+            self.__index_pending.append(ts)
+        self.__buffered = i + 1
+        if self.__buffered == len(self.__buffer['ts']):
+            self.flush()
+
+    def flush(self):
+        n = self.__buffered
+        if n == 0:
+            return
+        for name, _ in COLUMNS:
+            self.__files[name].write(self.__buffer[name][:n].tobytes())
+            self.__files[name].flush()
+        if self.__index_pending:
+            pending = np.array(self.__index_pending, dtype=np.int64)
+            self.__index_file.write(pending.tobytes())
+            self.__index_file.flush()
+            self.index = np.concatenate([self.index, pending])
+            self.__index_pending = []
+        self.count += n
+        self.__buffered = 0
+
+    def columns(self):
+        """Read-only memory maps of the flushed columns."""
+        if self.__mapped != self.count:
+            if self.count == 0:
+                self.__maps = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+            else:
+                self.__maps = {name: np.memmap(self.__file(name), dtype=dtype, mode='r', shape=(self.count,))
+                               for name, dtype in COLUMNS}
+            self.__mapped = self.count
+        return self.__maps
+
+    def locate(self, ts, side):
+        """Position of ts in the timestamp column, as numpy.searchsorted."""
+        if self.count == 0:
+            return 0
+        block = max(int(np.searchsorted(self.index, ts, side)) - 1, 0)
+        lo = block * self.index_every
+        hi = min(lo + self.index_every, self.count)
+        return lo + int(np.searchsorted(self.columns()['ts'][lo:hi], ts, side))
+
+    def close(self):
+        self.flush()
+        for f in self.__files.values():
+            f.close()
+        self.__index_file.close()
+        self.__maps = None
+        self.__mapped = -1
+
+class Archive:
+    def __init__(self, root, index_every=4096, buffer_size=1024, flush_interval=1.0):
+        """
+        Append-only, memory-mapped columnar store of received readings.
+
+        Each sensor gets a directory of column files (int64 timestamps,
+        float64 temperatures, uint8 flags) plus a sparse index holding every
+        index_every-th timestamp. Appends are buffered and written at the end
+        of the files; queries memory-map the columns and binary search the
+        index, so only the pages a query touches are read from disk.
+        Timestamps are expected to be non-decreasing per sensor. Buffered
+        readings are written by a background timer as well as by append, so
+        a sensor that goes quiet is still on disk within flush_interval.
+
+        Parameters:
+        root (str): Directory holding one subdirectory per sensor.
+        index_every (int): Readings per sparse index entry.
+        buffer_size (int): Readings buffered per sensor before writing.
+        flush_interval (float): Longest time in seconds a reading stays buffered.
+        """
+        self.root = root
+        self.index_every = index_every
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        os.makedirs(root, exist_ok=True)
+        self.__sensors = {}
+        self.__lock = threading.Lock()
+        self.__flushed = time.monotonic()
+        # Started by the first append, so read-only archives have no thread
+        self.__timer = None
+        self.__closed = threading.Event()
+
+    def __sensor(self, sensor):
+        columns = self.__sensors.get(sensor)
+        if columns is None:
+            path = os.path.join(self.root, quote(sensor, safe=''))
+            columns = self.__sensors[sensor] = _SensorColumns(path, self.index_every, self.buffer_size)
+        return columns
+
+    def sensors(self):
+        """Every sensor with data in the archive."""
+        with self.__lock:
+            known = set(self.__sensors)
+        return sorted(known | {unquote(name) for name in os.listdir(self.root)})
+
+    def append(self, sensor, ts, temp, flags=0):
+        with self.__lock:
+            if self.__timer is None:
+                self.__timer = threading.Thread(target=self.__flush_periodically, name='archive', daemon=True)
+                self.__timer.start()
+            self.__sensor(sensor).append(ts, temp, flags)
+            if time.monotonic() - self.__flushed >= self.flush_interval:
+                self.__flush()
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def __flush(self):
+        for columns in self.__sensors.values():
+            columns.flush()
+        self.__flushed = time.monotonic()
+
+    def __flush_periodically(self):
+        while not self.__closed.wait(self.flush_interval):
+            with self.__lock:
+                if time.monotonic() - self.__flushed >= self.flush_interval:
+                    self.__flush()
+
+    def close(self):
+        self.__closed.set()
+        if self.__timer is not None:
+            self.__timer.join()
+            self.__timer = None
+        with self.__lock:
+            for columns in self.__sensors.values():
+                columns.close()
+            self.__sensors.clear()
+
+    def count(self, sensor):
+        with self.__lock:
+            columns = self.__sensor(sensor)
+            columns.flush()
+            return columns.count
+
+    def range(self, sensor, start=None, end=None):
+        """
+        Readings with start <= timestamp < end, as memory-mapped views.
+
+        Returns:
+        tuple: (timestamps, temps, flags) arrays.
+        """
+        with self.__lock:
+            columns = self.__sensor(sensor)
+            columns.flush()
+            lo = 0 if start is None else columns.locate(start, 'left')
+            hi = columns.count if end is None else columns.locate(end, 'left')
+            maps = columns.columns()
+        return tuple(maps[name][lo:hi] for name, _ in COLUMNS)
+
+    def downsample(self, sensor, start, end, bucket_ms, include_wild=False, chunk=1 << 20):
+        """
+        Min, max and mean per time bucket over [start, end).
+
+        The range is processed chunk readings at a time, so memory use does
+        not depend on the size of the range. Empty buckets are left out.
+
+        Parameters:
+        sensor (str): Sensor to query.
+        start (int): First timestamp, in ms.
+        end (int): End timestamp (exclusive), in ms.
+        bucket_ms (int): Bucket width in ms.
+        include_wild (bool): Include readings flagged as wild.
+        chunk (int): Readings processed per step.
+
+        Returns:
+        dict: Arrays 'ts' (bucket start), 'min', 'max', 'mean' and 'count'.
+        """
+        timestamps, temps, flags = self.range(sensor, start, end)
+        parts = {key: [] for key in ('bucket', 'min', 'max', 'sum', 'count')}
+        for lo in range(0, len(timestamps), chunk):
+            ts = np.asarray(timestamps[lo:lo + chunk])
+            values = np.asarray(temps[lo:lo + chunk])
+            if not include_wild:
+                keep = (np.asarray(flags[lo:lo + chunk]) & FLAG_WILD) == 0
+                ts, values = ts[keep], values[keep]
+            if len(ts) == 0:
+                continue
+            buckets = (ts - start) // bucket_ms
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+            parts['bucket'].append(buckets[starts])
+            parts['min'].append(np.minimum.reduceat(values, starts))
+            parts['max'].append(np.maximum.reduceat(values, starts))
+            parts['sum'].append(np.add.reduceat(values, starts))
+            parts['count'].append(np.diff(np.append(starts, len(values))))
+
+        if not parts['bucket']:
+            empty = np.empty(0)
+            return {'ts': empty.astype(np.int64), 'min': empty, 'max': empty,
+                    'mean': empty, 'count': empty.astype(np.int64)}
+
+        # A bucket can straddle two chunks; merge its partial results
+        bucket = np.concatenate(parts['bucket'])
+        first = np.concatenate([[True], np.diff(bucket) != 0])
+        starts = np.flatnonzero(first)
+        total = np.add.reduceat(np.concatenate(parts['sum']), starts)
+        count = np.add.reduceat(np.concatenate(parts['count']), starts)
+        return {
+            'ts': bucket[starts] * bucket_ms + start,
+            'min': np.minimum.reduceat(np.concatenate(parts['min']), starts),
+            'max': np.maximum.reduceat(np.concatenate(parts['max']), starts),
+            'mean': total / count,
+            'count': count,
+        }
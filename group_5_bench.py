@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import threading
+import itertools
+import multiprocessing
+import numpy as np
+import paho.mqtt
+import paho.mqtt.client as mqtt
+
+from group_5_broker import LocalBroker
+from group_5_codec import get_codec, PayloadDecoder, FrameBatcher
+from group_5_data_generator import SensorSimulator
+from group_5_fleet import FleetSensor, FleetScheduler
+
+TOPIC_PREFIX = 'bench'
+
+def _usage():
+    """CPU seconds used by this process so far and its current RSS in MB."""
+    cpu = time.process_time()
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return cpu, rss / 1e6
+
+def _client(client_id):
+    return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, protocol=mqtt.MQTTv5)
+
+def _component_result(conn, cpu_start, extra):
+    cpu, rss = _usage()
+    extra.update(cpu_s=cpu - cpu_start, rss_mb=rss)
+    conn.send(extra)
+
+def broker_worker(conn):
+    broker = LocalBroker().start()
+    conn.send({'port': broker.port})
+    conn.recv()
+    cpu_start, _ = _usage()
+    conn.recv()
+    _component_result(conn, cpu_start, {'published': broker.published, 'delivered': broker.delivered})
+    broker.stop()
+
+def subscriber_worker(conn, host, port, qos, index):
+    decoder = PayloadDecoder()
+    latencies = []
+    counts = {'readings': 0, 'messages': 0, 'errors': 0}
+    subscribed = threading.Event()
+
+    def on_message(client, userdata, msg):
+        now = time.time()
+        counts['messages'] += 1
+        try:
+            readings = decoder.decode(msg.topic, msg.payload)
+        except ValueError:
+            counts['errors'] += 1
+            return
+        counts['readings'] += len(readings)
+        latencies.extend((now - r['sentAt']) * 1000 for r in readings)
+
+    client = _client(f'bench_sub_{index}_{random.randint(1000, 9999)}')
+    client.on_message = on_message
+    client.on_subscribe = lambda *args: subscribed.set()
+    client.connect(host, port)
+    client.subscribe(f'{TOPIC_PREFIX}/+', qos=qos)
+    client.loop_start()
+    subscribed.wait(10)
+    conn.send({'ready': True})
+    conn.recv()
+    cpu_start, _ = _usage()
+    conn.recv()
+    client.loop_stop()
+    client.disconnect()
+    _component_result(conn, cpu_start, dict(counts, latency_ms=np.array(latencies, dtype=np.float32)))
+
+def publisher_worker(conn, host, port, qos, index, sensors, interval, codec, batch, inflight):
+    client = _client(f'bench_pub_{index}_{random.randint(1000, 9999)}')
+    client.max_inflight_messages_set(inflight)
+    client.connect(host, port)
+    client.loop_start()
+
+    fleet = [FleetSensor(topic=f'{TOPIC_PREFIX}/p{index}s{i}', name=f'Bench {index}.{i}',
+                         ipv4=f'10.0.{index}.{i % 256}', interval=interval,
+                         simulator=SensorSimulator(), faults=False, codec=codec)
+             for i in range(sensors)]
+    codecs = {sensor.topic: get_codec(codec) for sensor in fleet}
+    batchers = {sensor.topic: FrameBatcher(batch, max_latency=1000) for sensor in fleet} if batch > 1 else {}
+    counts = {'messages': 0}
+
+    def publish(sensor, msg_dict):
+        if not batchers:
+            data = codecs[sensor.topic].encode(msg_dict)
+        else:
+            data = batchers[sensor.topic].add(msg_dict, time.monotonic())
+        if data is not None:
+            client.publish(sensor.topic, data, qos=qos)
+            counts['messages'] += 1
+
+    scheduler = FleetScheduler(fleet, publish)
+    conn.send({'ready': True})
+    duration = conn.recv()
+    cpu_start, _ = _usage()
+    scheduler.run(duration)
+    for topic, batcher in batchers.items():
+        for data in batcher.flush():
+            client.publish(topic, data, qos=qos)
+    conn.recv()
+    client.loop_stop()
+    client.disconnect()
+    _component_result(conn, cpu_start, dict(
+        counts, readings=sum(s.published for s in fleet), overruns=sum(s.overruns for s in fleet)))
+
+def _spawn(ctx, target, *args):
+    parent, child = ctx.Pipe()
+    process = ctx.Process(target=target, args=(child,) + args, daemon=True)
+    process.start()
+    return process, parent
+
+def run_case(publishers, subscribers, sensors, rate, codec, qos, duration, batch=1,
+             inflight=20, drain=1.0, broker=None):
+    """
+    Run one benchmark configuration and return its results as a dict.
+
+    Every component runs in its own process so CPU time and RSS are
+    measured per component. The broker is a fresh LocalBroker process
+    unless broker is given as (host, port).
+    """
+    ctx = multiprocessing.get_context('spawn')
+    processes, components = [], {}
+
+    if broker is None:
+        process, conn = _spawn(ctx, broker_worker)
+        host, port = '127.0.0.1', conn.recv()['port']
+        processes.append(process)
+        components['broker'] = conn
+    else:
+        host, port = broker
+
+    interval = publishers * sensors / rate
+    for i in range(subscribers):
+        process, conn = _spawn(ctx, subscriber_worker, host, port, qos, i)
+        processes.append(process)
+        components[f'subscriber_{i}'] = conn
+    for i in range(publishers):
+        process, conn = _spawn(ctx, publisher_worker, host, port, qos, i, sensors, interval,
+                               codec, batch, inflight)
+        processes.append(process)
+        components[f'publisher_{i}'] = conn
+
+    for name, conn in components.items():
+        if name != 'broker':
+            conn.recv()
+    for name, conn in components.items():
+        conn.send(duration if name.startswith('publisher') else 'start')
+    time.sleep(duration + drain)
+    for conn in components.values():
+        conn.send('stop')
+    results = {name: conn.recv() for name, conn in components.items()}
+    for process in processes:
+        process.join(5)
+
+    published = sum(r['readings'] for n, r in results.items() if n.startswith('publisher'))
+    received = sum(r['readings'] for n, r in results.items() if n.startswith('subscriber'))
+    latencies = [r.pop('latency_ms') for n, r in results.items() if n.startswith('subscriber')]
+    latencies = np.concatenate(latencies) if latencies else np.empty(0)
+    expected = published * subscribers
+    percentiles = {}
+    if len(latencies):
+        for label, q in (('p50', 50), ('p99', 99), ('p999', 99.9)):
+            percentiles[label] = round(float(np.percentile(latencies, q)), 3)
+        percentiles['max'] = round(float(latencies.max()), 3)
+
+    return {
+        'publishers': publishers, 'subscribers': subscribers, 'sensors_per_publisher': sensors,
+        'target_rate': rate, 'codec': codec, 'qos': qos, 'batch': batch, 'duration_s': duration,
+        'published': published,
+        'received': received,
+        'published_per_s': round(published / duration, 1),
+        'received_per_s': round(received / duration, 1),
+        'loss': round(1 - received / expected, 6) if expected else 0.0,
+        'latency_ms': percentiles,
+        'components': {name: {k: (round(v, 3) if isinstance(v, float) else v) for k, v in r.items()}
+                       for name, r in results.items()},
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local end-to-end throughput and latency benchmark')
+    parser.add_argument("--publishers", default=1, type=int)
+    parser.add_argument("--subscribers", default=1, type=int)
+    parser.add_argument("--sensors", help="Sensors per publisher", default=10, type=int)
+    parser.add_argument("--rates", help="Total readings per second, comma separated", default='100,1000')
+    parser.add_argument("--codecs", default='json,binary')
+    parser.add_argument("--qos", default='0,1')
+    parser.add_argument("--batch", help="Readings per frame, 1 disables batching", default=1, type=int)
+    parser.add_argument("--inflight", help="Publisher in-flight window for QoS > 0", default=20, type=int)
+    parser.add_argument("--duration", help="Seconds per run", default=5, type=float)
+    parser.add_argument("--broker", help="host:port of an external broker instead of the local one")
+    parser.add_argument("--output", help="File to write the JSON report to (default stdout)")
+    args = parser.parse_args(argv)
+
+    broker = None
+    if args.broker:
+        host, port = args.broker.rsplit(':', 1)
+        broker = (host, int(port))
+
+    runs = []
+    for rate, codec, qos in itertools.product([float(r) for r in args.rates.split(',')],
+                                              args.codecs.split(','),
+                                              [int(q) for q in args.qos.split(',')]):
+        print(f'rate={rate:g} codec={codec} qos={qos}', file=sys.stderr)
+        runs.append(run_case(args.publishers, args.subscribers, args.sensors, rate, codec, qos,
+                             args.duration, batch=args.batch, inflight=args.inflight, broker=broker))
+
+    report = {
+        'env': {'python': platform.python_version(), 'platform': platform.platform(),
+                'cpus': os.cpu_count(), 'paho': paho.mqtt.__version__},
+        'runs': runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+import argparse
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        out.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(out)
+
+def _read_varint(data, offset):
+    value, shift = 0, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+def _read_str(data, offset):
+    length = int.from_bytes(data[offset:offset + 2], 'big')
+    offset += 2
+    return data[offset:offset + length].decode(), offset + length
+
+def _str(value):
+    raw = value.encode()
+    return len(raw).to_bytes(2, 'big') + raw
+
+def _packet(kind, flags, body):
+    return bytes([kind << 4 | flags]) + _varint(len(body)) + body
+
+def topic_matches(topic_filter, topic):
+    """MQTT filter matching with '+' for one level and '#' for the rest."""
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return not topic.startswith('$') or i > 0
+        if i >= len(topic_levels):
+            return False
+        if level == '+':
+            if i == 0 and topic.startswith('$'):
+                return False
+            continue
+        if level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+class _Session:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.version = 4
+        self.subscriptions = {}
+        self.__next_id = 0
+
+    def next_packet_id(self):
+        self.__next_id = self.__next_id % 0xFFFF + 1
+        return self.__next_id
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def deliver(self, topic, payload, qos):
+        body = _str(topic)
+        if qos:
+            body += self.next_packet_id().to_bytes(2, 'big')
+        if self.version == 5:
+            body += b'\x00'
+        self.send(_packet(PUBLISH, qos << 1, body + payload))
+        self.broker.delivered += 1
+
+    async def run(self):
+        import asyncio
+
+        try:
+            while True:
+                first = await self.reader.readexactly(1)
+                length, shift = 0, 0
+                while True:
+                    byte = (await self.reader.readexactly(1))[0]
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = await self.reader.readexactly(length) if length else b''
+                if not self.handle(first[0] >> 4, first[0] & 0x0F, body):
+                    break
+                if self.writer.transport.get_write_buffer_size() > 1 << 20:
+                    await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.broker.remove(self)
+            self.writer.close()
+
+    def handle(self, kind, flags, body):
+        if kind == PUBLISH:
+            qos = (flags >> 1) & 3
+            topic, offset = _read_str(body, 0)
+            packet_id = None
+            if qos:
+                packet_id = body[offset:offset + 2]
+                offset += 2
+            if self.version == 5:
+                props, offset = _read_varint(body, offset)
+                offset += props
+            self.broker.publish(topic, body[offset:], qos)
+            if qos == 1:
+                self.send(_packet(PUBACK, 0, packet_id))
+            elif qos == 2:
+                self.send(_packet(PUBREC, 0, packet_id))
+        elif kind == PUBREL:
+            self.send(_packet(PUBCOMP, 0, body[:2]))
+        elif kind == PUBREC:
+            self.send(_packet(PUBREL, 2, body[:2]))
+        elif kind in (PUBACK, PUBCOMP):
+            pass
+        elif kind == CONNECT:
+            _, offset = _read_str(body, 0)
+            self.version = body[offset]
+            offset += 4
+            if self.version == 5:
+                props, offset = _read_varint(body, offset)
+                offset += props
+            self.client_id, _ = _read_str(body, offset)
+            self.broker.register(self)
+            self.send(_packet(CONNACK, 0, b'\x00\x00\x00' if self.version == 5 else b'\x00\x00'))
+        elif kind == SUBSCRIBE:
+            packet_id, offset = body[:2], 2
+            if self.version == 5:
+                props, offset = _read_varint(body, offset)
+                offset += props
+            granted = bytearray()
+            while offset < len(body):
+                topic_filter, offset = _read_str(body, offset)
+                qos = body[offset] & 3
+                offset += 1
+                self.broker.subscribe(self, topic_filter, qos)
+                granted.append(qos)
+            props = b'\x00' if self.version == 5 else b''
+            self.send(_packet(SUBACK, 0, packet_id + props + bytes(granted)))
+        elif kind == UNSUBSCRIBE:
+            packet_id, offset = body[:2], 2
+            if self.version == 5:
+                props, offset = _read_varint(body, offset)
+                offset += props
+            count = 0
+            while offset < len(body):
+                topic_filter, offset = _read_str(body, offset)
+                self.broker.unsubscribe(self, topic_filter)
+                count += 1
+            tail = b'\x00' + bytes(count) if self.version == 5 else b''
+            self.send(_packet(UNSUBACK, 0, packet_id + tail))
+        elif kind == PINGREQ:
+            self.send(_packet(PINGRESP, 0, b''))
+        elif kind == DISCONNECT:
+            return False
+        return True
+
+class LocalBroker:
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        Minimal in-process MQTT broker for local tests and benchmarks.
+
+        Speaks MQTT 3.1.1 and 5 with QoS 0, 1 and 2, '+' and '#' wildcards
+        and $share/<group>/ shared subscriptions (round robin). Sessions are
+        always clean and nothing is retained or retransmitted, which is
+        enough for a loopback broker and keeps it out of the measurements.
+
+        Parameters:
+        host (str): Interface to listen on.
+        port (int): Port to listen on; 0 picks a free one.
+        """
+        self.host = host
+        self.port = port
+        self.published = 0
+        self.delivered = 0
+        self.__sessions = {}
+        self.__subscriptions = {}
+        self.__shared = {}
+        self.__routes = {}
+        self.__loop = None
+        self.__server = None
+        self.__started = threading.Event()
+
+    def register(self, session):
+        old = self.__sessions.get(session.client_id)
+        if old is not None and old is not session:
+            # Same client id connecting again takes over the session
+            old.writer.close()
+            self.remove(old)
+        self.__sessions[session.client_id] = session
+
+    def remove(self, session):
+        if self.__sessions.get(session.client_id) is session:
+            del self.__sessions[session.client_id]
+        for topic_filter in list(session.subscriptions):
+            self.unsubscribe(session, topic_filter)
+
+    def subscribe(self, session, topic_filter, qos):
+        session.subscriptions[topic_filter] = qos
+        if topic_filter.startswith('$share/'):
+            _, group, real_filter = topic_filter.split('/', 2)
+            members = self.__shared.setdefault((group, real_filter), [])
+            if session not in members:
+                members.append(session)
+        else:
+            self.__subscriptions.setdefault(topic_filter, {})[session] = qos
+        self.__routes.clear()
+
+    def unsubscribe(self, session, topic_filter):
+        session.subscriptions.pop(topic_filter, None)
+        if topic_filter.startswith('$share/'):
+            _, group, real_filter = topic_filter.split('/', 2)
+            members = self.__shared.get((group, real_filter), [])
+            if session in members:
+                members.remove(session)
+            if not members:
+                self.__shared.pop((group, real_filter), None)
+        else:
+            subscribers = self.__subscriptions.get(topic_filter, {})
+            subscribers.pop(session, None)
+            if not subscribers:
+                self.__subscriptions.pop(topic_filter, None)
+        self.__routes.clear()
+
+    def __route(self, topic):
+        # Matching filters are worked out once per topic and cached until
+        # the subscriptions change
+        route = self.__routes.get(topic)
+        if route is None:
+            direct = {}
+            for topic_filter, subscribers in self.__subscriptions.items():
+                if topic_matches(topic_filter, topic):
+                    for session, qos in subscribers.items():
+                        direct[session] = max(direct.get(session, 0), qos)
+            shared = [key for key in self.__shared if topic_matches(key[1], topic)]
+            route = self.__routes[topic] = (list(direct.items()), shared)
+        return route
+
+    def publish(self, topic, payload, qos):
+        self.published += 1
+        direct, shared = self.__route(topic)
+        for session, sub_qos in direct:
+            session.deliver(topic, payload, min(qos, sub_qos))
+        for key in shared:
+            members = self.__shared.get(key)
+            if members:
+                members.append(members.pop(0))
+                session = members[-1]
+                session.deliver(topic, payload, min(qos, session.subscriptions.get(f'$share/{key[0]}/{key[1]}', 0)))
+
+    async def __serve(self):
+        import asyncio
+
+        async def on_client(reader, writer):
+            await _Session(self, reader, writer).run()
+
+        self.__loop = asyncio.get_running_loop()
+        self.__server = await asyncio.start_server(on_client, self.host, self.port)
+        self.port = self.__server.sockets[0].getsockname()[1]
+        self.__started.set()
+        async with self.__server:
+            try:
+                await self.__server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def serve_forever(self):
+        # topic_matches is used well beyond the broker, so asyncio is only
+        # imported once a broker actually runs
+        import asyncio
+
+        asyncio.run(self.__serve())
+
+    def start(self):
+        """Run the broker on a background thread, returning once it listens."""
+        threading.Thread(target=self.serve_forever, name='broker', daemon=True).start()
+        self.__started.wait()
+        return self
+
+    def stop(self):
+        if self.__loop is not None and self.__server is not None:
+            self.__loop.call_soon_threadsafe(self.__close)
+
+    def __close(self):
+        self.__server.close()
+        for session in list(self.__sessions.values()):
+            session.writer.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Minimal local MQTT broker')
+    parser.add_argument("--host", default='127.0.0.1', type=str)
+    parser.add_argument("--port", default=1883, type=int)
+    args = parser.parse_args()
+    broker = LocalBroker(args.host, args.port)
+    logger.info('Listening on %s:%d', args.host, args.port)
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
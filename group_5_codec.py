@@ -0,0 +1,423 @@
+import json
+import time
+import socket
+import struct
+import threading
+
+# Binary payloads start with this byte; JSON payloads always start with '{'
+# or whitespace, so the subscriber can tell them apart from the first byte.
+MAGIC = 0xB5
+
+KIND_READING = 0x01
+KIND_FRAME = 0x02
+FLAG_META = 0x80
+
+HEADER = struct.Struct('<BBH')      # magic, kind, sensor id
+META = struct.Struct('<4sdIB')      # ipv4, interval, run id, name length
+READING = struct.Struct('<QdIQ')        # packetId, temp, seq, sentAt in us
+FRAME_HEAD = struct.Struct('<HQdIQ')    # reading count, then the first reading
+
+class CodecError(ValueError):
+    """Raised when a payload cannot be encoded or decoded."""
+
+def _instrumentation(msg_dict):
+    # Readings from older publishers carry no seq or sentAt
+    seq = msg_dict.get('seq', 0)
+    sent_us = int(round(msg_dict.get('sentAt', msg_dict['packetId'] / 1000) * 1e6))
+    return seq, sent_us
+
+class JsonCodec:
+    """The original indented, key-sorted JSON payload."""
+    name = 'json'
+
+    def encode(self, msg_dict):
+        return json.dumps(msg_dict, indent=4, sort_keys=True, default=str).encode()
+
+class CompactJsonCodec:
+    """JSON without indentation or key sorting."""
+    name = 'compact'
+
+    def encode(self, msg_dict):
+        return json.dumps(msg_dict, separators=(',', ':'), default=str).encode()
+
+class BinaryCodec:
+    def __init__(self, meta_every=100):
+        """
+        Fixed-layout binary payload with interned sensor metadata.
+
+        A reading is a 4 byte header (magic, kind, sensor id) followed by the
+        packetId, temperature, sequence number and send time, 32 bytes in
+        all. Name, IPv4, interval and run id are
+        inserted after the header on the first payload of each sensor,
+        whenever they change, and every meta_every payloads so late
+        subscribers can pick them up.
+
+        Parameters:
+        meta_every (int): Payloads between repeated metadata.
+        """
+        self.meta_every = meta_every
+        self.__ids = {}
+        self.__since_meta = {}
+
+    def _header(self, msg_dict, kind):
+        """Return the header, with a metadata block when one is due."""
+        meta = (msg_dict['name'], msg_dict['ipv4'], float(msg_dict['interval']), msg_dict.get('run', 0))
+        sensor_id = self.__ids.setdefault(meta[:2], len(self.__ids))
+        if sensor_id > 0xFFFF:
+            raise CodecError('Too many sensors for one binary codec')
+
+        last_meta, count = self.__since_meta.get(sensor_id, (None, 0))
+        if last_meta == meta and count < self.meta_every:
+            self.__since_meta[sensor_id] = (meta, count + 1)
+            return HEADER.pack(MAGIC, kind, sensor_id)
+
+        self.__since_meta[sensor_id] = (meta, 1)
+        name = meta[0].encode()
+        try:
+            ipv4 = socket.inet_aton(meta[1])
+        except OSError as e:
+            raise CodecError(f'Invalid IPv4 address: {meta[1]}') from e
+        return (HEADER.pack(MAGIC, kind | FLAG_META, sensor_id)
+                + META.pack(ipv4, meta[2], meta[3], len(name)) + name)
+
+    def encode(self, msg_dict):
+        return self._header(msg_dict, KIND_READING) + READING.pack(
+            msg_dict['packetId'], msg_dict['temp'], *_instrumentation(msg_dict))
+
+class _BitWriter:
+    def __init__(self):
+        self.__buf = bytearray()
+        self.__acc = 0
+        self.__bits = 0
+
+    def write(self, value, nbits):
+        self.__acc = (self.__acc << nbits) | value
+        self.__bits += nbits
+        while self.__bits >= 8:
+            self.__bits -= 8
+            self.__buf.append(self.__acc >> self.__bits)
+            self.__acc &= (1 << self.__bits) - 1
+
+    def getvalue(self):
+        if self.__bits:
+            return bytes(self.__buf) + bytes([self.__acc << (8 - self.__bits)])
+        return bytes(self.__buf)
+
+class _BitReader:
+    def __init__(self, data):
+        self.__data = data
+        self.__pos = 0
+        self.__acc = 0
+        self.__bits = 0
+
+    def read(self, nbits):
+        # Only the bytes a read needs join the accumulator, so a read costs
+        # the same wherever it is in the frame
+        if self.__bits < nbits:
+            need = (nbits - self.__bits + 7) // 8
+            end = self.__pos + need
+            if end > len(self.__data):
+                raise CodecError('Frame bit stream is truncated')
+            self.__acc = (self.__acc << (8 * need)) | int.from_bytes(self.__data[self.__pos:end], 'big')
+            self.__pos = end
+            self.__bits += 8 * need
+        self.__bits -= nbits
+        value = self.__acc >> self.__bits
+        self.__acc &= (1 << self.__bits) - 1
+        return value
+
+# Delta-of-delta buckets for timestamps, as in Gorilla: (prefix, prefix
+# length, value bits). A zero delta-of-delta is the single bit '0'. The
+# small buckets store the value offset to be non-negative, the last one
+# stores it in two's complement.
+_DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12), (0b1111, 4, 64))
+
+_DOUBLE = struct.Struct('<d')
+_DOUBLE_BITS = struct.Struct('<Q')
+
+def _float_bits(value):
+    return _DOUBLE_BITS.unpack(_DOUBLE.pack(value))[0]
+
+def _bits_float(bits):
+    return _DOUBLE.unpack(_DOUBLE_BITS.pack(bits))[0]
+
+def _write_dod(writer, dod):
+    if dod == 0:
+        writer.write(0, 1)
+        return
+    for prefix, prefix_len, nbits in _DOD_BUCKETS:
+        offset = (1 << (nbits - 1)) - 1 if nbits < 64 else 0
+        if nbits == 64 or -offset <= dod <= offset + 1:
+            writer.write(prefix, prefix_len)
+            writer.write((dod + offset) & ((1 << nbits) - 1), nbits)
+            return
+
+def _read_dod(reader):
+    if not reader.read(1):
+        return 0
+    prefix_len, prefix = 1, 1
+    for bucket_prefix, bucket_len, nbits in _DOD_BUCKETS:
+        while prefix_len < bucket_len:
+            prefix = (prefix << 1) | reader.read(1)
+            prefix_len += 1
+        if prefix == bucket_prefix:
+            dod = reader.read(nbits)
+            if nbits < 64:
+                return dod - ((1 << (nbits - 1)) - 1)
+            return dod - (1 << 64) if dod >= 1 << 63 else dod
+
+def encode_frame_body(columns, temps):
+    """
+    Compress a run of readings into a bit stream.
+
+    The first value of every column is stored in FRAME_HEAD. After that,
+    each reading stores a delta-of-delta for every integer column
+    (timestamp, sequence number, send time), then its temperature XORed with
+    the previous one, keeping only the meaningful bits (Gorilla encoding).
+
+    Parameters:
+    columns (list): Equal-length lists of integers.
+    temps (list): Temperatures, one per reading.
+    """
+    writer = _BitWriter()
+    prev = [[column[0], 0] for column in columns]
+    prev_bits = _float_bits(temps[0])
+    prev_lead, prev_trail = 65, 65
+
+    for i in range(1, len(temps)):
+        for column, state in zip(columns, prev):
+            delta = column[i] - state[0]
+            _write_dod(writer, delta - state[1])
+            state[0], state[1] = column[i], delta
+
+        bits = _float_bits(temps[i])
+        xor = bits ^ prev_bits
+        prev_bits = bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if lead >= prev_lead and trail >= prev_trail:
+            writer.write(0b10, 2)
+            writer.write(xor >> prev_trail, 64 - prev_lead - prev_trail)
+        else:
+            meaningful = 64 - lead - trail
+            writer.write(0b11, 2)
+            writer.write(lead, 5)
+            writer.write(meaningful & 63, 6)
+            writer.write(xor >> trail, meaningful)
+            prev_lead, prev_trail = lead, trail
+    return writer.getvalue()
+
+def decode_frame_body(count, firsts, first_temp, body):
+    """Reverse encode_frame_body, returning (columns, temps)."""
+    reader = _BitReader(body)
+    columns = [[first] for first in firsts]
+    prev = [[first, 0] for first in firsts]
+    temps = [first_temp]
+    prev_bits = _float_bits(first_temp)
+    prev_lead, prev_trail = 0, 0
+
+    for _ in range(count - 1):
+        for column, state in zip(columns, prev):
+            state[1] += _read_dod(reader)
+            state[0] += state[1]
+            column.append(state[0])
+
+        if reader.read(1):
+            if reader.read(1):
+                prev_lead = reader.read(5)
+                meaningful = reader.read(6) or 64
+                prev_trail = 64 - prev_lead - meaningful
+            prev_bits ^= reader.read(64 - prev_lead - prev_trail) << prev_trail
+        temps.append(_bits_float(prev_bits))
+    return columns, temps
+
+class FrameBatcher:
+    def __init__(self, max_readings=32, max_latency=1000, meta_every=10):
+        """
+        Pack several readings of each sensor into one compressed frame.
+
+        A sensor's frame is closed once it holds max_readings readings, or
+        when waiting for the next reading would hold the first one back for
+        more than max_latency milliseconds. If the next reading never comes,
+        because the sensor stopped or skipped a slot, flush_due closes the
+        frame once it is due; FrameFlusher calls it on a timer. Safe to use
+        from several threads.
+
+        Parameters:
+        max_readings (int): Readings per frame, at most 65535.
+        max_latency (float): Longest time in ms a reading may wait in a frame.
+        meta_every (int): Frames between repeated metadata.
+        """
+        self.max_readings = min(max_readings, 0xFFFF)
+        self.max_latency = max_latency
+        self.__codec = BinaryCodec(meta_every=meta_every)
+        self.__pending = {}
+        self.__lock = threading.Lock()
+
+    def add(self, msg_dict, now):
+        """
+        Queue a reading, returning a frame payload if this closed one.
+
+        Parameters:
+        msg_dict (dict): The reading, as the publisher builds it.
+        now (float): Current monotonic time in seconds.
+        """
+        with self.__lock:
+            return self.__add(msg_dict, now)
+
+    def __add(self, msg_dict, now):
+        key = (msg_dict['name'], msg_dict['ipv4'])
+        pending = self.__pending.get(key)
+        payload = None
+        if pending is not None and pending[1] != msg_dict['interval']:
+            payload = self.__close(key)
+            pending = None
+        if pending is None:
+            pending = self.__pending[key] = [now, msg_dict['interval'], []]
+        pending[2].append(msg_dict)
+
+        waited = (now - pending[0] + pending[1]) * 1000
+        if len(pending[2]) >= self.max_readings or waited > self.max_latency:
+            return self.__close(key)
+        return payload
+
+    def flush(self):
+        """Close every open frame, returning their payloads."""
+        with self.__lock:
+            return [self.__close(key) for key in list(self.__pending)]
+
+    def next_due(self):
+        """Monotonic time the oldest open frame is due by, or None."""
+        with self.__lock:
+            first = min((pending[0] for pending in self.__pending.values()), default=None)
+        return None if first is None else first + self.max_latency / 1000
+
+    def flush_due(self, now):
+        """Close every frame whose first reading has waited max_latency, returning their payloads."""
+        with self.__lock:
+            due = now - self.max_latency / 1000
+            return [self.__close(key) for key, pending in list(self.__pending.items()) if pending[0] <= due]
+
+    def __close(self, key):
+        readings = self.__pending.pop(key)[2]
+        instrumentation = [_instrumentation(m) for m in readings]
+        columns = [[m['packetId'] for m in readings],
+                   [seq for seq, _ in instrumentation],
+                   [sent for _, sent in instrumentation]]
+        temps = [float(m['temp']) for m in readings]
+        return (self.__codec._header(readings[0], KIND_FRAME)
+                + FRAME_HEAD.pack(len(readings), columns[0][0], temps[0], columns[1][0], columns[2][0])
+                + encode_frame_body(columns, temps))
+
+class FrameFlusher:
+    def __init__(self, batchers, send):
+        """
+        Send frames that are due from a background thread, so a reading
+        never waits longer than max_latency for a sensor's next one.
+
+        Parameters:
+        batchers (dict): Topic to FrameBatcher.
+        send (callable): Called as send(topic, payload) for each frame.
+        """
+        self.batchers = batchers
+        self.send = send
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='frames', daemon=True)
+
+    def start(self):
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
+
+    def __run(self):
+        # A frame opened now is due max_latency from now at the soonest
+        idle = min(batcher.max_latency for batcher in self.batchers.values()) / 1000 if self.batchers else 1.0
+        timeout = idle
+        while not self.__stop.wait(timeout):
+            now = time.monotonic()
+            for topic, batcher in self.batchers.items():
+                for data in batcher.flush_due(now):
+                    self.send(topic, data)
+            due = [d for d in (batcher.next_due() for batcher in self.batchers.values()) if d is not None]
+            timeout = max(min(due) - time.monotonic(), 0.001) if due else idle
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    CompactJsonCodec.name: CompactJsonCodec,
+    'binary': BinaryCodec,
+}
+
+def get_codec(name):
+    """Return a new encoder for the codec registered under name."""
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise CodecError(f'Unknown codec: {name}') from None
+
+class PayloadDecoder:
+    def __init__(self):
+        """
+        Decode payloads from any registered codec.
+
+        The format is detected from the first byte. Binary metadata is kept
+        per topic, so sensor ids from different publishers never collide.
+        """
+        self.__meta = {}
+
+    def decode(self, topic, payload):
+        """Return the list of message dicts carried by one payload."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if not payload:
+            raise CodecError('Empty payload')
+        if payload[0] == MAGIC:
+            return self.__decode_binary(topic, payload)
+        try:
+            return [json.loads(payload)]
+        except ValueError as e:
+            raise CodecError(f'Unable to decode JSON payload: {e}') from e
+
+    def __decode_binary(self, topic, payload):
+        try:
+            _, kind, sensor_id = HEADER.unpack_from(payload)
+            offset = HEADER.size
+            if kind & FLAG_META:
+                ipv4, interval, run, name_len = META.unpack_from(payload, offset)
+                offset += META.size
+                name = payload[offset:offset + name_len].decode()
+                offset += name_len
+                self.__meta[topic, sensor_id] = (name, socket.inet_ntoa(ipv4), interval, run)
+                kind &= ~FLAG_META
+
+            if kind == KIND_READING:
+                packet_id, temp, seq, sent_us = READING.unpack_from(payload, offset)
+                columns, temps = [[packet_id], [seq], [sent_us]], [temp]
+            elif kind == KIND_FRAME:
+                count, first_ts, first_temp, first_seq, first_sent = FRAME_HEAD.unpack_from(payload, offset)
+                columns, temps = decode_frame_body(
+                    count, (first_ts, first_seq, first_sent), first_temp, payload[offset + FRAME_HEAD.size:])
+            else:
+                raise CodecError(f'Unknown binary payload kind: {kind}')
+        except (struct.error, UnicodeDecodeError) as e:
+            raise CodecError(f'Malformed binary payload: {e}') from e
+
+        try:
+            name, ipv4, interval, run = self.__meta[topic, sensor_id]
+        except KeyError:
+            raise CodecError(f'No metadata yet for sensor {sensor_id} on {topic}') from None
+        return [{
+            "packetId": packet_id,
+            "name": name,
+            "ipv4": ipv4,
+            "temp": temp,
+            "interval": interval,
+            "seq": seq,
+            "run": run,
+            "sentAt": sent_us / 1e6
+        } for packet_id, seq, sent_us, temp in zip(*columns, temps)]
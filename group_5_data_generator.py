@@ -1,7 +1,13 @@
 import random
-import matplotlib.pyplot as plt
+
+# Below this many sensors the batch walk is run row by row on plain floats,
+# which beats issuing several numpy calls per time step for a tiny column.
+_ROW_WALK_THRESHOLD = 8
 
 class SensorSimulator:
+    # Parameters whose sign flips at every cycle reset
+    PHASED = ('delta', 'min_step', 'max_step')
+
     def __init__(self, min_value=18.0, max_value=21.0, noise_level=0.2, base_value=18.5, 
                  min_step=0, max_step=0.6, delta=0.08, min_cycle=1, max_cycle=4, 
                  squiggle=False, seed=None):
@@ -30,20 +36,20 @@ class SensorSimulator:
         self.delta = delta
         self.min_cycle = min_cycle
         self.max_cycle = max_cycle
-        self.cycle = random.randint(self.min_cycle, self.max_cycle)
+        # Every draw comes from this generator, so simulators sharing a
+        # process neither disturb nor depend on each other
+        self.rng = random.Random(seed)
+        self.cycle = self.rng.randint(self.min_cycle, self.max_cycle)
         self.half_cycle = self.cycle / 2
         self.squiggle = squiggle
-        
-        if seed is not None:
-            random.seed(seed)
 
     def _generate_normalized_value(self):
         """Generate a normalized value with randomness and noise."""
-        return random.random()
+        return self.rng.random()
 
     def _apply_noise(self, value):
         """Apply noise to the generated value."""
-        return value + (random.uniform(-1, 1) * self.noise_level)
+        return value + (self.rng.uniform(-1, 1) * self.noise_level)
 
     def _clip_value(self, value):
         """Ensure the value stays within the defined range."""
@@ -56,12 +62,17 @@ class SensorSimulator:
 
     def _reset_cycle(self):
         """Reset cycle and adjust parameters for next value generation."""
-        self.cycle = random.randint(self.min_cycle, self.max_cycle)
+        self.cycle = self.rng.randint(self.min_cycle, self.max_cycle)
         self.half_cycle = self.cycle / 2
         self.delta *= -1
         self.min_step *= -1
         self.max_step *= -1
 
+    @property
+    def phase(self):
+        """1 while the walk is in its rising half cycle, -1 in its falling one."""
+        return -1 if (self.delta or self.max_step) < 0 else 1
+
     @property
     def value(self):
         """Generate the sensor value based on the algorithm."""
@@ -79,12 +90,49 @@ class SensorSimulator:
 
         return self.base_value
 
+    def snapshot(self):
+        """
+        Capture the full state of the simulator, its generator included.
+
+        Returns:
+        dict: Picklable state to pass to restore.
+        """
+        state = {key: value for key, value in vars(self).items() if key != 'rng'}
+        state['rng'] = self.rng.getstate()
+        return state
+
+    def restore(self, state):
+        """Return to a state captured by snapshot; the same values follow."""
+        state = dict(state)
+        self.rng.setstate(state.pop('rng'))
+        vars(self).update(state)
+
     def generate_data(self, num_points=200):
         """Generate a list of sensor values."""
         return [self.value for _ in range(num_points)]
 
+    def generate_batch(self, num_points=200, rng=None):
+        """
+        Generate num_points values in one vectorized pass.
+
+        Uses the same cycle, step, squiggle, clip and noise rules as the value
+        property and leaves the simulator in the state it would be in after
+        num_points calls to it, so batch and scalar generation can be mixed.
+
+        Parameters:
+        num_points (int): Number of values to generate.
+        rng (numpy.random.Generator or int): Generator or seed for the draws;
+            by default seeded from the simulator's own generator.
+
+        Returns:
+        numpy.ndarray: Array of shape (num_points,).
+        """
+        return generate_matrix([self], num_points, rng=rng)[0]
+
     def plot_data(self, data):
         """Plot the generated sensor data."""
+        import matplotlib.pyplot as plt
+
         plt.plot(data)
         plt.title('Simulated Sensor Data')
         plt.xlabel('Time')
@@ -92,9 +140,260 @@ class SensorSimulator:
         plt.grid(True)
         plt.show()
 
-# Example usage
+def generate_matrix(sensors, num_points=200, rng=None):
+    """
+    Generate a sensors x time matrix of values for many simulators at once.
+
+    Every random draw for the whole batch is made up front, the cycle
+    schedule and increments are computed with array operations, and only the
+    clipped running sum is stepped through time. Each simulator's state is
+    advanced exactly as num_points calls to its value property would.
+
+    Parameters:
+    sensors (list): SensorSimulator instances, one per row.
+    num_points (int): Number of values to generate per sensor.
+    rng (numpy.random.Generator or int): Generator or seed for the draws;
+        by default seeded from every simulator's own generator, so seeded
+        simulators give the same batch every time.
+
+    Returns:
+    numpy.ndarray: Array of shape (len(sensors), num_points).
+    """
+    # numpy is only loaded by the batch paths, so importing the simulator
+    # costs the standard library alone
+    import numpy as np
+
+    if rng is None and sensors:
+        rng = [sensor.rng.getrandbits(64) for sensor in sensors]
+    rng = np.random.default_rng(rng)
+    num_sensors = len(sensors)
+    if num_sensors == 0 or num_points <= 0:
+        return np.empty((num_sensors, max(num_points, 0)))
+
+    def column(attr, dtype=float):
+        return np.array([getattr(s, attr) for s in sensors], dtype=dtype)
+
+    min_value, max_value = column('min_value'), column('max_value')
+    noise_level, base_value = column('noise_level'), column('base_value')
+    delta, min_step, max_step = column('delta'), column('min_step'), column('max_step')
+    min_cycle, max_cycle = column('min_cycle', int), column('max_cycle', int)
+    cycle, half_cycle = column('cycle', int), column('half_cycle')
+    squiggle = column('squiggle', bool)
+
+    # Phase 0 is the remainder of the current cycle: the counter still has
+    # `cycle` decrements to go before it drops below zero. Every later phase
+    # starts on a reset to a fresh randint(min_cycle, max_cycle) counter and
+    # lasts counter + 1 steps, so at least min_cycle + 1 steps.
+    num_phases = num_points // (max(int(min_cycle.min()), 0) + 1) + 2
+    new_cycles = rng.integers(min_cycle[:, None], max_cycle[:, None] + 1,
+                              size=(num_sensors, num_phases - 1))
+    phase_len = np.concatenate([np.maximum(cycle, 0)[:, None], new_cycles + 1], axis=1)
+    phase_top = np.concatenate([(cycle - 1)[:, None], new_cycles], axis=1)
+    phase_half = np.concatenate([half_cycle[:, None], new_cycles / 2], axis=1)
+    phase_end = np.cumsum(phase_len, axis=1)
+    phase_start = phase_end - phase_len
+
+    # Mark every phase start that falls inside the batch, then a running sum
+    # gives the phase index of each time step.
+    marks = np.zeros((num_sensors, num_points + 1), dtype=np.int64)
+    rows, cols = np.nonzero(phase_start[:, 1:] <= num_points)
+    np.add.at(marks, (rows, phase_start[rows, cols + 1]), 1)
+    phase = np.cumsum(marks[:, :num_points], axis=1)
+
+    row = np.arange(num_sensors)[:, None]
+    steps = np.arange(num_points)[None, :]
+    counter = phase_top[row, phase] - (steps - phase_start[row, phase])
+    sign = np.where(phase % 2 == 0, 1.0, -1.0)
+
+    # Signs flip on every reset, and the increment is clamped against the
+    # flipped step bounds exactly as _adjust_increment does.
+    step_lo = sign * min_step[:, None]
+    step_hi = sign * max_step[:, None]
+    normalized = rng.random((num_sensors, num_points))
+    increment = normalized * (sign * delta[:, None]) * 5 + step_lo
+    increment = np.minimum(np.maximum(increment, step_lo), step_hi)
+    flip = squiggle[:, None] & (counter == phase_half[row, phase])
+    increment[flip] *= -1
+    noise = rng.uniform(-1, 1, (num_sensors, num_points)) * noise_level[:, None]
+
+    values = _clipped_walk(base_value, increment, noise, min_value, max_value)
+
+    last_phase = phase[:, -1]
+    last_sign = sign[:, -1]
+    for i, sensor in enumerate(sensors):
+        sensor.base_value = float(values[i, -1])
+        sensor.cycle = int(counter[i, -1])
+        sensor.half_cycle = float(phase_half[i, last_phase[i]])
+        if last_sign[i] < 0:
+            sensor.delta *= -1
+            sensor.min_step *= -1
+            sensor.max_step *= -1
+    return values
+
+def _clipped_walk(start, increment, noise, min_value, max_value):
+    """Run base = clip(base + increment) + noise along the time axis."""
+    import numpy as np
+
+    num_sensors, num_points = increment.shape
+    values = np.empty_like(increment)
+    if num_sensors <= _ROW_WALK_THRESHOLD:
+        for i in range(num_sensors):
+            lo, hi = float(min_value[i]), float(max_value[i])
+            current = float(start[i])
+            row = []
+            append = row.append
+            for inc, nz in zip(increment[i].tolist(), noise[i].tolist()):
+                current += inc
+                if current > hi:
+                    current = hi
+                if current < lo:
+                    current = lo
+                current += nz
+                append(current)
+            values[i] = row
+        return values
+
+    current = start.copy()
+    for t in range(num_points):
+        np.add(current, increment[:, t], out=current)
+        np.minimum(current, max_value, out=current)
+        np.maximum(current, min_value, out=current)
+        np.add(current, noise[:, t], out=current)
+        values[:, t] = current
+    return values
+
+def write_trace(path, sensors, num_points, chunk=65536, rng=None):
+    """
+    Precompute num_points values per simulator into a memory-mappable file.
+
+    The file is a .npy array of shape (num_points, len(sensors)), one
+    column per simulator, so a time step of the whole fleet is contiguous.
+    It is filled chunk time steps at a time with generate_matrix, so memory
+    use does not depend on the length of the trace.
+
+    Parameters:
+    path (str): File to write.
+    sensors (list): SensorSimulator instances, one per column.
+    num_points (int): Values per simulator.
+    chunk (int): Time steps generated at a time.
+    rng (numpy.random.Generator or int): Generator or seed for the draws;
+        by default seeded from the simulators' own generators.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(rng) if rng is not None else None
+    trace = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                      shape=(num_points, len(sensors)))
+    for start in range(0, num_points, chunk):
+        count = min(chunk, num_points - start)
+        trace[start:start + count] = generate_matrix(sensors, count, rng).T
+    trace.flush()
+    del trace
+
+class TracePlayer:
+    def __init__(self, path, column=0, loop=True, block=4096):
+        """
+        Play one column of a trace written by write_trace.
+
+        Has the value property of SensorSimulator, so it can stand in for
+        one, but every value is a precomputed float: the file is memory-
+        mapped and read block values at a time, so playing is a list index
+        per value whatever the length of the trace.
+
+        Parameters:
+        path (str): Trace file.
+        column (int): Simulator column to play.
+        loop (bool): Start over at the end of the trace instead of stopping.
+        block (int): Values read from the file at a time.
+        """
+        import numpy as np
+
+        self.path = path
+        self.column = column
+        self.loop = loop
+        self.position = 0
+        self.__trace = np.load(path, mmap_mode='r')
+        if not 0 <= column < self.__trace.shape[1]:
+            raise ValueError(f'Trace {path} has no column {column}')
+        self.__block = block
+        self.__values = []
+        self.__index = 0
+
+    def __len__(self):
+        return self.__trace.shape[0]
+
+    def read(self, count):
+        """
+        The next count values as an array, moving the position on.
+
+        Raises:
+        StopIteration: The trace ended and loop is off.
+        """
+        import numpy as np
+
+        parts = []
+        while count > 0:
+            if self.position >= len(self):
+                if not self.loop or len(self) == 0:
+                    raise StopIteration('End of trace')
+                self.position = 0
+            part = self.__trace[self.position:self.position + count, self.column]
+            parts.append(part)
+            self.position += len(part)
+            count -= len(part)
+        # Values already buffered for the value property are skipped
+        self.__values = []
+        self.__index = 0
+        return np.concatenate(parts) if parts else np.empty(0)
+
+    @property
+    def value(self):
+        if self.__index >= len(self.__values):
+            self.__values = self.read(self.__block).tolist()
+            self.__index = 0
+        value = self.__values[self.__index]
+        self.__index += 1
+        return value
+
 if __name__ == "__main__":
-    sensor = SensorSimulator(seed=42)
-    data = sensor.generate_data(num_points=500)
-    sensor.plot_data(data)
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Plot simulated data, or precompute a trace file')
+    parser.add_argument("--trace", help="Write a trace to this .npy file instead of plotting")
+    parser.add_argument("--config", help="Fleet config whose simulators the trace columns follow")
+    parser.add_argument("--sensors", help="Simulators with default parameters, without --config", default=1, type=int)
+    parser.add_argument("--points", help="Values per simulator", default=100000, type=int)
+    parser.add_argument("--seed", default=42, type=int)
+    args = parser.parse_args()
+
+    if not args.trace:
+        # Example usage
+        sensor = SensorSimulator(seed=args.seed)
+        data = sensor.generate_data(num_points=500)
+        sensor.plot_data(data)
+    else:
+        if args.config:
+            from group_5_fleet import load_fleet
+            simulators = [sensor.simulator for sensor in load_fleet(args.config, seed=args.seed)[1]]
+        else:
+            simulators = [SensorSimulator(seed=args.seed + i) for i in range(args.sensors)]
+        start = time.perf_counter()
+        write_trace(args.trace, simulators, args.points)
+        written = time.perf_counter() - start
+
+        # Playback against generating the same number of values live
+        player = TracePlayer(args.trace)
+        count = min(args.points, 1000000)
+        start = time.perf_counter()
+        for _ in range(count):
+            player.value
+        played = time.perf_counter() - start
+        live = SensorSimulator(seed=args.seed)
+        start = time.perf_counter()
+        for _ in range(count):
+            live.value
+        generated = time.perf_counter() - start
+        print(f'Wrote {args.points} x {len(simulators)} values in {written:.2f}s; '
+              f'playback {count / played:,.0f}/s, live generation {count / generated:,.0f}/s')
 
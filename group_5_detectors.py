@@ -0,0 +1,346 @@
+import json
+import math
+import time
+import heapq
+import argparse
+import tracemalloc
+from collections import deque
+
+from group_5_broker import topic_matches
+
+class RangeDetector:
+    __slots__ = ('low', 'high')
+
+    def __init__(self, low=-40, high=40):
+        """
+        Flag readings outside a fixed plausible range.
+
+        Parameters:
+        low (float): Lowest plausible temperature.
+        high (float): Highest plausible temperature.
+        """
+        self.low = low
+        self.high = high
+
+    def update(self, ts, value):
+        if value < self.low or value > self.high:
+            return f'outside {self.low:g}..{self.high:g}'
+        return None
+
+class ZScoreDetector:
+    __slots__ = ('alpha', 'threshold', 'warmup', 'min_std', 'rebaseline', 'mean', 'var', 'count', 'flagged')
+
+    def __init__(self, alpha=0.05, threshold=6, warmup=20, min_std=0.1, rebaseline=10):
+        """
+        Flag readings far from an exponentially weighted mean.
+
+        Mean and variance are updated incrementally (Welford's method with
+        exponential forgetting), so each reading costs a handful of float
+        operations and the state is three numbers. Flagged readings do not
+        update the estimates, so a spike cannot widen its own threshold;
+        after `rebaseline` flagged readings in a row the level has really
+        moved, and the mean restarts from the latest reading, keeping the
+        variance, so a step change is flagged for a moment and not forever.
+
+        Parameters:
+        alpha (float): Weight of each new reading; about 2 / alpha readings
+            make up the estimate.
+        threshold (float): Standard deviations from the mean that are anomalous.
+        warmup (int): Readings seen before anything is flagged.
+        min_std (float): Floor on the standard deviation, so a sensor that
+            has been flat does not flag the smallest move.
+        rebaseline (int): Flagged readings in a row after which the mean
+            moves to the new level.
+        """
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.min_std = min_std
+        self.rebaseline = rebaseline
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+        self.flagged = 0
+
+    def update(self, ts, value):
+        if self.count == 0:
+            self.mean = value
+            self.count = 1
+            return None
+        diff = value - self.mean
+        if self.count >= self.warmup:
+            std = max(math.sqrt(self.var), self.min_std)
+            if abs(diff) > self.threshold * std:
+                self.flagged += 1
+                if self.flagged >= self.rebaseline:
+                    self.mean = value
+                    self.flagged = 0
+                return f'z-score {diff / std:+.1f}'
+        self.flagged = 0
+        incr = self.alpha * diff
+        self.mean += incr
+        self.var = (1 - self.alpha) * (self.var + diff * incr)
+        self.count += 1
+        return None
+
+class RollingMedian:
+    def __init__(self, window):
+        """
+        Median of the last `window` values, kept in two heaps.
+
+        The lower half is a max-heap and the upper half a min-heap. Values
+        leaving the window are deleted lazily: they are marked and dropped
+        when they reach the top of their heap, and a heap that fills up with
+        marked entries is rebuilt, so memory stays proportional to window.
+        Adding a value is O(log window).
+        """
+        self.window = window
+        self.__values = deque()
+        self.__low = []     # (-value, -index), so the top is the largest
+        self.__high = []    # (value, index)
+        self.__low_size = 0
+        self.__high_size = 0
+        self.__expired = set()
+        self.__index = 0
+
+    def __len__(self):
+        return len(self.__values)
+
+    def __prune(self, heap):
+        while heap and abs(heap[0][1]) in self.__expired:
+            self.__expired.discard(abs(heap[0][1]))
+            heapq.heappop(heap)
+
+    def __low_top(self):
+        self.__prune(self.__low)
+        value, index = self.__low[0]
+        return -value, -index
+
+    def add(self, value):
+        item = (value, self.__index)
+        self.__index += 1
+        self.__values.append(item)
+        if self.__low_size and item > self.__low_top():
+            heapq.heappush(self.__high, item)
+            self.__high_size += 1
+        else:
+            heapq.heappush(self.__low, (-value, -item[1]))
+            self.__low_size += 1
+
+        if len(self.__values) > self.window:
+            old = self.__values.popleft()
+            if self.__low_size and old <= self.__low_top():
+                self.__low_size -= 1
+            else:
+                self.__high_size -= 1
+            self.__expired.add(old[1])
+        self.__rebalance()
+        if len(self.__low) + len(self.__high) > 2 * self.window + 8:
+            self.__rebuild()
+
+    def __rebalance(self):
+        while self.__low_size > self.__high_size + 1:
+            value, index = self.__low_top()
+            heapq.heappop(self.__low)
+            heapq.heappush(self.__high, (value, index))
+            self.__low_size -= 1
+            self.__high_size += 1
+        while self.__high_size > self.__low_size:
+            self.__prune(self.__high)
+            value, index = heapq.heappop(self.__high)
+            heapq.heappush(self.__low, (-value, -index))
+            self.__high_size -= 1
+            self.__low_size += 1
+
+    def __rebuild(self):
+        items = sorted(self.__values)
+        half = (len(items) + 1) // 2
+        self.__low = [(-value, -index) for value, index in items[:half]]
+        self.__high = items[half:]
+        heapq.heapify(self.__low)
+        heapq.heapify(self.__high)
+        self.__low_size, self.__high_size = len(self.__low), len(self.__high)
+        self.__expired.clear()
+
+    @property
+    def median(self):
+        if not self.__values:
+            return None
+        low = self.__low_top()[0]
+        if self.__low_size > self.__high_size:
+            return low
+        self.__prune(self.__high)
+        return (low + self.__high[0][0]) / 2
+
+class MadDetector:
+    __slots__ = ('threshold', 'warmup', 'min_mad', 'values', 'deviations')
+    # Scales the MAD to a standard deviation for normally distributed data
+    MAD_SCALE = 1.4826
+
+    def __init__(self, window=51, threshold=6, warmup=None, min_mad=0.05):
+        """
+        Flag readings far from the rolling median, in units of the rolling
+        median absolute deviation (MAD).
+
+        Unlike a mean and standard deviation, median and MAD ignore the
+        spikes they are meant to catch. Both come from RollingMedian; the
+        deviations are taken from the median at the time each reading
+        arrived, the usual streaming approximation of the MAD. Flagged
+        readings are left out of both windows.
+
+        Parameters:
+        window (int): Readings in the rolling windows.
+        threshold (float): Scaled MADs from the median that are anomalous.
+        warmup (int): Readings seen before anything is flagged; defaults to
+            half the window.
+        min_mad (float): Floor on the MAD.
+        """
+        self.threshold = threshold
+        self.warmup = window // 2 if warmup is None else warmup
+        self.min_mad = min_mad
+        self.values = RollingMedian(window)
+        self.deviations = RollingMedian(window)
+
+    def update(self, ts, value):
+        median = self.values.median
+        if median is not None:
+            deviation = abs(value - median)
+            if len(self.values) >= self.warmup:
+                mad = max(self.deviations.median, self.min_mad) * self.MAD_SCALE
+                if deviation > self.threshold * mad:
+                    return f'{deviation / mad:.1f} MADs from median {median:.2f}'
+            self.deviations.add(deviation)
+        self.values.add(value)
+        return None
+
+class RateDetector:
+    __slots__ = ('max_rate', 'last_ts', 'last_value')
+
+    def __init__(self, max_rate=10.0):
+        """
+        Flag readings that change faster than a sensor physically can.
+
+        Parameters:
+        max_rate (float): Largest plausible change, in degrees per second.
+        """
+        self.max_rate = max_rate
+        self.last_ts = None
+        self.last_value = None
+
+    def update(self, ts, value):
+        if self.last_ts is not None and ts > self.last_ts:
+            rate = (value - self.last_value) * 1000 / (ts - self.last_ts)
+            if abs(rate) > self.max_rate:
+                return f'changing {rate:+.2f}/s'
+        self.last_ts = ts
+        self.last_value = value
+        return None
+
+DETECTORS = {
+    'range': RangeDetector,
+    'zscore': ZScoreDetector,
+    'mad': MadDetector,
+    'rate': RateDetector,
+}
+
+DEFAULT_DETECTORS = [{'type': 'range', 'low': -40, 'high': 40}, {'type': 'zscore'}]
+
+def build_detectors(specs):
+    """Detector instances for a list of {"type": name, **parameters} specs."""
+    detectors = []
+    for spec in specs:
+        params = dict(spec)
+        kind = params.pop('type')
+        try:
+            detectors.append(DETECTORS[kind](**params))
+        except KeyError:
+            raise ValueError(f'Unknown detector: {kind!r}') from None
+    return detectors
+
+class AnomalyEngine:
+    def __init__(self, config=None):
+        """
+        Run a chain of streaming detectors over every sensor's readings.
+
+        Each sensor gets its own detector instances, built on its first
+        reading from the first rule in config["sensors"] whose MQTT topic
+        filter matches it, else from config["default"]. A reading is
+        anomalous when any detector in the chain flags it; the chain stops
+        at the first one that does. Every detector keeps bounded state, so
+        memory grows only with the number of sensors.
+
+        Parameters:
+        config (dict): {"default": [spec, ...], "sensors": {filter: [spec, ...]}},
+            each spec being {"type": "range" | "zscore" | "mad" | "rate", **parameters}.
+        """
+        config = config or {}
+        self.default = config.get('default', DEFAULT_DETECTORS)
+        self.rules = list(config.get('sensors', {}).items())
+        self.__sensors = {}
+        # Fail on a bad config now rather than on the first reading
+        for specs in [self.default] + [specs for _, specs in self.rules]:
+            build_detectors(specs)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def detectors(self, sensor):
+        detectors = self.__sensors.get(sensor)
+        if detectors is None:
+            specs = next((specs for topic_filter, specs in self.rules
+                          if topic_matches(topic_filter, sensor)), self.default)
+            detectors = self.__sensors[sensor] = build_detectors(specs)
+        return detectors
+
+    def check(self, sensor, ts, value):
+        """Return why the reading is anomalous, or None if it is not."""
+        for detector in self.detectors(sensor):
+            reason = detector.update(ts, value)
+            if reason is not None:
+                return reason
+        return None
+
+    def clear(self):
+        self.__sensors.clear()
+
+if __name__ == '__main__':
+    import numpy as np
+    from group_5_data_generator import SensorSimulator, generate_matrix
+
+    parser = argparse.ArgumentParser(description='Per-reading cost and memory of the anomaly detectors')
+    parser.add_argument("--sensors", default=2000, type=int)
+    parser.add_argument("--readings", help="Readings per sensor", default=200, type=int)
+    parser.add_argument("--wild", help="Fraction of readings made wild", default=0.01, type=float)
+    parser.add_argument("--seed", default=1, type=int)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    simulators = [SensorSimulator(seed=args.seed + i) for i in range(args.sensors)]
+    values = generate_matrix(simulators, args.readings, rng)
+    wild = rng.random(values.shape) < args.wild
+    values = np.where(wild, values * rng.integers(2, 11, values.shape), values)
+    # Readings interleaved across sensors, as a wildcard subscriber sees them
+    readings = [(f'fleet/{s}', t * 250, value)
+                for t, row in enumerate(values.T.tolist()) for s, value in enumerate(row)]
+    truth = wild.T.ravel().tolist()
+
+    for name in DETECTORS:
+        config = {'default': [{'type': name}]}
+        engine = AnomalyEngine(config)
+        start = time.perf_counter()
+        flags = [engine.check(sensor, ts, value) is not None for sensor, ts, value in readings]
+        elapsed = time.perf_counter() - start
+        # Memory is measured on a second pass, tracing slows everything down
+        tracemalloc.start()
+        engine = AnomalyEngine(config)
+        for sensor, ts, value in readings:
+            engine.check(sensor, ts, value)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        caught = sum(f and t for f, t in zip(flags, truth))
+        false = sum(f and not t for f, t in zip(flags, truth))
+        print(f'{name:>6}: {elapsed / len(readings) * 1e6:6.2f} us/reading, '
+              f'{memory / args.sensors:7.0f} B/sensor, '
+              f'caught {caught}/{sum(truth)} wild, {false} false alarms')
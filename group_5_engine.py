@@ -0,0 +1,324 @@
+import time
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import paho.mqtt.client as mqtt
+from paho.mqtt import MQTTException
+
+from group_5_codec import get_codec, FrameBatcher
+from group_5_metrics import MetricsRegistry, MetricsServer
+from group_5_logs import setup_logging, add_logging_arguments
+
+logger = logging.getLogger(__name__)
+
+class AsyncMqtt:
+    def __init__(self, loop, client, inflight=100):
+        """
+        Drive a paho client from an asyncio event loop instead of its own
+        network thread.
+
+        The socket is watched with add_reader / add_writer, so reads and
+        writes happen on the loop whenever the socket is ready and publish
+        never blocks on the network. At most `inflight` messages are queued
+        or unacknowledged at once; publish waits for room, which pushes back
+        on the producers instead of letting paho's queue grow without bound.
+        Messages are tracked by mid; when the socket closes, paho drops the
+        unwritten QoS 0 ones without calling on_publish, so every message
+        still in flight gives its place in the window back.
+
+        Parameters:
+        loop (asyncio.AbstractEventLoop): Loop to run the client on.
+        client (mqtt.Client): Client, not yet connected.
+        inflight (int): Messages allowed in flight.
+        """
+        self.loop = loop
+        self.client = client
+        self.inflight = inflight
+        self.pending = 0
+        self.__window = asyncio.Semaphore(inflight)
+        self.__inflight = set()
+        self.__misc = None
+        client.on_socket_open = self.__on_loop(self.on_socket_open)
+        client.on_socket_close = self.__on_loop(self.on_socket_close)
+        client.on_socket_register_write = self.__on_loop(self.on_socket_register_write)
+        client.on_socket_unregister_write = self.__on_loop(self.on_socket_unregister_write)
+        client.on_publish = self.on_publish
+        client.max_inflight_messages_set(inflight)
+
+    def __on_loop(self, callback):
+        # A blocking connect may run in an executor thread; the socket
+        # callbacks it fires must still touch the loop from the loop's thread
+        def call(*args):
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is self.loop:
+                callback(*args)
+            else:
+                self.loop.call_soon_threadsafe(callback, *args)
+        return call
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self.__misc = self.loop.create_task(self.__misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self.__misc is not None:
+            self.__misc.cancel()
+        # Written or not, none of these will be reported any more; QoS 1/2
+        # ones paho resends after reconnecting are acknowledged unseen
+        for _ in self.__inflight:
+            self.__window.release()
+        self.pending -= len(self.__inflight)
+        self.__inflight.clear()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    def on_publish(self, client, userdata, mid, reason, properties):
+        # Called once a QoS 0 message is written, or a QoS 1/2 one acknowledged
+        if mid in self.__inflight:
+            self.__inflight.discard(mid)
+            self.pending -= 1
+            self.__window.release()
+
+    async def __misc_loop(self):
+        # Keepalive pings and retries, which paho's own thread would do
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    async def publish(self, topic, payload, qos=0):
+        await self.__window.acquire()
+        self.pending += 1
+        info = self.client.publish(topic, payload, qos=qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.pending -= 1
+            self.__window.release()
+            raise MQTTException(mqtt.error_string(info.rc))
+        self.__inflight.add(info.mid)
+        return info
+
+    async def drain(self, timeout=5):
+        """Wait until every message in flight is written or acknowledged."""
+        end = self.loop.time() + timeout
+        while self.pending and self.loop.time() < end:
+            await asyncio.sleep(0.01)
+
+class AsyncPublisherEngine:
+    def __init__(self, sensors, host='broker.hivemq.com', port=1883, qos=0, inflight=100,
+                 batch_size=1, max_latency=1000, metrics=None):
+        """
+        Publish a fleet of simulated sensors from one asyncio event loop.
+
+        Each sensor is a coroutine that sleeps until an absolute deadline,
+        publishes one reading, and moves its deadline on by its interval,
+        so generation and publish time never add up to drift. A sensor more
+        than a whole interval behind skips the missed slots, counted in its
+        overruns, instead of bursting. MQTT I/O runs on the same loop
+        through AsyncMqtt, with a bounded in-flight window. While the broker
+        connection is down, readings are dropped and counted, and the
+        connection is retried with backoff off the loop.
+
+        Parameters:
+        sensors (list): FleetSensor instances.
+        host (str): MQTT broker host.
+        port (int): MQTT broker port.
+        qos (int): QoS of every publish.
+        inflight (int): Messages allowed in flight before publishing waits.
+        batch_size (int): Readings per compressed frame, 1 disables batching.
+        max_latency (float): Longest time in ms a reading waits in a frame.
+        metrics (MetricsRegistry): Where to record counts and latencies.
+        """
+        self.sensors = list(sensors)
+        self.host = host
+        self.port = port
+        self.qos = qos
+        self.inflight = inflight
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.metrics.describe('publisher_readings_total', 'counter', 'Readings published per sensor')
+        self.metrics.describe('publisher_latency_seconds', 'summary',
+                              'Publish path latency per sensor and stage (schedule, encode, publish)')
+        self.metrics.describe('publisher_inflight', 'gauge', 'Messages waiting to be written or acknowledged')
+        self.metrics.describe('publisher_dropped_total', 'counter', 'Messages dropped while disconnected')
+        self.dropped = 0
+        self.__codecs = {}
+        self.__batchers = {}
+        for sensor in self.sensors:
+            self.__codecs.setdefault(sensor.topic, get_codec(sensor.codec))
+            if batch_size > 1:
+                self.__batchers.setdefault(sensor.topic, FrameBatcher(batch_size, max_latency))
+        self.__mqtt = None
+        self.__stop = None
+        self.__reconnecting = None
+
+    def stop(self):
+        """Stop the engine; safe to call from any thread."""
+        if self.__stop is not None:
+            self.__mqtt.loop.call_soon_threadsafe(self.__stop.set)
+
+    async def run(self, duration=None):
+        loop = asyncio.get_running_loop()
+        self.__stop = asyncio.Event()
+        client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=f'pub_engine_{int(time.time())}_{random.randint(1000, 9999)}',
+            protocol=mqtt.MQTTv5
+        )
+        client.on_disconnect = lambda *args: logger.warning('Engine connection lost')
+        self.__mqtt = AsyncMqtt(loop, client, self.inflight)
+        # Connecting blocks once, before any sensor runs
+        client.connect(host=self.host, port=self.port)
+        logger.info("Engine started with %d sensors", len(self.sensors))
+
+        start = loop.time()
+        end = start + duration if duration is not None else None
+        tasks = [asyncio.create_task(self.__run_sensor(sensor, start + sensor.interval * i / len(self.sensors), end))
+                 for i, sensor in enumerate(self.sensors)]
+        running = asyncio.gather(*tasks, return_exceptions=True)
+        frames = asyncio.create_task(self.__flush_frames()) if self.__batchers else None
+        stop = asyncio.create_task(self.__stop.wait())
+        try:
+            await asyncio.wait([running, stop], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            stop.cancel()
+            if frames is not None:
+                frames.cancel()
+            if self.__reconnecting is not None:
+                self.__reconnecting.cancel()
+            for sensor, result in zip(self.sensors, await running):
+                # Cancelled tasks give CancelledError, which is not an Exception
+                if isinstance(result, Exception):
+                    logger.error('Sensor %s failed', sensor.topic, exc_info=result)
+            await self.flush()
+            await self.__mqtt.drain()
+            client.disconnect()
+            logger.info("Engine stopped. Published: %d, Overruns: %d, Dropped: %d",
+                        sum(s.published for s in self.sensors),
+                        sum(s.overruns for s in self.sensors), self.dropped)
+
+    async def __run_sensor(self, sensor, deadline, end):
+        loop = asyncio.get_running_loop()
+        stop = self.__stop
+        while not stop.is_set() and (end is None or deadline < end):
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = loop.time()
+            sensor.lateness = now - deadline
+            temp = sensor.next_reading()
+            if temp is not None and await self.publish(sensor, sensor.message(temp)):
+                sensor.published += 1
+
+            deadline += sensor.interval
+            now = loop.time()
+            if deadline <= now:
+                missed = int((now - deadline) // sensor.interval) + 1
+                sensor.overruns += missed
+                deadline += missed * sensor.interval
+
+    async def publish(self, sensor, msg_dict):
+        """Encode and publish one reading; False if it was dropped."""
+        start = time.perf_counter()
+        batcher = self.__batchers.get(sensor.topic)
+        if batcher is None:
+            data = self.__codecs[sensor.topic].encode(msg_dict)
+        else:
+            data = batcher.add(msg_dict, time.monotonic())
+        encoded = time.perf_counter()
+        if data is not None and not await self.__send(sensor.topic, data):
+            return False
+        published = time.perf_counter()
+        self.metrics.inc('publisher_readings_total', sensor=sensor.topic)
+        self.metrics.set('publisher_inflight', self.__mqtt.pending)
+        self.metrics.observe('publisher_latency_seconds', sensor.lateness, sensor=sensor.topic, stage='schedule')
+        self.metrics.observe('publisher_latency_seconds', encoded - start, sensor=sensor.topic, stage='encode')
+        # Includes any wait for room in the in-flight window
+        self.metrics.observe('publisher_latency_seconds', published - encoded, sensor=sensor.topic, stage='publish')
+        return True
+
+    async def __send(self, topic, data):
+        try:
+            await self.__mqtt.publish(topic, data, self.qos)
+            return True
+        except MQTTException:
+            self.dropped += 1
+            self.metrics.inc('publisher_dropped_total', sensor=topic)
+            if self.__reconnecting is None or self.__reconnecting.done():
+                self.__reconnecting = asyncio.create_task(self.__reconnect())
+            return False
+
+    async def __reconnect(self):
+        delay = 0.5
+        while not self.__stop.is_set():
+            try:
+                # Connecting blocks for up to the connect timeout; keep it off
+                # the loop so the sensors keep their schedule
+                await self.__mqtt.loop.run_in_executor(None, self.__mqtt.client.reconnect)
+                logger.info('Engine connection restored')
+                return
+            except OSError as e:
+                logger.error('Engine connection: %s', e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def __flush_frames(self):
+        # Frames whose sensor skipped a slot go out when due, not with its
+        # next reading; a frame opened now is due max_latency from now at the soonest
+        idle = min(batcher.max_latency for batcher in self.__batchers.values()) / 1000
+        while True:
+            due = [d for d in (batcher.next_due() for batcher in self.__batchers.values()) if d is not None]
+            await asyncio.sleep(max(min(due) - time.monotonic(), 0.001) if due else idle)
+            now = time.monotonic()
+            for topic, batcher in self.__batchers.items():
+                for data in batcher.flush_due(now):
+                    await self.__send(topic, data)
+
+    async def flush(self):
+        for topic, batcher in self.__batchers.items():
+            for data in batcher.flush():
+                await self.__send(topic, data)
+
+if __name__ == '__main__':
+    from group_5_fleet import load_fleet
+
+    parser = argparse.ArgumentParser(description='Publish a sensor fleet from one asyncio event loop')
+    parser.add_argument("--config", help="Fleet config file", default='group_5_fleet.json', type=str)
+    parser.add_argument("--duration", help="Seconds to run for", type=float)
+    parser.add_argument("--inflight", help="Messages in flight before publishing waits", default=100, type=int)
+    parser.add_argument("--metrics-port", help="Serve Prometheus metrics on this local port", type=int)
+    parser.add_argument("--trace", help="Play values from this precomputed trace file", type=str)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging('publisher.log', json_lines=args.log_json,
+                  sample_every=args.log_sample, max_per_second=args.log_rate)
+
+    config, sensors = load_fleet(args.config, trace=args.trace)
+    broker = config.get('broker', {})
+    batch = config.get('batch', {})
+    engine = AsyncPublisherEngine(sensors, host=broker.get('host', 'broker.hivemq.com'),
+                                  port=int(broker.get('port', 1883)), qos=int(config.get('qos', 0)),
+                                  inflight=args.inflight, batch_size=int(batch.get('size', 1)),
+                                  max_latency=float(batch.get('max_latency', 1000)))
+    server = MetricsServer(engine.metrics, args.metrics_port).start() if args.metrics_port is not None else None
+    try:
+        asyncio.run(engine.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    except (socket.error, MQTTException) as e:
+        logger.error("MQTT connection error: %s", e)
+    lateness = engine.metrics.histogram('publisher_latency_seconds', stage='schedule')
+    if lateness.count:
+        print(f'{lateness.count} readings, lateness p50 {lateness.percentile(0.5) / 1000:.3f} ms, '
+              f'p99 {lateness.percentile(0.99) / 1000:.3f} ms, max {lateness.max / 1000:.3f} ms, '
+              f'overruns {sum(s.overruns for s in sensors)}')
+    if server is not None:
+        server.stop()
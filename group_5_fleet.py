@@ -0,0 +1,321 @@
+import json
+import heapq
+import random
+import threading
+import argparse
+import time
+import socket
+import logging
+import paho.mqtt.client as mqtt
+from paho.mqtt import MQTTException
+
+from group_5_data_generator import SensorSimulator, TracePlayer
+from group_5_codec import get_codec, FrameBatcher, FrameFlusher
+from group_5_metrics import MetricsRegistry, MetricsServer
+from group_5_logs import SampledLogger, setup_logging, add_logging_arguments
+from group_5_sequence import new_run_id
+
+logger = logging.getLogger(__name__)
+messages = SampledLogger(__name__)
+
+SIMULATOR_KEYS = ('min_value', 'max_value', 'noise_level', 'base_value', 'min_step',
+                  'max_step', 'delta', 'min_cycle', 'max_cycle', 'squiggle', 'seed')
+
+class FleetSensor:
+    def __init__(self, topic, name, ipv4, interval, simulator, max_iteration=100, faults=True, codec='json',
+                 seed=None):
+        """
+        One simulated sensor driven by the fleet scheduler.
+
+        Parameters:
+        topic (str): MQTT topic the readings are published on.
+        name (str): Sensor name sent in every reading.
+        ipv4 (str): Sensor address sent in every reading.
+        interval (float): Seconds between readings.
+        simulator (SensorSimulator): Source of temperature values.
+        max_iteration (int): Length of the window in which one reading is
+            dropped and one is made wild, as in the GUI publisher.
+        faults (bool): If False, never drop or corrupt readings.
+        codec (str): Name of the payload codec used on this sensor's topic.
+        seed (int): Seed for picking the faulty readings.
+        """
+        self.topic = topic
+        self.name = name
+        self.ipv4 = ipv4
+        self.interval = interval
+        self.simulator = simulator
+        self.faults = faults
+        self.codec = codec
+        self.published = 0
+        self.overruns = 0
+        # Seconds the current reading started after its deadline
+        self.lateness = 0.0
+        self.__seq = 0
+        # Random even for seeded sensors, so a rerun is a new count
+        self.__run = new_run_id()
+        self.__max_iteration = max_iteration
+        self.__iteration = 0
+        # Its own generator, seeded apart from the simulator's stream
+        self.__rng = random.Random(None if seed is None else f'faults/{seed}')
+        self.__pick_faults()
+
+    def __pick_faults(self):
+        self.__miss_transmission = self.__rng.randint(1, self.__max_iteration)
+        self.__wild_transmission = self.__rng.randint(1, self.__max_iteration)
+
+    def next_reading(self):
+        """Return the next temperature, or None if this slot is a dropped packet."""
+        # seq counts every slot, dropped ones included, so the subscriber can
+        # tell exactly which readings never arrived
+        self.__seq += 1
+        self.__iteration += 1
+        if self.__iteration > self.__max_iteration:
+            self.__iteration = 0
+            self.__pick_faults()
+
+        if self.faults and self.__miss_transmission == self.__iteration:
+            return None
+
+        temp = self.simulator.value
+        if self.faults and self.__wild_transmission == self.__iteration:
+            temp = temp * self.__rng.randint(2, 10)
+        return temp
+
+    def message(self, temp):
+        # sentAt is the send time in epoch seconds
+        sent_at = time.time()
+        return {
+            "packetId": int(sent_at * 1000),
+            "name": self.name,
+            "ipv4": self.ipv4,
+            "temp": temp,
+            "interval": self.interval,
+            "seq": self.__seq,
+            "run": self.__run,
+            "sentAt": sent_at
+        }
+
+class FleetScheduler:
+    def __init__(self, sensors, publish, clock=time.monotonic):
+        """
+        Drive many sensors from one thread with a heap of absolute deadlines.
+
+        Each sensor's next deadline is its previous deadline plus its interval,
+        so time spent generating and publishing never accumulates as drift.
+        A sensor that falls more than a whole interval behind skips the
+        missed slots (counted in its overruns) instead of bursting.
+
+        Parameters:
+        sensors (list): FleetSensor instances.
+        publish (callable): Called as publish(sensor, msg_dict) for each reading.
+        clock (callable): Monotonic clock in seconds.
+        """
+        self.sensors = list(sensors)
+        self.publish = publish
+        self.clock = clock
+        self.__stop = threading.Event()
+
+    def stop(self):
+        self.__stop.set()
+
+    def run(self, duration=None):
+        start = self.clock()
+        end = start + duration if duration is not None else None
+        # Spread first deadlines over one interval so sensors sharing an
+        # interval do not all fire in the same instant.
+        heap = [(start + sensor.interval * index / len(self.sensors), index)
+                for index, sensor in enumerate(self.sensors)]
+        heapq.heapify(heap)
+
+        while heap and not self.__stop.is_set():
+            deadline, index = heap[0]
+            if end is not None and deadline >= end:
+                break
+            now = self.clock()
+            if deadline > now:
+                if self.__stop.wait(deadline - now):
+                    break
+                now = self.clock()
+
+            sensor = self.sensors[index]
+            sensor.lateness = now - deadline
+            temp = sensor.next_reading()
+            if temp is not None:
+                self.publish(sensor, sensor.message(temp))
+                sensor.published += 1
+
+            next_deadline = deadline + sensor.interval
+            if next_deadline <= now:
+                missed = int((now - next_deadline) // sensor.interval) + 1
+                sensor.overruns += missed
+                next_deadline += missed * sensor.interval
+            heapq.heapreplace(heap, (next_deadline, index))
+
+def load_fleet(path, seed=None, trace=None):
+    """
+    Read a fleet config file and build its FleetSensor instances.
+
+    Each entry in "sensors" describes one sensor, or "count" sensors when that
+    key is given, in which case "{index}" in topic, name and ipv4 is replaced
+    by the running sensor number. Simulator parameters go under "simulator";
+    a seed there is offset by the index so expanded sensors differ, and
+    sensors without one are seeded with seed + index when seed is given. The
+    payload codec is set with "codec" at the top level or per entry.
+
+    With a trace, given here or as "trace" at the top level, sensor i plays
+    column i - 1 of a file written by group_5_data_generator.write_trace
+    instead of generating its values.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    trace = trace or config.get('trace')
+
+    sensors = []
+    for entry in config['sensors']:
+        for _ in range(int(entry.get('count', 1))):
+            index = len(sensors) + 1
+            params = {k: v for k, v in entry.get('simulator', {}).items() if k in SIMULATOR_KEYS}
+            if params.get('seed') is not None:
+                params['seed'] += index
+            elif seed is not None:
+                params['seed'] = seed + index
+            if trace:
+                simulator = TracePlayer(trace, column=index - 1)
+            else:
+                simulator = SensorSimulator(**params)
+            sensors.append(FleetSensor(
+                topic=entry['topic'].format(index=index),
+                name=entry.get('name', entry['topic']).format(index=index),
+                ipv4=entry.get('ipv4', f'10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}').format(index=index),
+                interval=float(entry.get('interval', 1)),
+                simulator=simulator,
+                faults=entry.get('faults', True),
+                codec=entry.get('codec', config.get('codec', 'json')),
+                seed=params.get('seed')
+            ))
+    return config, sensors
+
+class FleetPublisher:
+    def __init__(self, config_path, metrics_port=None, trace=None, gateway=None):
+        self.config, self.sensors = load_fleet(config_path, trace=trace)
+        self.metrics = MetricsRegistry()
+        self.metrics.describe('publisher_readings_total', 'counter', 'Readings published per sensor')
+        self.metrics.describe('publisher_latency_seconds', 'summary',
+                              'Publish path latency per sensor and stage (schedule, encode, publish)')
+        self.__metrics_port = metrics_port
+        broker = self.config.get('broker', {})
+        self.__host = broker.get('host', 'broker.hivemq.com')
+        self.__port = int(broker.get('port', 1883))
+        self.__qos = int(self.config.get('qos', 0))
+
+        self.mqttc = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=f'pub_fleet_{int(time.time())}_{random.randint(1000, 9999)}',
+            protocol=mqtt.MQTTv5
+        )
+        self.mqttc.on_connect = self.on_connect
+        self.mqttc.on_disconnect = self.on_disconnect
+        # Through a gateway, readings due together go out in one send
+        self.__gateway = None
+        if gateway:
+            # The gateway module brings in asyncio, so only when used
+            from group_5_gateway import GatewayClient
+
+            self.__gateway = GatewayClient(gateway, max_delay=0.005)
+        self.scheduler = FleetScheduler(self.sensors, self.publish)
+        # One encoder per topic, so stateful codecs intern their metadata per
+        # topic just as the subscriber's decoder tracks it.
+        self.__codecs = {}
+        for sensor in self.sensors:
+            self.__codecs.setdefault(sensor.topic, get_codec(sensor.codec))
+        # With "batch" in the config, readings go out as compressed frames
+        batch = self.config.get('batch', {})
+        self.__batchers = {}
+        if int(batch.get('size', 1)) > 1:
+            for sensor in self.sensors:
+                self.__batchers.setdefault(sensor.topic, FrameBatcher(
+                    int(batch['size']), float(batch.get('max_latency', 1000))))
+
+    def publish(self, sensor, msg_dict):
+        start = time.perf_counter()
+        batcher = self.__batchers.get(sensor.topic)
+        if batcher is None:
+            data = self.__codecs[sensor.topic].encode(msg_dict)
+        else:
+            data = batcher.add(msg_dict, time.monotonic())
+        encoded = time.perf_counter()
+        if data is not None:
+            self.send(sensor.topic, data)
+        published = time.perf_counter()
+        self.metrics.inc('publisher_readings_total', sensor=sensor.topic)
+        self.metrics.observe('publisher_latency_seconds', sensor.lateness, sensor=sensor.topic, stage='schedule')
+        self.metrics.observe('publisher_latency_seconds', encoded - start, sensor=sensor.topic, stage='encode')
+        self.metrics.observe('publisher_latency_seconds', published - encoded, sensor=sensor.topic, stage='publish')
+        messages.debug("Published message: %s", msg_dict)
+
+    def send(self, topic, data):
+        if self.__gateway is not None:
+            self.__gateway.publish(topic, data, self.__qos)
+        else:
+            self.mqttc.publish(topic=topic, payload=data, qos=self.__qos)
+
+    def flush(self):
+        for topic, batcher in self.__batchers.items():
+            for data in batcher.flush():
+                self.send(topic, data)
+        if self.__gateway is not None:
+            self.__gateway.flush()
+
+    def run(self, duration=None):
+        if self.__gateway is None:
+            try:
+                self.mqttc.connect(host=self.__host, port=self.__port)
+            except (socket.error, MQTTException) as e:
+                logger.error("MQTT connection error: %s", e)
+                return
+            self.mqttc.loop_start()
+        server = MetricsServer(self.metrics, self.__metrics_port).start() if self.__metrics_port is not None else None
+        # Sends frames whose sensor skipped a slot without waiting for it
+        flusher = FrameFlusher(self.__batchers, self.send).start() if self.__batchers else None
+        logger.info("Fleet of %d sensors started", len(self.sensors))
+        try:
+            self.scheduler.run(duration)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if flusher is not None:
+                flusher.stop()
+            self.flush()
+            if self.__gateway is not None:
+                self.__gateway.close()
+            else:
+                self.mqttc.disconnect()
+                self.mqttc.loop_stop()
+            if server is not None:
+                server.stop()
+            logger.info("Fleet stopped. Published: %d, Overruns: %d",
+                        sum(s.published for s in self.sensors),
+                        sum(s.overruns for s in self.sensors))
+
+    def stop(self):
+        self.scheduler.stop()
+
+    def on_connect(self, mqttc, userdata, flags, rc, properties=None):
+        logger.info('Connected to MQTT broker. Return code: %s', rc)
+
+    def on_disconnect(self, client, userdata, flags, reason, properties):
+        logger.info('Disconnected from MQTT broker. Return code: %s', reason)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", help="Fleet config file", default='group_5_fleet.json', type=str)
+    parser.add_argument("--duration", help="Seconds to run for", type=float)
+    parser.add_argument("--metrics-port", help="Serve Prometheus metrics on this local port", type=int)
+    parser.add_argument("--trace", help="Play values from this precomputed trace file", type=str)
+    parser.add_argument("--gateway", help="Publish through the local gateway listening on this Unix socket", type=str)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging('publisher.log', json_lines=args.log_json,
+                  sample_every=args.log_sample, max_per_second=args.log_rate)
+    FleetPublisher(args.config, metrics_port=args.metrics_port, trace=args.trace,
+                   gateway=args.gateway).run(args.duration)
@@ -0,0 +1,269 @@
+import os
+import time
+import zlib
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+import paho.mqtt.client as mqtt
+from paho.mqtt import MQTTException
+
+from group_5_engine import AsyncMqtt
+from group_5_metrics import MetricsRegistry, MetricsServer
+from group_5_outbox import RECORD
+from group_5_logs import setup_logging, add_logging_arguments
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/group_5_gateway.sock'
+
+class GatewayClient:
+    # Same interface as Outbox, so a publisher can use either
+    rate_scale = 1.0
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, max_batch=64 * 1024, max_delay=0.0, timeout=1.0):
+        """
+        Hand readings to a PublisherGateway over its Unix domain socket.
+
+        Records are framed like the outbox spill log (qos, topic length,
+        payload length, topic, payload) and buffered, then written with one
+        send once max_batch bytes are buffered or the oldest has waited
+        max_delay seconds, checked on each publish. With the default
+        max_delay of 0 every reading is sent at once. A send that times out
+        or fails drops the buffered readings, counted in dropped, and the
+        next one reconnects. Safe to share between threads, as the outbox is.
+
+        Parameters:
+        socket_path (str): Gateway socket.
+        max_batch (int): Bytes buffered before sending.
+        max_delay (float): Longest time in seconds a reading stays buffered.
+        timeout (float): Longest time in seconds a send may block when the
+            gateway is not keeping up.
+        """
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.sent = 0
+        self.dropped = 0
+        self.__buffer = bytearray()
+        self.__buffered = 0
+        self.__first = None
+        self.__sock = None
+        self.__lock = threading.RLock()
+
+    @property
+    def backlog(self):
+        return self.__buffered
+
+    def __connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.__sock = sock
+
+    def publish(self, topic, payload, qos=0):
+        topic = topic.encode()
+        with self.__lock:
+            self.__buffer += RECORD.pack(qos, len(topic), len(payload))
+            self.__buffer += topic
+            self.__buffer += payload
+            self.__buffered += 1
+            now = time.monotonic()
+            if self.__first is None:
+                self.__first = now
+            if len(self.__buffer) >= self.max_batch or now - self.__first >= self.max_delay:
+                return self.flush()
+            return False
+
+    def flush(self):
+        """Send everything buffered; returns False if it was dropped."""
+        with self.__lock:
+            return self.__flush()
+
+    def __flush(self):
+        if not self.__buffer:
+            return True
+        try:
+            if self.__sock is None:
+                self.__connect()
+            self.__sock.sendall(self.__buffer)
+            self.sent += self.__buffered
+            return True
+        except OSError as e:
+            logger.error('Gateway send error: %s', e)
+            self.dropped += self.__buffered
+            self.close()
+            return False
+        finally:
+            self.__buffer.clear()
+            self.__buffered = 0
+            self.__first = None
+
+    def close(self):
+        with self.__lock:
+            if self.__sock is not None:
+                self.__sock.close()
+                self.__sock = None
+
+class PublisherGateway:
+    def __init__(self, socket_path=DEFAULT_SOCKET, host='broker.hivemq.com', port=1883, connections=2,
+                 inflight=100, metrics=None):
+        """
+        Publish readings from many local producers over a few broker connections.
+
+        Producers connect to a Unix domain socket and stream framed records
+        (see GatewayClient). Everything runs on one asyncio event loop: each
+        read takes whatever the producers have sent, often many readings, and
+        each reading is routed to one of `connections` paho clients driven
+        by AsyncMqtt, picked by a hash of its topic so a topic's readings
+        stay in order. A connection with `inflight` messages outstanding
+        makes the gateway stop reading, which leaves the data in the socket
+        buffers and in the end blocks the producers: backpressure instead
+        of an unbounded queue. Readings for a connection that is down are
+        dropped and counted while it reconnects.
+
+        Parameters:
+        socket_path (str): Unix socket to listen on.
+        host (str): MQTT broker host.
+        port (int): MQTT broker port.
+        connections (int): Broker connections in the pool.
+        inflight (int): Messages in flight per connection.
+        metrics (MetricsRegistry): Where to record counts.
+        """
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.connections = connections
+        self.inflight = inflight
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.metrics.describe('gateway_readings_total', 'counter', 'Readings published per connection')
+        self.metrics.describe('gateway_reads_total', 'counter', 'Socket reads; readings per read is the batching')
+        self.metrics.describe('gateway_dropped_total', 'counter', 'Readings dropped per reason')
+        self.metrics.describe('gateway_producers', 'gauge', 'Producers connected')
+        self.__pool = []
+        self.__reconnecting = {}
+        self.__producers = 0
+        self.__stop = None
+        self.__loop = None
+
+    def stop(self):
+        """Stop the gateway; safe to call from any thread."""
+        if self.__stop is not None:
+            self.__loop.call_soon_threadsafe(self.__stop.set)
+
+    def __client(self, index):
+        client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=f'pub_gateway_{index}_{int(time.time())}_{random.randint(1000, 9999)}',
+            protocol=mqtt.MQTTv5
+        )
+        client.on_disconnect = lambda *args: logger.warning('Gateway connection %d lost', index)
+        return client
+
+    async def __reconnect(self, connection, index):
+        delay = 0.5
+        while not self.__stop.is_set():
+            try:
+                # Connecting blocks for up to the connect timeout; keep it off
+                # the loop so producers and the other connections carry on
+                await self.__loop.run_in_executor(None, connection.client.reconnect)
+                logger.info('Gateway connection %d restored', index)
+                return
+            except OSError as e:
+                logger.error('Gateway connection %d: %s', index, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def run(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__stop = asyncio.Event()
+        for index in range(self.connections):
+            connection = AsyncMqtt(self.__loop, self.__client(index), self.inflight)
+            # Connecting blocks once, before any producer is accepted
+            connection.client.connect(host=self.host, port=self.port)
+            self.__pool.append(connection)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self.__serve, path=self.socket_path)
+        logger.info('Gateway listening on %s with %d broker connections', self.socket_path, self.connections)
+        try:
+            await self.__stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            for connection in self.__pool:
+                await connection.drain()
+                connection.client.disconnect()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def __serve(self, reader, writer):
+        self.__producers += 1
+        self.metrics.set('gateway_producers', self.__producers)
+        pending = b''
+        try:
+            while True:
+                data = await reader.read(1 << 16)
+                if not data:
+                    break
+                self.metrics.inc('gateway_reads_total')
+                data = pending + data if pending else data
+                offset, end = 0, len(data)
+                while end - offset >= RECORD.size:
+                    qos, topic_len, payload_len = RECORD.unpack_from(data, offset)
+                    start = offset + RECORD.size
+                    stop = start + topic_len + payload_len
+                    if stop > end:
+                        break
+                    await self.publish(data[start:start + topic_len].decode(errors='replace'),
+                                       data[start + topic_len:stop], qos)
+                    offset = stop
+                pending = data[offset:]
+        finally:
+            self.__producers -= 1
+            self.metrics.set('gateway_producers', self.__producers)
+            writer.close()
+
+    async def publish(self, topic, payload, qos=0):
+        index = zlib.crc32(topic.encode()) % len(self.__pool)
+        connection = self.__pool[index]
+        try:
+            await connection.publish(topic, payload, qos)
+        except ValueError:
+            # Wildcards or an empty topic
+            self.metrics.inc('gateway_dropped_total', reason='topic')
+            return
+        except MQTTException:
+            self.metrics.inc('gateway_dropped_total', reason='disconnected')
+            task = self.__reconnecting.get(index)
+            if task is None or task.done():
+                self.__reconnecting[index] = asyncio.create_task(self.__reconnect(connection, index))
+            return
+        self.metrics.inc('gateway_readings_total', connection=str(index))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publish readings from local producers over a pool of broker connections')
+    parser.add_argument("--socket", help="Unix socket to listen on", default=DEFAULT_SOCKET, type=str)
+    parser.add_argument("--host", help="MQTT broker host", default='broker.hivemq.com', type=str)
+    parser.add_argument("--port", help="MQTT broker port", default=1883, type=int)
+    parser.add_argument("--connections", help="Broker connections in the pool", default=2, type=int)
+    parser.add_argument("--inflight", help="Messages in flight per connection", default=100, type=int)
+    parser.add_argument("--metrics-port", help="Serve Prometheus metrics on this local port", type=int)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging('publisher.log', json_lines=args.log_json,
+                  sample_every=args.log_sample, max_per_second=args.log_rate)
+
+    gateway = PublisherGateway(args.socket, args.host, args.port, args.connections, args.inflight)
+    server = MetricsServer(gateway.metrics, args.metrics_port).start() if args.metrics_port is not None else None
+    try:
+        asyncio.run(gateway.run())
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        logger.error("MQTT connection error: %s", e)
+    if server is not None:
+        server.stop()
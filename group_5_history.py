@@ -0,0 +1,276 @@
+import numpy as np
+
+class RingBuffer:
+    def __init__(self, capacity=100000):
+        """
+        Fixed-capacity history of (timestamp, temperature) readings.
+
+        Storage is preallocated at twice the capacity and every reading is
+        written to both halves, so the newest `capacity` readings are always
+        one contiguous slice and views never need to copy or wrap.
+
+        Parameters:
+        capacity (int): Number of most recent readings kept.
+        """
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self.capacity = capacity
+        self.__timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self.__temps = np.zeros(2 * capacity, dtype=np.float64)
+        self.__next = 0
+        self.__size = 0
+
+    def __len__(self):
+        return self.__size
+
+    @property
+    def nbytes(self):
+        """Bytes held by the preallocated arrays."""
+        return self.__timestamps.nbytes + self.__temps.nbytes
+
+    def append(self, timestamp, temp):
+        i = self.__next
+        self.__timestamps[i] = self.__timestamps[i + self.capacity] = timestamp
+        self.__temps[i] = self.__temps[i + self.capacity] = temp
+        self.__next = i + 1 if i + 1 < self.capacity else 0
+        if self.__size < self.capacity:
+            self.__size += 1
+
+    def clear(self):
+        self.__next = 0
+        self.__size = 0
+
+    def view(self, last=None):
+        """
+        Return read-only (timestamps, temps) views, oldest first.
+
+        Parameters:
+        last (int): Only return the most recent `last` readings.
+        """
+        n = self.__size if last is None else min(last, self.__size)
+        end = self.__next + self.capacity if self.__size == self.capacity else self.__next
+        timestamps = self.__timestamps[end - n:end]
+        temps = self.__temps[end - n:end]
+        timestamps.flags.writeable = False
+        temps.flags.writeable = False
+        return timestamps, temps
+
+class MinMaxLevel:
+    def __init__(self, capacity):
+        """
+        Fixed-capacity ring of (timestamp, min, max) buckets, written twice
+        like RingBuffer so its contents are always one contiguous slice.
+
+        Parameters:
+        capacity (int): Number of most recent buckets kept.
+        """
+        self.capacity = capacity
+        self.__timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self.__low = np.zeros(2 * capacity, dtype=np.float64)
+        self.__high = np.zeros(2 * capacity, dtype=np.float64)
+        self.__next = 0
+        self.__size = 0
+
+    def __len__(self):
+        return self.__size
+
+    @property
+    def nbytes(self):
+        return self.__timestamps.nbytes + self.__low.nbytes + self.__high.nbytes
+
+    def append(self, timestamp, low, high):
+        i = self.__next
+        self.__timestamps[i] = self.__timestamps[i + self.capacity] = timestamp
+        self.__low[i] = self.__low[i + self.capacity] = low
+        self.__high[i] = self.__high[i + self.capacity] = high
+        self.__next = i + 1 if i + 1 < self.capacity else 0
+        if self.__size < self.capacity:
+            self.__size += 1
+
+    def view(self):
+        """Return read-only (timestamps, lows, highs) views, oldest first."""
+        end = self.__next + self.capacity if self.__size == self.capacity else self.__next
+        views = (self.__timestamps[end - self.__size:end], self.__low[end - self.__size:end],
+                 self.__high[end - self.__size:end])
+        for view in views:
+            view.flags.writeable = False
+        return views
+
+class MinMaxPyramid:
+    def __init__(self, factor=8, depth=6, capacity=2048):
+        """
+        Min/max summaries of a stream of readings at several resolutions.
+
+        Level k holds one (first timestamp, min, max) bucket per factor**k
+        readings, level 1 being built from the readings and every further
+        level from the one below, as each bucket completes. Adding a reading
+        is O(1) amortized, and since every level keeps the same number of
+        buckets, coarser levels reach further back: capacity * factor**k
+        readings. Min/max per bucket keeps every spike visible, which
+        averaging or picking points (LTTB) would not guarantee, and unlike
+        LTTB it can be built up incrementally. Levels are allocated when
+        their first bucket completes.
+
+        Parameters:
+        factor (int): Readings (level 1) or buckets per bucket of the next level.
+        depth (int): Number of levels.
+        capacity (int): Buckets kept per level.
+        """
+        self.factor = factor
+        self.depth = depth
+        self.capacity = capacity
+        self.__levels = [None] * depth
+        # Bucket still filling per level: [count, first timestamp, min, max]
+        self.__partial = [[0, 0, 0.0, 0.0] for _ in range(depth)]
+
+    def append(self, timestamp, value):
+        low = high = value
+        for k, partial in enumerate(self.__partial):
+            if partial[0] == 0:
+                partial[1], partial[2], partial[3] = timestamp, low, high
+            else:
+                if low < partial[2]:
+                    partial[2] = low
+                if high > partial[3]:
+                    partial[3] = high
+            partial[0] += 1
+            if partial[0] < self.factor:
+                return
+            partial[0] = 0
+            level = self.__levels[k]
+            if level is None:
+                level = self.__levels[k] = MinMaxLevel(self.capacity)
+            timestamp, low, high = partial[1], partial[2], partial[3]
+            level.append(timestamp, low, high)
+
+    def clear(self):
+        self.__levels = [None] * self.depth
+        for partial in self.__partial:
+            partial[0] = 0
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.__levels if level is not None)
+
+    def level(self, k):
+        """
+        Buckets of level k (1 to depth), oldest first, the ones still
+        filling included so the newest readings are always covered.
+
+        Returns:
+        tuple: (timestamps, lows, highs) arrays and whether buckets have
+            already been dropped off the old end.
+        """
+        level = self.__levels[k - 1]
+        timestamps, lows, highs = level.view() if level is not None else (np.empty(0, np.int64),) + (np.empty(0),) * 2
+        # Still-filling buckets of this level and those below, oldest first
+        tail = [partial[1:] for partial in reversed(self.__partial[:k]) if partial[0]]
+        if tail:
+            extra = np.array(tail, dtype=np.float64).T
+            timestamps = np.concatenate([timestamps, extra[0].astype(np.int64)])
+            lows = np.concatenate([lows, extra[1]])
+            highs = np.concatenate([highs, extra[2]])
+        dropped = level is not None and len(level) == level.capacity
+        return timestamps, lows, highs, dropped
+
+class HistoryStore:
+    def __init__(self, capacity=100000, factor=8, depth=6, level_capacity=2048):
+        """
+        One RingBuffer and MinMaxPyramid per sensor, created on first use.
+
+        Parameters:
+        capacity (int): Capacity of each sensor's buffer.
+        factor (int): Readings per bucket of the first summary level, and
+            buckets per bucket of every further one.
+        depth (int): Number of summary levels; 0 keeps none.
+        level_capacity (int): Buckets kept per summary level.
+        """
+        self.capacity = capacity
+        self.factor = factor
+        self.depth = depth
+        self.level_capacity = level_capacity
+        self.__buffers = {}
+        self.__pyramids = {}
+
+    def __getitem__(self, sensor):
+        buffer = self.__buffers.get(sensor)
+        if buffer is None:
+            buffer = self.__buffers[sensor] = RingBuffer(self.capacity)
+        return buffer
+
+    def __contains__(self, sensor):
+        return sensor in self.__buffers
+
+    def __iter__(self):
+        return iter(self.__buffers)
+
+    def pyramid(self, sensor):
+        pyramid = self.__pyramids.get(sensor)
+        if pyramid is None:
+            pyramid = self.__pyramids[sensor] = MinMaxPyramid(self.factor, self.depth, self.level_capacity)
+        return pyramid
+
+    def append(self, sensor, timestamp, temp):
+        self[sensor].append(timestamp, temp)
+        if self.depth:
+            self.pyramid(sensor).append(timestamp, temp)
+
+    def window(self, sensor, start=None, end=None, max_points=1000):
+        """
+        Readings with start <= timestamp <= end, at most max_points of them.
+
+        Served from the raw buffer when it holds the whole range in few
+        enough points, else from the finest summary level that reaches back
+        to start with at most max_points / 2 buckets in range; each bucket
+        is drawn as its min and its max at the bucket's timestamp, and the
+        bucket that overlaps start is included though it begins before it.
+        The cost depends on max_points, not on how long the range is.
+
+        Parameters:
+        sensor (str): Sensor to query.
+        start (int): First timestamp; None for the oldest kept.
+        end (int): Last timestamp; None for the newest.
+        max_points (int): Most points returned.
+
+        Returns:
+        tuple: (timestamps, temps) arrays, oldest first.
+        """
+        timestamps, temps = self[sensor].view()
+
+        def bounds(ts, buckets=False):
+            lo = 0 if start is None else int(np.searchsorted(ts, start, 'left'))
+            if buckets and lo and (lo == len(ts) or ts[lo] > start):
+                # The bucket starting before start overlaps the range, and a
+                # spike inside it must still show
+                lo -= 1
+            hi = len(ts) if end is None else int(np.searchsorted(ts, end, 'right'))
+            return lo, hi
+
+        # The raw buffer is complete for the range if nothing older was dropped
+        complete = len(timestamps) < self.capacity or (start is not None and len(timestamps)
+                                                        and timestamps[0] <= start)
+        lo, hi = bounds(timestamps)
+        if (complete and hi - lo <= max_points) or not self.depth or sensor not in self.__pyramids:
+            return timestamps[lo:hi], temps[lo:hi]
+
+        pyramid = self.__pyramids[sensor]
+        for k in range(1, self.depth + 1):
+            ts, lows, highs, dropped = pyramid.level(k)
+            lo, hi = bounds(ts, buckets=True)
+            reaches = not dropped or (start is not None and len(ts) and ts[0] <= start)
+            if (reaches and hi - lo <= max_points // 2) or k == self.depth:
+                break
+        if hi - lo > max_points // 2:
+            # Even the coarsest level is too fine; keep the newest buckets
+            lo = hi - max_points // 2
+        return np.repeat(ts[lo:hi], 2), np.column_stack([lows[lo:hi], highs[lo:hi]]).ravel()
+
+    def clear(self):
+        self.__buffers.clear()
+        self.__pyramids.clear()
+
+    @property
+    def nbytes(self):
+        """Bytes held by all sensors' buffers and summary levels."""
+        return (sum(buffer.nbytes for buffer in self.__buffers.values()) +
+                sum(pyramid.nbytes for pyramid in self.__pyramids.values()))
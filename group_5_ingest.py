@@ -0,0 +1,366 @@
+import time
+import logging
+import argparse
+import threading
+from collections import deque, namedtuple
+from types import MappingProxyType
+
+from group_5_codec import PayloadDecoder, CodecError
+from group_5_alerts import AlertDispatcher, SmtpSender
+from group_5_metrics import MetricsRegistry, MetricsServer
+from group_5_sequence import GAP, REORDERED, DUPLICATE, LATE
+from group_5_detectors import AnomalyEngine
+from group_5_aggregate import Aggregator, DEFAULT_WINDOWS, DERIVED
+from group_5_transport import open_transport
+from group_5_logs import SampledLogger, setup_logging, add_logging_arguments
+
+logger = logging.getLogger(__name__)
+
+# Per-reading records, thinned out with --log-sample / --log-rate
+messages = SampledLogger()
+
+# One sensor as of its latest reading. Built on the ingest thread after
+# every reading and never changed afterwards; last_message is shared, so
+# consumers must not modify it. appended counts readings added to the
+# history, so a consumer can tell whether it has anything new to draw.
+SensorSnapshot = namedtuple('SensorSnapshot', ['topic', 'last_message', 'received', 'missing', 'wild',
+                                               'sent_at', 'received_at', 'appended'])
+
+# Every sensor at one moment: version grows with each change, sensors maps
+# topic to SensorSnapshot (read-only) and last_event is the id of the
+# newest event, for events(after=...)
+Snapshot = namedtuple('Snapshot', ['version', 'sensors', 'last_event'])
+
+# Something that went wrong off the caller's thread: kind is the label of
+# subscriber_errors_total it was counted under
+Event = namedtuple('Event', ['id', 'time', 'kind', 'title', 'message'])
+
+def check_reading(message):
+    """
+    Raise KeyError, TypeError or ValueError unless message is a reading: a
+    JSON object with numeric packetId, interval and temp, and integer seq
+    and run if it has them. Anything can be published on a wildcard topic.
+    """
+    if not isinstance(message, dict):
+        raise TypeError(f'expected a JSON object, got {type(message).__name__}')
+    for key in ('packetId', 'interval', 'temp'):
+        value = message[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError(f'{key} is not a number: {value!r}')
+    for key in ('seq', 'run'):
+        value = message.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+            raise TypeError(f'{key} is not an integer: {value!r}')
+
+class IngestEngine:
+    def __init__(self, history_size=100000, alert_window=30, alert_rate=6, archive=None, reorder_window=64,
+                 detectors=None, share_group=None, metrics=None, sender=None, max_events=1000,
+                 aggregate=None, publish_aggregates=False, aggregate_history=10000, transport=None):
+        """
+        Everything the subscriber does with a reading, without any GUI.
+
+        Readings arrive through on_message, from paho's network thread or
+        any other feeder, and go through decoding, loss and reorder
+        tracking, the wild data detectors, the archive, alerts and the
+        history store at full speed. Consumers never read that state
+        directly: they poll snapshot(), an immutable view rebuilt only when
+        something changed, at their own pace. Errors on the hot path are
+        counted in subscriber_errors_total and kept as events in a bounded
+        buffer that consumers read with events(); nothing here blocks or
+        waits on a consumer.
+
+        Parameters:
+        history_size (int): Readings kept per sensor.
+        alert_window (float): Seconds alerts are collected into one email.
+        alert_rate (float): Most alert emails per minute.
+        archive (str): Directory to archive received readings in.
+        reorder_window (int): Readings one may arrive late by before it counts as lost.
+        detectors (str): JSON file configuring the wild data detectors per sensor.
+        share_group (str): Shared subscription group to split load with other subscribers.
+        metrics (MetricsRegistry): Where to record counts and latencies.
+        sender (SmtpSender): Sends the alert emails; SmtpSender() by default.
+        max_events (int): Events kept for consumers that have not read them.
+        aggregate (list): Window specs to summarize readings over (see
+            group_5_aggregate); None for no aggregation.
+        publish_aggregates (bool): Also publish the summaries to their
+            derived topics on the broker.
+        aggregate_history (int): Summaries kept per derived topic.
+        transport: Transport to receive on, or its URL (see
+            group_5_transport.open_transport); None for TRANSPORT_URL.
+        """
+        self.share_group = share_group
+        self.topic = None
+        self.transport = open_transport(transport) if transport is None or isinstance(transport, str) else transport
+        self.transport.on_error = lambda title, message: self.report('transport', title, message)
+        # The history and archive bring in numpy, so it is loaded when an
+        # engine is made rather than when this module is imported
+        from group_5_registry import SensorRegistry
+
+        self.registry = SensorRegistry(history_size, reorder_window)
+        self.history = self.registry.history
+        # Every received reading is also kept on disk when an archive is given
+        self.archive = None
+        if archive:
+            from group_5_archive import Archive, FLAG_GAP, FLAG_WILD
+
+            self.archive = Archive(archive)
+            self.__archive_flags = (FLAG_GAP, FLAG_WILD)
+        # Streaming detectors decide what is wild, per sensor
+        self.detectors = AnomalyEngine.from_file(detectors) if detectors else AnomalyEngine()
+        self.__decoder = PayloadDecoder()
+        # Summaries of the readings that reach the history
+        self.aggregates = None
+        if aggregate is not None:
+            self.aggregates = Aggregator(aggregate, self.__publish_aggregate if publish_aggregates else None,
+                                         aggregate_history)
+
+        # Latency per sensor and stage: transport (sent to received, across
+        # hosts so only as good as their clock sync) and decode; consumers
+        # that draw add render and total
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.metrics.describe('subscriber_readings_total', 'counter', 'Readings received per sensor')
+        self.metrics.describe('subscriber_missing_total', 'counter', 'Missing readings detected per sensor')
+        self.metrics.describe('subscriber_wild_total', 'counter', 'Wild readings received per sensor')
+        self.metrics.describe('subscriber_duplicates_total', 'counter', 'Duplicate readings dropped per sensor')
+        self.metrics.describe('subscriber_reordered_total', 'counter', 'Readings received out of order within the reorder window')
+        self.metrics.describe('subscriber_late_total', 'counter', 'Readings received after being counted lost')
+        self.metrics.describe('subscriber_errors_total', 'counter', 'Errors per kind (decode, data, email, transport)')
+        self.metrics.describe('subscriber_latency_seconds', 'summary',
+                              'Receive path latency per sensor and stage (transport, decode, render, total)')
+
+        # Alerts are queued and emailed as digests by a background thread
+        self.alerts = AlertDispatcher(
+            sender if sender is not None else SmtpSender(), window=alert_window, max_per_minute=alert_rate,
+            on_error=lambda e: self.report('email', "Email Error", f"Failed to send email notification: {e}")
+        ).start()
+
+        # Written only by the ingest thread; a snapshot copies the dict
+        self.__frozen = {}
+        self.__version = 0
+        self.__snapshot = None
+        self.__events = deque(maxlen=max_events)
+        self.__event_id = 0
+        self.__events_lock = threading.Lock()
+
+    def report(self, kind, title, message):
+        """Count an error and keep it as an event; safe to call from any thread."""
+        self.metrics.inc('subscriber_errors_total', kind=kind)
+        with self.__events_lock:
+            self.__event_id += 1
+            self.__events.append(Event(self.__event_id, time.time(), kind, title, message))
+
+    def events(self, after=0):
+        """Events with an id above after, oldest first; older ones may have been dropped."""
+        with self.__events_lock:
+            return [event for event in self.__events if event.id > after]
+
+    def snapshot(self):
+        """The current Snapshot, the same object until something changes."""
+        version = self.__version
+        snapshot = self.__snapshot
+        if snapshot is None or snapshot.version != version or snapshot.last_event != self.__event_id:
+            # Copying a dict into a dict runs without releasing the GIL, so
+            # the ingest thread cannot add a sensor halfway through
+            snapshot = self.__snapshot = Snapshot(version, MappingProxyType(dict(self.__frozen)),
+                                                  self.__event_id)
+        return snapshot
+
+    def subscription(self):
+        # With a share group the broker splits the topic's messages between
+        # every subscriber in the group instead of copying them to each
+        if self.share_group:
+            return f'$share/{self.share_group}/{self.topic}'
+        return self.topic
+
+    def clear(self):
+        """Forget every sensor; only while nothing is being ingested."""
+        self.registry.clear()
+        self.detectors.clear()
+        if self.aggregates is not None:
+            self.aggregates.clear()
+        self.__frozen.clear()
+        self.__version += 1
+
+    def start(self, topic):
+        """Connect the transport and ingest everything published on topic."""
+        self.topic = topic
+        self.transport.subscribe(self.subscription(), self.on_message)
+        self.transport.connect()
+        logger.info('Starting: %s', topic)
+
+    def stop(self):
+        """Stop receiving and flush the archive."""
+        if self.topic is not None:
+            self.transport.unsubscribe(self.subscription())
+            self.transport.close()
+        if self.archive is not None:
+            self.archive.flush()
+
+    def close(self):
+        self.alerts.stop(timeout=1)
+        if self.archive is not None:
+            self.archive.close()
+
+    def __publish_aggregate(self, topic, payload):
+        if self.topic is not None:
+            self.transport.publish(topic, payload)
+
+    def on_message(self, mqttc, userdata, msg):
+        if DERIVED in msg.topic:
+            # Summaries published by this or another subscriber, not readings
+            return
+        received_at = time.time()
+        try:
+            state = self.registry[msg.topic]
+            start = time.perf_counter()
+            decoded = self.__decoder.decode(msg.topic, msg.payload)
+            self.metrics.observe('subscriber_latency_seconds', time.perf_counter() - start,
+                                 sensor=msg.topic, stage='decode')
+            for message in decoded:
+                check_reading(message)
+                state.last_message = message
+                state.received_at = received_at
+                state.sent_at = message.get('sentAt')
+                self.metrics.inc('subscriber_readings_total', sensor=msg.topic)
+                if state.sent_at is not None:
+                    self.metrics.observe('subscriber_latency_seconds', received_at - state.sent_at,
+                                         sensor=msg.topic, stage='transport')
+                self.update_data(message['packetId'], message['interval'], message['temp'], msg.topic,
+                                 message.get('seq'), message.get('run'))
+        except CodecError as e:
+            messages.error('Decode Error: %s', e)
+            self.report('decode', "Data Error", "Failed to decode the received data.")
+        except KeyError as e:
+            messages.error('Missing key in JSON data: %s', e)
+            self.report('data', "Data Error", f"Received data is missing key: {e}")
+        except (TypeError, ValueError, AttributeError) as e:
+            # Valid JSON that is not a reading, e.g. a stray publisher on '#'
+            messages.error('Not a reading: %s', e)
+            self.report('data', "Data Error", f"Received data is not a reading: {e}")
+
+    def update_data(self, packetId, interval, newTemp, sensor=None, seq=None, run=None):
+        if sensor is None:
+            sensor = self.topic
+        state = self.registry[sensor]
+        self.__ingest(state, packetId, interval, newTemp, seq, run)
+        self.__frozen[sensor] = SensorSnapshot(sensor, state.last_message, state.received, state.missing,
+                                               state.wild, state.sent_at, state.received_at, state.appended)
+        self.__version += 1
+
+    def __ingest(self, state, packetId, interval, newTemp, seq, run):
+        sensor = state.topic
+        gap = False
+        in_order = True
+        if seq:
+            # Sequence numbers give exact losses whatever the timing jitter;
+            # a reading only counts as lost once the reorder window has passed it
+            tracker = state.sequence
+            lost = tracker.lost
+            status = tracker.observe(seq, run)
+            if status == DUPLICATE:
+                self.metrics.inc('subscriber_duplicates_total', sensor=sensor)
+                return
+            if status == GAP:
+                gap = True
+            elif status == REORDERED:
+                self.metrics.inc('subscriber_reordered_total', sensor=sensor)
+            elif status == LATE:
+                self.metrics.inc('subscriber_late_total', sensor=sensor)
+            # History and archive stay in time order, so stragglers are only counted
+            in_order = status not in (REORDERED, LATE)
+            newly_lost = tracker.lost - lost
+            if newly_lost:
+                messages.warning('Missing Detected!')
+                self.metrics.inc('subscriber_missing_total', newly_lost, sensor=sensor)
+                self.alerts.submit(sensor, 'Missing Data Alert',
+                                   f'Missing data detected. {newly_lost} reading(s) lost. Packet ID: {packetId}')
+            state.missing = tracker.missing
+        elif (state.last_received > 0 and
+              (packetId - state.last_received) > (interval * 1000 * 1.1)):
+            # Readings without sequence numbers fall back to timing
+            messages.warning('Missing Detected!')
+            state.missing += 1
+            self.metrics.inc('subscriber_missing_total', sensor=sensor)
+            gap = True
+            self.alerts.submit(sensor, 'Missing Data Alert', f'Missing data detected. Packet ID: {packetId}')
+
+        state.received += 1
+        if in_order:
+            state.last_received = packetId
+
+        # Wild Data is not added to dataset
+        reason = self.detectors.check(sensor, packetId, newTemp)
+        wild = reason is not None
+        if self.archive is not None and in_order:
+            gap_flag, wild_flag = self.__archive_flags
+            self.archive.append(sensor, packetId, newTemp, (gap_flag if gap else 0) | (wild_flag if wild else 0))
+        if wild:
+            messages.warning('Wild Detected!')
+            state.wild += 1
+            self.metrics.inc('subscriber_wild_total', sensor=sensor)
+            self.alerts.submit(sensor, 'Wild Data Alert', f'Wild data detected. Temperature: {newTemp} ({reason})')
+            return
+        if not in_order:
+            return
+
+        if sensor not in self.history:
+            logger.info('History for %s: %d readings, %.1f MB', sensor,
+                        self.history.capacity, self.history[sensor].nbytes / 1e6)
+        self.history.append(sensor, packetId, newTemp)
+        state.appended += 1
+        if self.aggregates is not None:
+            self.aggregates.add(sensor, packetId, newTemp)
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    # TRANSPORT_URL and the SMTP settings
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Ingest sensor readings without a GUI')
+    parser.add_argument("--topic", help="Topic or wildcard to subscribe to, e.g. 'sensor/+'", default='#', type=str)
+    parser.add_argument("--transport", help="mqtt://host:port, udp://host:port or loopback://hub; "
+                        "TRANSPORT_URL by default", type=str)
+    parser.add_argument("--history-size", help="Readings kept per sensor", default=100000, type=int)
+    parser.add_argument("--alert-window", help="Seconds alerts are collected into one email", default=30, type=float)
+    parser.add_argument("--alert-rate", help="Maximum alert emails per minute, 0 for none", default=6, type=float)
+    parser.add_argument("--share-group", help="Shared subscription group to split load with other subscribers", type=str)
+    parser.add_argument("--archive", help="Directory to archive received readings in", type=str)
+    parser.add_argument("--metrics-port", help="Serve Prometheus metrics on this local port", type=int)
+    parser.add_argument("--reorder-window", help="Readings one may arrive late by before it counts as lost", default=64, type=int)
+    parser.add_argument("--detectors", help="JSON file configuring the wild data detectors per sensor", type=str)
+    parser.add_argument("--aggregate", help="Summarize readings over these windows, e.g. 1m or 1h/1m for sliding",
+                        nargs='*', metavar='WINDOW')
+    parser.add_argument("--publish-aggregates", help="Publish the summaries to <sensor>/agg/<window>",
+                        action='store_true')
+    parser.add_argument("--status", help="Seconds between status lines", default=5, type=float)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging('Subscriber.log', json_lines=args.log_json,
+                  sample_every=args.log_sample, max_per_second=args.log_rate)
+
+    engine = IngestEngine(history_size=args.history_size, alert_window=args.alert_window,
+                          alert_rate=args.alert_rate, archive=args.archive, reorder_window=args.reorder_window,
+                          detectors=args.detectors, share_group=args.share_group,
+                          aggregate=(args.aggregate or DEFAULT_WINDOWS) if args.aggregate is not None else None,
+                          publish_aggregates=args.publish_aggregates, transport=args.transport)
+    server = MetricsServer(engine.metrics, args.metrics_port).start() if args.metrics_port is not None else None
+    engine.start(args.topic)
+    # The status line is just another consumer polling snapshots
+    last_event = 0
+    try:
+        while True:
+            time.sleep(args.status)
+            snapshot = engine.snapshot()
+            sensors = snapshot.sensors.values()
+            print(f'{len(snapshot.sensors)} sensors, {sum(s.received for s in sensors)} readings, '
+                  f'{sum(s.missing for s in sensors)} missing, {sum(s.wild for s in sensors)} wild')
+            for event in engine.events(last_event):
+                print(f'{event.title}: {event.message}')
+                last_event = event.id
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+        engine.close()
+        if server is not None:
+            server.stop()
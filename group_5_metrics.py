@@ -0,0 +1,202 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sub-bucket bits of the latency histograms: every power of two is split into
+# 2**(SUB_BITS - 1) buckets, so a reported value is within 1/128 of the truth.
+SUB_BITS = 7
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+class LatencyHistogram:
+    def __init__(self):
+        """
+        HDR-style histogram of latencies in whole microseconds.
+
+        Values below 2**SUB_BITS us get a bucket each; above that the bucket
+        width doubles with every power of two, so the relative error is
+        bounded whatever the range. Buckets are kept sparsely in a dict, so
+        an idle or narrow histogram costs a few entries.
+        """
+        self.counts = {}
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def record(self, micros):
+        micros = max(int(micros), 0)
+        shift = max(micros.bit_length() - SUB_BITS, 0)
+        key = (shift << SUB_BITS) | (micros >> shift)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.sum += micros
+        if self.min is None or micros < self.min:
+            self.min = micros
+        if self.max is None or micros > self.max:
+            self.max = micros
+
+    @staticmethod
+    def bucket_value(key):
+        """Midpoint in us of the values that land in bucket key."""
+        shift, mantissa = key >> SUB_BITS, key & ((1 << SUB_BITS) - 1)
+        return (mantissa << shift) + ((1 << shift) - 1) / 2
+
+    def percentile(self, q):
+        """Value in us at quantile q (0 to 1), or None when empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                return min(max(self.bucket_value(key), self.min), self.max)
+        return self.max
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escape = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+    pairs = (f'{k}="{str(v).translate(escape)}"' for k, v in labels)
+    return '{' + ','.join(pairs) + '}'
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        Thread-safe counters, gauges and latency histograms, rendered in the
+        Prometheus text format.
+
+        Series are identified by a metric name plus keyword labels, e.g.
+        observe('latency_seconds', 0.002, sensor='sensor1', stage='decode').
+        Histograms are exported as summaries (quantiles, _sum and _count in
+        seconds).
+        """
+        self.__lock = threading.Lock()
+        self.__help = {}
+        self.__values = {}
+        self.__histograms = {}
+
+    def describe(self, name, kind, help_text):
+        """Set the TYPE (counter, gauge or summary) and HELP of a metric."""
+        self.__help[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__values[key] = self.__values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__values[key] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = LatencyHistogram()
+            histogram.record(seconds * 1e6)
+
+    def histogram(self, name, **labels):
+        """Copy of one histogram series, or of all of them merged when no labels are given."""
+        merged = LatencyHistogram()
+        with self.__lock:
+            for (series, series_labels), histogram in self.__histograms.items():
+                if series == name and set(labels.items()) <= set(series_labels):
+                    merged.merge(histogram)
+        return merged
+
+    def render(self):
+        with self.__lock:
+            values = sorted(self.__values.items())
+            histograms = [(key, LatencyHistogram()) for key in sorted(self.__histograms)]
+            for key, copy in histograms:
+                copy.merge(self.__histograms[key])
+
+        lines, described = [], set()
+
+        def header(name, default_kind):
+            if name not in described:
+                described.add(name)
+                kind, help_text = self.__help.get(name, (default_kind, ''))
+                if help_text:
+                    lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in values:
+            header(name, 'untyped')
+            lines.append(f'{name}{_labels(labels)} {value}')
+        for (name, labels), histogram in histograms:
+            header(name, 'summary')
+            for q in QUANTILES:
+                value = histogram.percentile(q) / 1e6
+                lines.append(f'{name}{_labels(labels + (("quantile", q),))} {value:.6g}')
+            lines.append(f'{name}_sum{_labels(labels)} {histogram.sum / 1e6:.6f}')
+            lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+def _handler():
+    # http.server costs tens of ms to import and only a served registry needs it
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = self.server.registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug('Metrics request: ' + format, *args)
+
+    return MetricsHandler
+
+class MetricsServer:
+    def __init__(self, registry, port=0, host='127.0.0.1'):
+        """
+        Serve a MetricsRegistry at http://host:port/metrics for Prometheus.
+
+        Parameters:
+        registry (MetricsRegistry): Metrics to serve.
+        port (int): Port to listen on; 0 picks a free one.
+        host (str): Interface to listen on, local only by default.
+        """
+        from http.server import ThreadingHTTPServer
+
+        self.__server = ThreadingHTTPServer((host, port), _handler())
+        self.__server.daemon_threads = True
+        self.__server.registry = registry
+        self.registry = registry
+
+    @property
+    def server_address(self):
+        return self.__server.server_address
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.__server.serve_forever, name='metrics', daemon=True).start()
+        logger.info('Serving metrics on http://%s:%d/metrics', *self.server_address[:2])
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
@@ -0,0 +1,427 @@
+import os
+import time
+import struct
+import logging
+import threading
+from collections import deque
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+# qos, topic length, payload length
+RECORD = struct.Struct('<BHI')
+CURSOR = struct.Struct('<QQ')
+
+class SegmentLog:
+    def __init__(self, path, segment_bytes=4 << 20, max_bytes=1 << 30):
+        """
+        Disk-backed FIFO of (topic, payload, qos) records in segment files.
+
+        Records are appended to the newest segment and read from the oldest;
+        a segment is deleted once read to the end and committed. The read
+        position is kept in a cursor file, so records spilled before a
+        restart are sent after it. Records read but not committed when the
+        process dies are read again, so delivery is at least once.
+
+        Parameters:
+        path (str): Directory holding the segments.
+        segment_bytes (int): Size at which a new segment is started.
+        max_bytes (int): Most bytes kept; beyond that the oldest segments
+            are dropped, counted in dropped.
+        """
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        os.makedirs(path, exist_ok=True)
+        self.__cursor_path = os.path.join(path, 'cursor')
+        self.__segments = sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith('.seg'))
+        read_segment, read_offset = 0, 0
+        if os.path.exists(self.__cursor_path):
+            with open(self.__cursor_path, 'rb') as f:
+                data = f.read(CURSOR.size)
+            if len(data) == CURSOR.size:
+                read_segment, read_offset = CURSOR.unpack(data)
+        self.__segments = [s for s in self.__segments if s >= read_segment]
+        if not self.__segments or self.__segments[0] != read_segment:
+            read_offset = 0
+        # Records and bytes not yet committed, per segment
+        self.__counts = {}
+        self.__sizes = {}
+        for segment in self.__segments:
+            offset = read_offset if segment == self.__segments[0] else 0
+            count, end = self.__scan(segment, offset)
+            self.__counts[segment] = count
+            self.__sizes[segment] = end - offset
+            # A record cut short by a crash is dropped from the segment
+            with open(self.__file(segment), 'ab') as f:
+                f.truncate(end)
+        self.__committed = (self.__segments[0], read_offset) if self.__segments else None
+        self.__pending = None
+        self.__writer = None
+        self.__reader = None
+
+    def __file(self, segment):
+        return os.path.join(self.path, f'{segment:012d}.seg')
+
+    def __scan(self, segment, offset):
+        count = 0
+        with open(self.__file(segment), 'rb') as f:
+            f.seek(offset)
+            while True:
+                head = f.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    break
+                _, topic_len, payload_len = RECORD.unpack(head)
+                body = f.read(topic_len + payload_len)
+                if len(body) < topic_len + payload_len:
+                    break
+                count += 1
+                offset += RECORD.size + topic_len + payload_len
+        return count, offset
+
+    def __len__(self):
+        return sum(self.__counts.values())
+
+    @property
+    def nbytes(self):
+        return sum(self.__sizes.values())
+
+    def append(self, topic, payload, qos=0):
+        topic = topic.encode()
+        if self.__writer is None or self.__writer.tell() >= self.segment_bytes:
+            self.__roll()
+        segment = self.__segments[-1]
+        self.__writer.write(RECORD.pack(qos, len(topic), len(payload)) + topic + payload)
+        self.__counts[segment] += 1
+        self.__sizes[segment] += RECORD.size + len(topic) + len(payload)
+        while self.nbytes > self.max_bytes and len(self.__segments) > 1:
+            self.__drop_oldest()
+
+    def __roll(self):
+        if self.__writer is not None:
+            self.__writer.close()
+        segment = self.__segments[-1] + 1 if self.__segments else 0
+        self.__segments.append(segment)
+        self.__counts[segment] = 0
+        self.__sizes[segment] = 0
+        if self.__committed is None:
+            self.__committed = (segment, 0)
+        self.__writer = open(self.__file(segment), 'ab')
+
+    def __drop_oldest(self):
+        segment = self.__segments.pop(0)
+        self.dropped += self.__counts.pop(segment)
+        del self.__sizes[segment]
+        self.__close_reader()
+        os.remove(self.__file(segment))
+        self.__committed = (self.__segments[0], 0)
+        self.__pending = None
+        self.__save_cursor()
+        logger.warning('Spill log over %d bytes, dropped segment %d', self.max_bytes, segment)
+
+    def __close_reader(self):
+        if self.__reader is not None:
+            self.__reader[1].close()
+            self.__reader = None
+
+    def read(self, count):
+        """
+        Up to count of the oldest records, as (topic, payload, qos) tuples.
+
+        They stay in the log until commit is called; the next read without
+        a commit returns them again.
+        """
+        if self.__committed is None:
+            return []
+        if self.__writer is not None:
+            self.__writer.flush()
+        segment, offset = self.__committed
+        records = []
+        while len(records) < count:
+            if self.__reader is None or self.__reader[0] != segment:
+                self.__close_reader()
+                self.__reader = (segment, open(self.__file(segment), 'rb'))
+            f = self.__reader[1]
+            f.seek(offset)
+            while len(records) < count:
+                head = f.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    break
+                qos, topic_len, payload_len = RECORD.unpack(head)
+                body = f.read(topic_len + payload_len)
+                records.append((body[:topic_len].decode(), body[topic_len:], qos))
+                offset += RECORD.size + topic_len + payload_len
+            if len(records) == count:
+                break
+            later = [s for s in self.__segments if s > segment]
+            if not later:
+                break
+            segment, offset = later[0], 0
+        self.__pending = (segment, offset, len(records))
+        return records
+
+    def commit(self):
+        """Remove the records returned by the last read."""
+        if self.__pending is None:
+            return
+        segment, offset, count = self.__pending
+        self.__pending = None
+        start_segment, start_offset = self.__committed
+        # Segments read past are used up
+        for done in [s for s in self.__segments if s < segment]:
+            count -= self.__counts[done]
+            self.__segments.remove(done)
+            del self.__counts[done], self.__sizes[done]
+            os.remove(self.__file(done))
+        self.__counts[segment] -= count
+        self.__sizes[segment] -= offset - (start_offset if segment == start_segment else 0)
+        self.__committed = (segment, offset)
+        if segment != self.__segments[-1] and offset and not self.__counts[segment]:
+            # Read to the end of a finished segment
+            self.__segments.remove(segment)
+            del self.__counts[segment], self.__sizes[segment]
+            self.__close_reader()
+            os.remove(self.__file(segment))
+            self.__committed = (self.__segments[0], 0)
+        self.__save_cursor()
+
+    def __save_cursor(self):
+        with open(self.__cursor_path + '.tmp', 'wb') as f:
+            f.write(CURSOR.pack(*self.__committed))
+        os.replace(self.__cursor_path + '.tmp', self.__cursor_path)
+
+    def flush(self):
+        if self.__writer is not None:
+            self.__writer.flush()
+
+    def close(self):
+        self.__close_reader()
+        if self.__writer is not None:
+            self.__writer.close()
+            self.__writer = None
+
+class Outbox:
+    def __init__(self, client, max_inflight=100, max_queued=10000, spill_dir=None,
+                 spill_bytes=1 << 30, flush_rate=1000, high_water=0.5, min_scale=0.1,
+                 metrics=None):
+        """
+        Bounded, backpressure-aware publishing through a paho client.
+
+        At most max_inflight messages are handed to paho and not yet written
+        (QoS 0) or acknowledged (QoS 1/2), counted through on_publish, so
+        paho's own queue stays bounded. Messages beyond that, or sent while
+        the broker is unreachable, wait in a queue of max_queued messages;
+        when it is full they spill to a SegmentLog on disk, or without a
+        spill_dir the oldest are dropped. Queued messages are sent oldest
+        first, at most flush_rate per second, so a reconnect drains a
+        backlog without flooding the broker. QoS 0 messages paho had not yet
+        written when the connection dropped are queued again.
+
+        rate_scale is an AIMD control for the producer: it halves, down to
+        min_scale, while the backlog is over high_water of max_queued, and
+        grows back by a tenth once the backlog is gone. Producers divide
+        their send rate by it to degrade gracefully rather than build up an
+        unbounded backlog.
+
+        The client's on_connect, on_disconnect and on_publish callbacks are
+        wrapped; callbacks set before keep being called.
+
+        Parameters:
+        client (mqtt.Client): Client, not yet connected.
+        max_inflight (int): Messages handed to paho at once.
+        max_queued (int): Messages queued in memory.
+        spill_dir (str): Directory to spill to; None drops the oldest.
+        spill_bytes (int): Most bytes kept in the spill directory.
+        flush_rate (float): Most queued messages sent per second.
+        high_water (float): Fraction of max_queued at which the rate backs off.
+        min_scale (float): Lowest rate_scale.
+        metrics (MetricsRegistry): Where to report queue gauges and counts.
+        """
+        self.client = client
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.flush_rate = flush_rate
+        self.high_water = high_water
+        self.min_scale = min_scale
+        self.rate_scale = 1.0
+        self.sent = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.metrics = metrics
+        self.__spill = SegmentLog(spill_dir, max_bytes=spill_bytes) if spill_dir else None
+        self.__queue = deque()
+        # mid -> (topic, payload, qos) of messages paho has not finished with
+        self.__inflight = {}
+        self.__connected = False
+        # Reentrant: without a network thread paho calls on_publish from
+        # inside publish
+        self.__lock = threading.RLock()
+        self.__wake = threading.Condition(self.__lock)
+        self.__closed = False
+
+        self.__on_connect = client.on_connect
+        self.__on_disconnect = client.on_disconnect
+        self.__on_publish = client.on_publish
+        client.on_connect = self.on_connect
+        client.on_disconnect = self.on_disconnect
+        client.on_publish = self.on_publish
+        client.max_inflight_messages_set(max_inflight)
+
+        if metrics is not None:
+            metrics.describe('outbox_queued', 'gauge', 'Messages waiting to be handed to paho, in memory and spilled')
+            metrics.describe('outbox_inflight', 'gauge', 'Messages handed to paho and not yet written or acknowledged')
+            metrics.describe('outbox_rate_scale', 'gauge', 'Fraction of the normal send rate producers should use')
+            metrics.describe('outbox_spilled_total', 'counter', 'Messages spilled to disk')
+            metrics.describe('outbox_dropped_total', 'counter', 'Messages dropped because every buffer was full')
+        self.__drainer = threading.Thread(target=self.__drain_loop, name='outbox', daemon=True)
+        self.__drainer.start()
+
+    @property
+    def backlog(self):
+        """Messages waiting to be handed to paho."""
+        return len(self.__queue) + (len(self.__spill) if self.__spill is not None else 0)
+
+    @property
+    def inflight(self):
+        return len(self.__inflight)
+
+    def on_connect(self, client, userdata, flags, reason, properties):
+        with self.__lock:
+            self.__connected = not reason.is_failure
+            self.__wake.notify()
+        if self.__on_connect is not None:
+            self.__on_connect(client, userdata, flags, reason, properties)
+
+    def on_disconnect(self, client, userdata, flags, reason, properties):
+        with self.__lock:
+            self.__connected = False
+            # QoS 0 messages paho had not written are gone with the socket;
+            # QoS 1/2 ones are resent by paho on reconnect
+            lost = [mid for mid, message in self.__inflight.items() if message[2] == 0]
+            for mid in reversed(lost):
+                self.__queue.appendleft(self.__inflight.pop(mid))
+        if self.__on_disconnect is not None:
+            self.__on_disconnect(client, userdata, flags, reason, properties)
+
+    def on_publish(self, client, userdata, mid, reason, properties):
+        with self.__lock:
+            if self.__inflight.pop(mid, None) is not None:
+                self.sent += 1
+                if self.backlog:
+                    self.__wake.notify()
+        if self.__on_publish is not None:
+            self.__on_publish(client, userdata, mid, reason, properties)
+
+    def publish(self, topic, payload, qos=0):
+        """
+        Send a message now if there is room in flight and nothing is queued
+        ahead of it, else queue it. Never blocks on the network.
+
+        Returns:
+        bool: True if handed to paho now, False if queued, spilled or dropped.
+        """
+        with self.__lock:
+            if self.__connected and self.backlog == 0 and len(self.__inflight) < self.max_inflight:
+                if self.__send((topic, payload, qos)):
+                    return True
+            self.__enqueue((topic, payload, qos))
+            return False
+
+    def __send(self, message):
+        # Called with the lock held, so paho's network thread cannot run
+        # on_publish for the mid before it is recorded
+        info = self.client.publish(message[0], message[1], qos=message[2])
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        if info.is_published():
+            self.sent += 1
+        else:
+            self.__inflight[info.mid] = message
+        return True
+
+    def __enqueue(self, message):
+        spilling = self.__spill is not None and len(self.__spill)
+        if not spilling and len(self.__queue) < self.max_queued:
+            self.__queue.append(message)
+        elif self.__spill is not None:
+            # Once spilling, everything goes to disk until it is drained,
+            # which keeps the messages in order
+            self.__spill.append(*message)
+            self.spilled += 1
+        else:
+            self.__queue.popleft()
+            self.__queue.append(message)
+            self.dropped += 1
+
+    def __drain_loop(self):
+        tokens = 0.0
+        last = time.monotonic()
+        adjusted = last
+        while True:
+            with self.__wake:
+                if self.__closed:
+                    return
+                self.__wake.wait(0.05)
+                now = time.monotonic()
+                tokens = min(tokens + (now - last) * self.flush_rate, max(self.flush_rate / 10, 1))
+                last = now
+                while (self.__connected and tokens >= 1 and self.backlog and
+                       len(self.__inflight) < self.max_inflight):
+                    sent = self.__drain(min(int(tokens), self.max_inflight - len(self.__inflight)))
+                    if not sent:
+                        break
+                    tokens -= sent
+                if now - adjusted >= 0.5:
+                    adjusted = now
+                    self.__adjust_rate()
+
+    def __drain(self, count):
+        # Memory queue first, it holds the oldest messages
+        sent = 0
+        while sent < count and self.__queue:
+            if not self.__send(self.__queue[0]):
+                return sent
+            self.__queue.popleft()
+            sent += 1
+        if sent < count and self.__spill is not None and len(self.__spill):
+            records = self.__spill.read(count - sent)
+            for i, record in enumerate(records):
+                if not self.__send(record):
+                    # The spill is committed past every record read, so the
+                    # unsent ones move to the memory queue, empty when the
+                    # spill is read, and go out first next time
+                    self.__queue.extend(records[i:])
+                    break
+                sent += 1
+            self.__spill.commit()
+        return sent
+
+    def __adjust_rate(self):
+        backlog = self.backlog
+        if backlog > self.high_water * self.max_queued:
+            self.rate_scale = max(self.rate_scale / 2, self.min_scale)
+        elif backlog == 0 and self.rate_scale < 1:
+            self.rate_scale = min(self.rate_scale + 0.1, 1.0)
+        if self.__spill is not None:
+            self.__spill.flush()
+            self.dropped += self.__spill.dropped
+            self.__spill.dropped = 0
+        if self.metrics is not None:
+            self.metrics.set('outbox_queued', backlog)
+            self.metrics.set('outbox_inflight', len(self.__inflight))
+            self.metrics.set('outbox_rate_scale', self.rate_scale)
+            self.metrics.set('outbox_spilled_total', self.spilled)
+            self.metrics.set('outbox_dropped_total', self.dropped)
+
+    def close(self, timeout=5):
+        """Wait up to timeout seconds for the backlog to drain, then stop."""
+        end = time.monotonic() + timeout
+        while (self.backlog or self.__inflight) and self.__connected and time.monotonic() < end:
+            time.sleep(0.05)
+        with self.__wake:
+            self.__closed = True
+            self.__wake.notify()
+        self.__drainer.join(1)
+        if self.__spill is not None:
+            self.__spill.close()
@@ -1,4 +1,3 @@
-import json
 import threading
 import random
 from tkinter import *
@@ -7,15 +6,20 @@ from tkinter.ttk import *
 import argparse
 import time
 import sys
-import paho.mqtt.client as mqtt
+from paho.mqtt import MQTTException
 import logging
 import socket
 
-from group_5_data_generator import SensorSimulator
+from group_5_data_generator import SensorSimulator, TracePlayer
+from group_5_codec import get_codec, CodecError, FrameBatcher, FrameFlusher
+from group_5_metrics import MetricsRegistry, MetricsServer
+from group_5_logs import SampledLogger, setup_logging, add_logging_arguments
+from group_5_outbox import Outbox
+from group_5_transport import open_transport, MqttTransport
+from group_5_sequence import new_run_id
 
-# Configure logging
-logging.basicConfig(filename='publisher.log', level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# Per-message records, thinned out with --log-sample / --log-rate
+messages = SampledLogger()
 
 class PublisherGUI(Tk):
     sensors_address = {
@@ -29,10 +33,24 @@ class PublisherGUI(Tk):
     }
     
 
-    def __init__(self, topic_name):
+    def __init__(self, topic_name, codec='json', batch_size=1, max_latency=1000, metrics_port=None,
+                 trace=None, trace_column=0, max_inflight=100, max_queued=10000, spill_dir=None,
+                 flush_rate=1000, gateway=None, transport=None):
         super().__init__()
         self.title(f'Temperature Publisher - {topic_name}')
         self.__topic = topic_name
+        # A precomputed trace replaces the simulator settings in the form
+        self.__trace = trace
+        self.__trace_column = trace_column
+        self.__codec = get_codec(codec)
+        # Batching sends compressed binary frames in place of the codec
+        self.__batcher = FrameBatcher(batch_size, max_latency) if batch_size > 1 else None
+        self.metrics = MetricsRegistry()
+        self.metrics.describe('publisher_readings_total', 'counter', 'Readings published per sensor')
+        self.metrics.describe('publisher_latency_seconds', 'summary',
+                              'Publish path latency per sensor and stage (generate, encode, publish)')
+        if metrics_port is not None:
+            MetricsServer(self.metrics, metrics_port).start()
 
         # Initialize UI
         self.create_vars()
@@ -44,17 +62,30 @@ class PublisherGUI(Tk):
             random_value = random.randint(1000, 9999)
             return f'pub_demo_{timestamp}_{random_value}'
 
-        # Create Mqtt client
-        self.mqttc = mqtt.Client(
-            mqtt.CallbackAPIVersion.VERSION2,
-            client_id= generate_client_id(),
-            protocol=mqtt.MQTTv5
-        )
-        # Register callbacks
-        self.mqttc.on_connect = self.on_connect
-        self.mqttc.on_disconnect = self.on_disconnect
-        self.mqttc.on_message = self.on_message
-        self.mqttc.on_publish = self.on_publish
+        self.mqttc = None
+        self.__transport = None
+        if gateway:
+            # A local gateway holds the broker connection for many
+            # publishers; its module brings in asyncio, so only when used
+            from group_5_gateway import GatewayClient
+
+            self.__sender = GatewayClient(gateway)
+        else:
+            # --transport, else TRANSPORT_URL, else the public broker
+            self.__transport = open_transport(transport, client_id=generate_client_id())
+            self.__sender = self.__transport
+        if isinstance(self.__transport, MqttTransport):
+            # Register callbacks
+            self.mqttc = self.__transport.client
+            self.mqttc.on_connect = self.on_connect
+            self.mqttc.on_disconnect = self.on_disconnect
+            self.mqttc.on_message = self.on_message
+            self.mqttc.on_publish = self.on_publish
+            # Bounded publishing: queues and spills while the broker is slow
+            # or down, and tells run to slow down through rate_scale
+            self.__sender = Outbox(self.mqttc, max_inflight=max_inflight, max_queued=max_queued,
+                                   spill_dir=spill_dir, flush_rate=flush_rate, metrics=self.metrics)
+        self.__network_started = False
 
     def configureResizable(self):
         max_row = 12
@@ -201,14 +232,16 @@ class PublisherGUI(Tk):
                     logging.warning("Max cycle not greater than min cycle: Min %d, Max %d", parsedMinCycle, parsedMaxCycle)
                     return
 
-                # Connect to MQTT broker
-                try:
-                    self.mqttc.connect(host='broker.hivemq.com', port=1883)
-                    logging.info("MQTT client connected")
-                except (socket.error, mqtt.MQTTException) as e:
-                    messagebox.showinfo(title='Information', message=f'Error connecting to MQTT broker: {e}')
-                    logging.error("MQTT connection error: %s", e)
-                    return
+                # Connect in the background; until an MQTT broker is
+                # reachable readings are queued by the outbox
+                if not self.__network_started and self.__transport is not None:
+                    try:
+                        self.__transport.connect(background=True)
+                        self.__network_started = True
+                    except (socket.error, MQTTException) as e:
+                        messagebox.showinfo(title='Information', message=f'Error connecting to MQTT broker: {e}')
+                        logging.error("MQTT connection error: %s", e)
+                        return
 
                 # Start data publishing thread
                 thread = threading.Thread(
@@ -230,94 +263,176 @@ class PublisherGUI(Tk):
             self.__flag_status = False
 
     def run(self, parsedBase, parsedMin, parsedMax, parsedDelta, parsedMinStep, parsedMaxStep, parsedMinCycle, parsedMaxCycle, parsedName, parsedInterval):
-        tempGenerator = SensorSimulator(
-            min_value=parsedMin, max_value=parsedMax, delta=parsedDelta,
-            base_value=parsedBase, min_step=parsedMinStep, max_step=parsedMaxStep,
-            min_cycle=parsedMinCycle, max_cycle=parsedMaxCycle,
-            squiggle=self.__squiggle.get()
-        )
+        if self.__trace:
+            tempGenerator = TracePlayer(self.__trace, column=self.__trace_column)
+        else:
+            tempGenerator = SensorSimulator(
+                min_value=parsedMin, max_value=parsedMax, delta=parsedDelta,
+                base_value=parsedBase, min_step=parsedMinStep, max_step=parsedMaxStep,
+                min_cycle=parsedMinCycle, max_cycle=parsedMaxCycle,
+                squiggle=self.__squiggle.get()
+            )
         miss_transmission = random.randint(1, self.__max_iteration)
         wild_transmission = random.randint(1, self.__max_iteration)
         iteration = 0
+        seq = 0
+        # A new count each time Start is pressed, told apart by its run id
+        run = new_run_id()
+        # Frames go out on time even when a slot is skipped or Stop pressed
+        flusher = None
+        if self.__batcher is not None:
+            flusher = FrameFlusher({self.__topic: self.__batcher}, self.publish).start()
+        deadline = time.monotonic()
         while self.__flag_status:
             iteration += 1
+            # seq also counts the dropped readings, so the gap shows up
+            seq += 1
             if iteration > self.__max_iteration:
                 iteration = 0
                 miss_transmission = random.randint(1, self.__max_iteration)
                 wild_transmission = random.randint(1, self.__max_iteration)
 
             if miss_transmission == iteration:
-                time.sleep(parsedInterval)
+                deadline = self.sleep_until(deadline + parsedInterval / self.__sender.rate_scale, parsedInterval)
                 continue
 
+            start = time.perf_counter()
             temp = tempGenerator.value
             if wild_transmission == iteration:
                 temp = temp * random.randint(2,10)
+            generated = time.perf_counter()
 
             try:
-                packetId = int(time.time() * 1000)
+                sentAt = time.time()
+                packetId = int(sentAt * 1000)
                 msg_dict = {
                     "packetId": packetId,
                     "name": parsedName,
                     "ipv4": self.sensors_address[parsedName],
                     "temp": temp,
-                    "interval": parsedInterval
+                    "interval": parsedInterval,
+                    "seq": seq,
+                    "run": run,
+                    "sentAt": sentAt
                 }
-                data = json.dumps(msg_dict, indent=4, sort_keys=True, default=str)
-                self.mqttc.publish(topic=self.__topic, payload=data, qos=0)
-                self.__status.set(f'Packet Sending: {msg_dict["packetId"]}')
-                logging.info("Published message: %s", msg_dict)
-                time.sleep(parsedInterval)
+                if self.__batcher is None:
+                    data = self.__codec.encode(msg_dict)
+                else:
+                    data = self.__batcher.add(msg_dict, time.monotonic())
+                encoded = time.perf_counter()
+                if data is not None:
+                    self.__sender.publish(self.__topic, data, 0)
+                published = time.perf_counter()
+                self.metrics.inc('publisher_readings_total', sensor=self.__topic)
+                self.metrics.observe('publisher_latency_seconds', generated - start, sensor=self.__topic, stage='generate')
+                self.metrics.observe('publisher_latency_seconds', encoded - generated, sensor=self.__topic, stage='encode')
+                self.metrics.observe('publisher_latency_seconds', published - encoded, sensor=self.__topic, stage='publish')
+                backlog = self.__sender.backlog
+                if backlog:
+                    self.__status.set(f'Buffering: {backlog} queued')
+                else:
+                    self.__status.set(f'Packet Sending: {msg_dict["packetId"]}')
+                messages.info("Published message: %s", msg_dict)
+                # Readings are spaced out while the outbox backs off
+                deadline = self.sleep_until(deadline + parsedInterval / self.__sender.rate_scale, parsedInterval)
 
             except (KeyboardInterrupt, SystemExit):
-                self.mqttc.disconnect()
+                self.disconnect()
                 logging.info("MQTT client disconnected due to exit")
                 sys.exit()
-            except mqtt.MQTTException as e:
+            except MQTTException as e:
                 messagebox.showinfo(title='Information', message=f'Error publishing message: {e}')
                 logging.error("MQTT publish error: %s", e)
                 break
+            except CodecError as e:
+                messagebox.showinfo(title='Information', message=f'Error encoding message: {e}')
+                logging.error("Encoding error: %s", e)
+                break
             except socket.error as e:
                 messagebox.showinfo(title='Information', message=f'Network error: {e}')
                 logging.error("Network error: %s", e)
                 break
 
-    def on_connect(self, mqttc, userdata, flags, rc):
+        if flusher is not None:
+            flusher.stop()
+            for data in self.__batcher.flush():
+                self.publish(self.__topic, data)
+
+    @staticmethod
+    def sleep_until(deadline, interval):
+        # Sleeping to absolute deadlines keeps generation and publish time
+        # out of the period; after falling a whole interval behind, the
+        # schedule restarts from now instead of bursting to catch up
+        now = time.monotonic()
+        if deadline > now:
+            time.sleep(deadline - now)
+        elif now - deadline > interval:
+            deadline = now
+        return deadline
+
+    def on_connect(self, mqttc, userdata, flags, rc, properties):
         logging.info('Connected to MQTT broker. Return code: %s', rc)
 
     def on_disconnect(self, client, userdata, flags, reason, properties):
         logging.info('Disconnected from MQTT broker. Return code: %s', reason)
 
     def on_message(self, mqttc, userdata, msg):
-        logging.info('Received message. Topic: %s, Message: %s', msg.topic, msg.payload)
+        messages.info('Received message. Topic: %s, Message: %s', msg.topic, msg.payload)
 
     def on_publish(self, client, userdata, mid, reason, properties):
-        logging.info('Published message. MID: %s, Reason: %s', mid, reason)
+        messages.info('Published message. MID: %s, Reason: %s', mid, reason)
 
     def publish(self, topic, payload, qos=0):
         try:
-            self.mqttc.publish(topic=topic, payload=payload, qos=qos)
-            logging.info('Published message to topic: %s', topic)
-        except mqtt.MQTTException as e:
+            self.__sender.publish(topic, payload, qos)
+            messages.info('Published message to topic: %s', topic)
+        except MQTTException as e:
             logging.error("MQTT publish error: %s", e)
         except socket.error as e:
             logging.error("Network error: %s", e)
         return
 
     def disconnect(self):
+        if self.__transport is None:
+            return
         try:
-            self.mqttc.disconnect()
+            self.__transport.close()
             logging.info('MQTT client disconnected')
-        except mqtt.MQTTException as e:
+        except MQTTException as e:
             logging.error("MQTT disconnection error: %s", e)
         except socket.error as e:
             logging.error("Network error during disconnection: %s", e)
 
 if __name__ == '__main__':
+    from dotenv import load_dotenv
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--topic", help="Topic name", required=True, type=str)
+    parser.add_argument("--codec", help="Payload codec", default='json', choices=['json', 'compact', 'binary'])
+    parser.add_argument("--batch-size", help="Readings per frame, 1 disables batching", default=1, type=int)
+    parser.add_argument("--max-latency", help="Longest time in ms a reading waits in a frame", default=1000, type=float)
+    parser.add_argument("--metrics-port", help="Serve Prometheus metrics on this local port", type=int)
+    parser.add_argument("--trace", help="Play values from this precomputed trace file", type=str)
+    parser.add_argument("--trace-column", help="Column of the trace to play", default=0, type=int)
+    parser.add_argument("--max-inflight", help="Messages handed to the MQTT client at once", default=100, type=int)
+    parser.add_argument("--max-queued", help="Messages queued in memory while the broker is slow or down", default=10000, type=int)
+    parser.add_argument("--spill-dir", help="Directory to spill queued messages to when memory is full", type=str)
+    parser.add_argument("--flush-rate", help="Most queued messages sent per second after a reconnect", default=1000, type=float)
+    parser.add_argument("--gateway", help="Publish through the local gateway listening on this Unix socket", type=str)
+    parser.add_argument("--transport", help="mqtt://host:port, udp://host:port or loopback://hub; "
+                        "TRANSPORT_URL by default", type=str)
+    add_logging_arguments(parser)
     args = parser.parse_args()
-    rmPub = PublisherGUI(topic_name=args.topic)
+    # TRANSPORT_URL may be set in .env
+    load_dotenv()
+    setup_logging('publisher.log', json_lines=args.log_json,
+                  sample_every=args.log_sample, max_per_second=args.log_rate)
+    rmPub = PublisherGUI(topic_name=args.topic, codec=args.codec,
+                         batch_size=args.batch_size, max_latency=args.max_latency,
+                         metrics_port=args.metrics_port, trace=args.trace,
+                         trace_column=args.trace_column, max_inflight=args.max_inflight,
+                         max_queued=args.max_queued, spill_dir=args.spill_dir, flush_rate=args.flush_rate,
+                         gateway=args.gateway, transport=args.transport)
     rmPub.geometry("400x300")
     rmPub.minsize(width=450, height=400)
     rmPub.mainloop()
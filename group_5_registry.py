@@ -0,0 +1,58 @@
+from group_5_history import HistoryStore
+from group_5_sequence import SequenceTracker
+
+class SensorState:
+    """Everything the subscriber tracks for one sensor topic."""
+    __slots__ = ('topic', 'last_message', 'last_received', 'received', 'missing', 'wild',
+                 'sent_at', 'received_at', 'sequence', 'appended')
+
+    def __init__(self, topic, reorder_window=64):
+        self.topic = topic
+        self.last_message = None
+        self.last_received = -1
+        self.received = 0
+        self.missing = 0
+        self.wild = 0
+        # Epoch seconds the latest reading was sent and received
+        self.sent_at = None
+        self.received_at = None
+        self.sequence = SequenceTracker(reorder_window)
+        # Readings added to the history, which stops growing once full
+        self.appended = 0
+
+class SensorRegistry:
+    def __init__(self, history_size=100000, reorder_window=64):
+        """
+        Per-sensor state for a subscriber that receives many topics.
+
+        Messages arriving on one wildcard subscription are routed by topic to
+        a SensorState, created on first use, and to that topic's buffer in
+        the shared HistoryStore.
+
+        Parameters:
+        history_size (int): Readings kept in each sensor's history.
+        reorder_window (int): Sequence numbers a reading may arrive late by
+            before it counts as lost.
+        """
+        self.history = HistoryStore(history_size)
+        self.reorder_window = reorder_window
+        self.__sensors = {}
+
+    def __getitem__(self, topic):
+        state = self.__sensors.get(topic)
+        if state is None:
+            state = self.__sensors[topic] = SensorState(topic, self.reorder_window)
+        return state
+
+    def __contains__(self, topic):
+        return topic in self.__sensors
+
+    def __iter__(self):
+        return iter(list(self.__sensors))
+
+    def __len__(self):
+        return len(self.__sensors)
+
+    def clear(self):
+        self.__sensors.clear()
+        self.history.clear()
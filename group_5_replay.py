@@ -0,0 +1,288 @@
+import os
+import ast
+import json
+import time
+import heapq
+import random
+import logging
+import argparse
+import threading
+from collections import deque
+from types import SimpleNamespace
+import paho.mqtt.client as mqtt
+
+from group_5_codec import get_codec
+
+logger = logging.getLogger(__name__)
+
+PUBLISHED = 'Published message: '
+
+def _log_time(stamp, cache):
+    # Every record in the same second shares the costly strptime
+    second = stamp[:19]
+    base = cache.get(second)
+    if base is None:
+        cache.clear()
+        base = cache[second] = time.mktime(time.strptime(second, '%Y-%m-%d %H:%M:%S'))
+    return base + int(stamp[20:23]) / 1000
+
+def parse_log_line(line, cache=None):
+    """
+    The reading in one publisher.log line, or None if the line holds none.
+
+    Both the text format ('... - INFO - Published message: {dict repr}')
+    and the JSON lines format written with --log-json are understood.
+
+    Returns:
+    tuple: (timestamp in epoch seconds, message dict).
+    """
+    cache = {} if cache is None else cache
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        if entry.get('event') != PUBLISHED.rstrip(': ') or not isinstance(entry.get('data'), dict):
+            return None
+        return entry['ts'], entry['data']
+    start = line.find(PUBLISHED)
+    if start < 0 or not line.rstrip().endswith('}'):
+        return None
+    try:
+        msg_dict = ast.literal_eval(line[start + len(PUBLISHED):].strip())
+        return _log_time(line, cache), msg_dict
+    except (ValueError, SyntaxError):
+        return None
+
+def read_log(path, topic='replay/{name}'):
+    """
+    Stream the readings of a publisher log, one line at a time.
+
+    Parameters:
+    path (str): Log file.
+    topic (str): Topic of each reading, formatted with its fields; the log
+        does not record the topic it was published to.
+
+    Yields:
+    tuple: (timestamp, topic, message dict), in file order.
+    """
+    cache = {}
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parsed = parse_log_line(line, cache)
+            if parsed is not None:
+                ts, msg_dict = parsed
+                try:
+                    yield ts, topic.format(**msg_dict), msg_dict
+                except KeyError:
+                    continue
+
+def read_archive(root, sensors=None, start=None, end=None, chunk=4096):
+    """
+    Stream the readings of an Archive in time order across sensors.
+
+    Each sensor is read chunk readings at a time from its memory-mapped
+    columns and the sensors are merged on timestamp, so memory use is one
+    chunk per sensor. The archive keeps no interval, name or address, so
+    the interval is taken from the gap to the sensor's previous reading.
+
+    Parameters:
+    root (str): Archive directory.
+    sensors (list): Sensors to replay; all of them by default.
+    start (int): First timestamp in ms.
+    end (int): End timestamp (exclusive) in ms.
+    chunk (int): Readings read from disk at a time per sensor.
+
+    Yields:
+    tuple: (timestamp, topic, message dict).
+    """
+    from group_5_archive import Archive
+
+    archive = Archive(root)
+
+    def sensor_readings(sensor):
+        timestamps, temps, _ = archive.range(sensor, start, end)
+        previous = None
+        for lo in range(0, len(timestamps), chunk):
+            for ts, temp in zip(timestamps[lo:lo + chunk].tolist(), temps[lo:lo + chunk].tolist()):
+                interval = (ts - previous) / 1000 if previous is not None and ts > previous else 1.0
+                previous = ts
+                yield ts / 1000, sensor, {'packetId': ts, 'name': sensor, 'ipv4': '0.0.0.0',
+                                          'temp': temp, 'interval': interval}
+
+    try:
+        yield from heapq.merge(*(sensor_readings(sensor) for sensor in sensors or archive.sensors()),
+                               key=lambda reading: reading[0])
+    finally:
+        archive.close()
+
+def open_source(path, topic='replay/{name}'):
+    """Readings from a publisher log, or from an archive when path is a directory."""
+    if os.path.isdir(path):
+        return read_archive(path)
+    return read_log(path, topic)
+
+class MqttSink:
+    def __init__(self, host='127.0.0.1', port=1883, qos=0, codec='json', inflight=1000):
+        """
+        Republish replayed readings to an MQTT broker.
+
+        At most `inflight` messages are queued in paho or unacknowledged at
+        once; beyond that sending waits for the oldest, so replaying at max
+        speed cannot grow the client's queue without bound.
+
+        Parameters:
+        host (str): MQTT broker host.
+        port (int): MQTT broker port.
+        qos (int): QoS of every publish.
+        codec (str): Payload codec.
+        inflight (int): Messages allowed in flight.
+        """
+        self.qos = qos
+        self.__codec = get_codec(codec)
+        self.__inflight = deque()
+        self.__limit = inflight
+        self.mqttc = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=f'replay_{int(time.time())}_{random.randint(1000, 9999)}',
+            protocol=mqtt.MQTTv5
+        )
+        self.mqttc.max_inflight_messages_set(inflight)
+        self.mqttc.connect(host=host, port=port)
+        self.mqttc.loop_start()
+
+    def send(self, topic, msg_dict):
+        if len(self.__inflight) >= self.__limit:
+            self.__inflight.popleft().wait_for_publish(5)
+        self.__inflight.append(self.mqttc.publish(topic, self.__codec.encode(msg_dict), qos=self.qos))
+
+    def close(self):
+        for info in self.__inflight:
+            info.wait_for_publish(5)
+        self.__inflight.clear()
+        self.mqttc.loop_stop()
+        self.mqttc.disconnect()
+
+class SubscriberSink:
+    def __init__(self, client, codec='json'):
+        """
+        Feed replayed readings straight into a subscriber's on_message,
+        encoded as they would arrive from the broker, so its whole ingestion
+        path runs without a broker or network in between.
+
+        Parameters:
+        client: Anything with a paho style on_message(client, userdata, msg),
+            such as IngestEngine or TempClient.
+        codec (str): Payload codec.
+        """
+        self.client = client
+        self.__codec = get_codec(codec)
+
+    def send(self, topic, msg_dict):
+        self.client.on_message(None, None, SimpleNamespace(topic=topic, payload=self.__codec.encode(msg_dict)))
+
+    def close(self):
+        pass
+
+class Replayer:
+    def __init__(self, speed=1.0):
+        """
+        Re-drive recorded readings with their original spacing.
+
+        Reading i is sent at start + (ts_i - ts_0) / speed, on absolute
+        deadlines, so time spent sending never accumulates into drift and
+        the inter-arrival pattern, bursts and gaps included, is kept. A
+        speed of 0 sends as fast as the sink takes them. Each reading is
+        sent as a copy with sentAt set to the time it is replayed, so
+        latency measured downstream is that of the replay; packetId keeps
+        the original time.
+
+        Parameters:
+        speed (float): Replay speed; 1 is real time, 0 is max speed.
+        """
+        self.speed = speed
+        self.sent = 0
+        # Furthest any reading was sent behind its deadline, in seconds
+        self.max_lag = 0.0
+        self.__stop = threading.Event()
+
+    def stop(self):
+        self.__stop.set()
+
+    def run(self, readings, sink, limit=None):
+        """
+        Send readings to sink until they run out, limit is reached or stop is called.
+
+        Returns:
+        float: Seconds the replay took.
+        """
+        start = time.monotonic()
+        first = None
+        for ts, topic, msg_dict in readings:
+            if self.__stop.is_set() or (limit is not None and self.sent >= limit):
+                break
+            if self.speed:
+                if first is None:
+                    first = ts
+                deadline = start + (ts - first) / self.speed
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    # Returns early when stopped
+                    self.__stop.wait(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+            message = dict(msg_dict)
+            message['sentAt'] = time.time()
+            sink.send(topic, message)
+            self.sent += 1
+        return time.monotonic() - start
+
+def _feed_subscriber(args, readings):
+    # The GUI-free engine TempClient polls, so no display is needed
+    from group_5_ingest import IngestEngine
+
+    # Replayed anomalies must not email anyone
+    engine = IngestEngine(history_size=args.history_size,
+                          sender=SimpleNamespace(send=lambda subject, message: None))
+    replayer = Replayer(args.speed)
+    try:
+        elapsed = replayer.run(readings, SubscriberSink(engine, args.codec), args.limit)
+    except KeyboardInterrupt:
+        elapsed = 0.0
+    finally:
+        engine.close()
+    decode = engine.metrics.histogram('subscriber_latency_seconds', stage='decode')
+    print(f'decode p50 {decode.percentile(0.5):.1f} us, p99 {decode.percentile(0.99):.1f} us')
+    return replayer, elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded readings from publisher.log or an archive')
+    parser.add_argument("source", help="publisher.log style file, or an archive directory")
+    parser.add_argument("--speed", help="Replay speed: 1 is real time, N is N times faster, 0 is max speed",
+                        default=1.0, type=float)
+    parser.add_argument("--topic", help="Topic for log readings, formatted with their fields", default='replay/{name}')
+    parser.add_argument("--codec", help="Payload codec", default='json', choices=['json', 'compact', 'binary'])
+    parser.add_argument("--limit", help="Stop after this many readings", type=int)
+    parser.add_argument("--broker", help="host:port to republish to", default='127.0.0.1:1883')
+    parser.add_argument("--qos", default=0, type=int)
+    parser.add_argument("--feed", help="Feed an in-process IngestEngine instead of a broker",
+                        action='store_true')
+    parser.add_argument("--history-size", help="Readings kept per sensor by the fed IngestEngine", default=100000, type=int)
+    args = parser.parse_args()
+
+    readings = open_source(args.source, args.topic)
+    if args.feed:
+        replayer, elapsed = _feed_subscriber(args, readings)
+    else:
+        host, port = args.broker.rsplit(':', 1)
+        sink = MqttSink(host, int(port), args.qos, args.codec)
+        replayer = Replayer(args.speed)
+        try:
+            elapsed = replayer.run(readings, sink, args.limit)
+        except KeyboardInterrupt:
+            elapsed = 0.0
+        finally:
+            sink.close()
+    rate = replayer.sent / elapsed if elapsed else 0.0
+    print(f'{replayer.sent} readings in {elapsed:.3f}s ({rate:,.0f}/s), '
+          f'max lag {replayer.max_lag * 1000:.1f} ms')
@@ -0,0 +1,190 @@
+import time
+import random
+import secrets
+import argparse
+
+# What observe() made of a sequence number
+IN_ORDER = 0     # the next one expected
+GAP = 1          # ahead of the next one expected; the ones skipped are missing for now
+REORDERED = 2    # behind the newest one but inside the window, filling a hole
+DUPLICATE = 3    # already received
+LATE = 4         # too old for the window; it was already counted as lost
+
+# Consecutive late readings that confirm a restarted count
+RESTART_RUN = 3
+
+def new_run_id():
+    """
+    A random 32-bit id for one run of a publisher's count, sent with every
+    reading as 'run'; never 0, which means no run id.
+    """
+    return secrets.randbits(32) or 1
+
+class SequenceTracker:
+    __slots__ = ('window', 'highest', 'received', 'lost', 'duplicates', 'reordered', 'late',
+                 'resets', 'run', '__bitmap', '__mask', '__probe', '__run')
+
+    def __init__(self, window=64):
+        """
+        Exact loss accounting for one sensor's sequence numbers.
+
+        A bitmap covers the newest `window` sequence numbers, bit i standing
+        for highest - i. Readings inside the window may arrive in any order
+        and more than once; a sequence number is only counted lost once it
+        slides out of the window unreceived, so reordering never causes
+        false losses. Every operation is a few integer shifts and masks.
+
+        Readings carrying a run id (see new_run_id) start a new count
+        whenever the id changes, however small the new numbers are. For
+        publishers without one, RESTART_RUN late readings in a row with consecutive numbers, the
+        first of them near the start of a count (at most `window`), mean the
+        publisher restarted it, and the tracker follows the new count. Any
+        other late readings, such as a redelivered burst of old ones, are
+        only counted as late.
+
+        Parameters:
+        window (int): Sequence numbers a reading may arrive behind the newest one.
+        """
+        self.window = window
+        self.highest = None
+        self.received = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.late = 0
+        self.resets = 0
+        self.run = None
+        self.__mask = (1 << window) - 1
+        # Positions before the first reading count as received
+        self.__bitmap = self.__mask
+        # Last number and length of the current run of consecutive late readings
+        self.__probe = None
+        self.__run = 0
+
+    @property
+    def missing(self):
+        """Readings lost so far plus the holes still open in the window."""
+        return self.lost + self.window - self.__bitmap.bit_count()
+
+    def restart(self):
+        """Follow a new count; holes left in the old one are lost."""
+        self.lost += self.window - self.__bitmap.bit_count()
+        self.resets += 1
+        self.highest = None
+        self.__bitmap = self.__mask
+        self.__probe = None
+        self.__run = 0
+
+    def observe(self, seq, run=None):
+        """
+        Record one sequence number and return IN_ORDER, GAP, REORDERED,
+        DUPLICATE or LATE. run is the publisher's run id, if it sends one.
+        """
+        if run and run != self.run:
+            if self.run is not None:
+                self.restart()
+            self.run = run
+        if self.highest is None:
+            self.highest = seq
+            self.received += 1
+            return IN_ORDER
+
+        ahead = seq - self.highest
+        if ahead > 0:
+            window = self.window
+            if ahead < window:
+                # The top `ahead` bits leave the window; zeros among them are losses
+                leaving = self.__bitmap >> (window - ahead)
+                self.lost += ahead - leaving.bit_count()
+                self.__bitmap = ((self.__bitmap << ahead) | 1) & self.__mask
+            else:
+                self.lost += window - self.__bitmap.bit_count() + ahead - window
+                self.__bitmap = 1
+            self.highest = seq
+            self.received += 1
+            self.__probe = None
+            return IN_ORDER if ahead == 1 else GAP
+
+        behind = -ahead
+        if behind < self.window:
+            bit = 1 << behind
+            if self.__bitmap & bit:
+                self.duplicates += 1
+                return DUPLICATE
+            self.__bitmap |= bit
+            self.received += 1
+            self.reordered += 1
+            return REORDERED
+
+        if self.__probe is not None and seq == self.__probe + 1:
+            self.__run += 1
+        else:
+            self.__run = 1
+        self.__probe = seq
+        self.late += 1
+        if self.__run >= RESTART_RUN and seq - self.__run < self.window:
+            # The run started a new count
+            self.late -= self.__run
+            self.received += self.__run
+            self.resets += 1
+            self.highest = seq
+            self.__bitmap = self.__mask
+            self.__probe = None
+            self.__run = 0
+            return IN_ORDER
+        return LATE
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check and time SequenceTracker on a lossy, reordered stream')
+    parser.add_argument("--readings", default=1000000, type=int)
+    parser.add_argument("--loss", help="Fraction of readings dropped", default=0.01, type=float)
+    parser.add_argument("--reorder", help="Fraction of readings delayed", default=0.01, type=float)
+    parser.add_argument("--duplicate", help="Fraction of readings sent twice", default=0.001, type=float)
+    parser.add_argument("--window", default=64, type=int)
+    parser.add_argument("--seed", default=1, type=int)
+    args = parser.parse_args()
+
+    # A redelivered burst of old readings is late, not a restart
+    tracker = SequenceTracker(args.window)
+    for seq in [*range(1, 101), 30, 31, *range(101, 111)]:
+        tracker.observe(seq)
+    assert (tracker.resets, tracker.lost, tracker.missing, tracker.late) == (0, 0, 0, 2), 'redelivery taken for a restart'
+    # A publisher starting its count again is followed
+    tracker = SequenceTracker(args.window)
+    for seq in [*range(1, 101), *range(1, 11)]:
+        tracker.observe(seq)
+    assert (tracker.resets, tracker.lost, tracker.missing, tracker.highest) == (1, 0, 0, 10), 'restart not followed'
+    # A quick restart reuses numbers still in the window; the run id tells them apart
+    tracker = SequenceTracker(args.window)
+    for seq in range(1, 21):
+        tracker.observe(seq, run=7)
+    statuses = [tracker.observe(seq, run=8) for seq in range(1, 21)]
+    assert DUPLICATE not in statuses and (tracker.resets, tracker.received, tracker.missing) == (1, 40, 0), \
+        'restart within the window dropped readings'
+
+    rng = random.Random(args.seed)
+    stream, delayed, dropped = [], [], 0
+    for seq in range(1, args.readings + 1):
+        if rng.random() < args.loss:
+            dropped += 1
+            continue
+        if rng.random() < args.reorder:
+            # Held back by up to half a window
+            delayed.append((seq + rng.randint(1, args.window // 2), seq))
+        else:
+            stream.append(seq)
+            if rng.random() < args.duplicate:
+                stream.append(seq)
+        while delayed and delayed[0][0] <= seq:
+            stream.append(delayed.pop(0)[1])
+    stream.extend(seq for _, seq in delayed)
+
+    tracker = SequenceTracker(args.window)
+    observe = tracker.observe
+    start = time.perf_counter()
+    for seq in stream:
+        observe(seq)
+    elapsed = time.perf_counter() - start
+    print(f'{len(stream)} readings in {elapsed:.3f}s ({len(stream) / elapsed:,.0f}/s): '
+          f'dropped {dropped}, missing {tracker.missing} (lost {tracker.lost}), '
+          f'reordered {tracker.reordered}, duplicates {tracker.duplicates}, late {tracker.late}')
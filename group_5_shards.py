@@ -0,0 +1,365 @@
+import os
+import sys
+import time
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+import paho.mqtt.client as mqtt
+from paho.mqtt import MQTTException
+
+from group_5_broker import topic_matches
+from group_5_codec import PayloadDecoder, CodecError
+from group_5_engine import AsyncPublisherEngine
+from group_5_fleet import load_fleet, SIMULATOR_KEYS
+from group_5_data_generator import SensorSimulator
+from group_5_metrics import LatencyHistogram
+from group_5_logs import setup_logging, add_logging_arguments
+from group_5_sequence import SequenceTracker
+
+logger = logging.getLogger(__name__)
+
+# Parameters that can be changed while the fleet runs
+LIVE_PARAMS = ('interval',) + tuple(key for key in SIMULATOR_KEYS if key != 'seed')
+
+def apply_params(sensors, topic_filter, params):
+    """
+    Set interval or simulator parameters on every sensor whose topic matches
+    topic_filter. Values of delta, min_step and max_step are given as for
+    the rising half cycle, and are applied in whichever half the walk is in.
+    """
+    changed = 0
+    for sensor in sensors:
+        if not topic_matches(topic_filter, sensor.topic):
+            continue
+        # Traces have no walk to keep in phase
+        phase = getattr(sensor.simulator, 'phase', 1)
+        for key, value in params.items():
+            if key == 'interval':
+                sensor.interval = float(value)
+            elif key in SensorSimulator.PHASED:
+                setattr(sensor.simulator, key, value * phase)
+            else:
+                setattr(sensor.simulator, key, value)
+        changed += 1
+    return changed
+
+def _shard_stats(shard, engine, final=False):
+    return {
+        'shard': shard,
+        'sensors': len(engine.sensors),
+        'published': sum(s.published for s in engine.sensors),
+        'overruns': sum(s.overruns for s in engine.sensors),
+        'dropped': engine.dropped,
+        'lateness': engine.metrics.histogram('publisher_latency_seconds', stage='schedule'),
+        'cpu_s': time.process_time(),
+        'final': final,
+    }
+
+async def _run_shard(conn, shard, engine, report_every):
+    loop = asyncio.get_running_loop()
+
+    def on_command():
+        try:
+            command, args = conn.recv()
+        except EOFError:
+            # The coordinator is gone
+            loop.remove_reader(conn.fileno())
+            engine.stop()
+            return
+        if command == 'stop':
+            engine.stop()
+        elif command == 'set':
+            apply_params(engine.sensors, *args)
+
+    async def report():
+        while True:
+            conn.send(('stats', _shard_stats(shard, engine)))
+            await asyncio.sleep(report_every)
+
+    loop.add_reader(conn.fileno(), on_command)
+    reporter = loop.create_task(report())
+    try:
+        await engine.run()
+    finally:
+        reporter.cancel()
+        loop.remove_reader(conn.fileno())
+
+def shard_worker(conn, config_path, shard, workers, seed, inflight, report_every):
+    """Process entry point: publish every workers-th sensor of the fleet, starting at shard."""
+    config, sensors = load_fleet(config_path, seed=seed)
+    sensors = sensors[shard::workers]
+    broker = config.get('broker', {})
+    batch = config.get('batch', {})
+    engine = AsyncPublisherEngine(sensors, host=broker.get('host', 'broker.hivemq.com'),
+                                  port=int(broker.get('port', 1883)), qos=int(config.get('qos', 0)),
+                                  inflight=inflight, batch_size=int(batch.get('size', 1)),
+                                  max_latency=float(batch.get('max_latency', 1000)))
+    try:
+        asyncio.run(_run_shard(conn, shard, engine, report_every))
+    except (socket.error, MQTTException) as e:
+        conn.send(('error', f'shard {shard}: {e}'))
+        return
+    conn.send(('stats', _shard_stats(shard, engine, final=True)))
+
+class LossMonitor:
+    def __init__(self, host, port, topics, qos=0):
+        """
+        Subscribe to every topic of the fleet and count exact losses from
+        the sequence numbers, as the subscriber does.
+
+        Parameters:
+        host (str): MQTT broker host.
+        port (int): MQTT broker port.
+        topics (list): Topics to watch.
+        qos (int): Subscription QoS.
+        """
+        self.host = host
+        self.port = port
+        self.topics = sorted(set(topics))
+        self.qos = qos
+        self.errors = 0
+        self.__trackers = {topic: SequenceTracker() for topic in self.topics}
+        self.__decoder = PayloadDecoder()
+        self.__subscribed = threading.Event()
+        self.__client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=f'sub_loss_{int(time.time())}_{random.randint(1000, 9999)}',
+            protocol=mqtt.MQTTv5
+        )
+        self.__client.on_message = self.on_message
+        self.__client.on_subscribe = lambda *args: self.__subscribed.set()
+
+    def start(self, timeout=10):
+        self.__client.connect(self.host, self.port)
+        self.__client.subscribe([(topic, self.qos) for topic in self.topics])
+        self.__client.loop_start()
+        self.__subscribed.wait(timeout)
+        return self
+
+    def stop(self):
+        self.__client.disconnect()
+        self.__client.loop_stop()
+
+    def on_message(self, client, userdata, msg):
+        tracker = self.__trackers.get(msg.topic)
+        if tracker is None:
+            return
+        try:
+            for message in self.__decoder.decode(msg.topic, msg.payload):
+                tracker.observe(message.get('seq', 0), message.get('run'))
+        except (CodecError, KeyError):
+            self.errors += 1
+
+    def stats(self):
+        trackers = list(self.__trackers.values())
+        return {
+            'received': sum(t.received for t in trackers),
+            'missing': sum(t.missing for t in trackers),
+            'duplicates': sum(t.duplicates for t in trackers),
+            'late': sum(t.late for t in trackers),
+            'decode_errors': self.errors,
+        }
+
+class ShardedPublisher:
+    def __init__(self, config_path, workers=None, seed=0, inflight=100, report_every=1.0, verify=False):
+        """
+        Publish one fleet from several processes, one shard of the sensors each.
+
+        Sensors are dealt round robin to the workers. Every worker has its
+        own asyncio engine and MQTT connection, and seeds its simulators
+        from seed + the sensor's index in the whole fleet, so a sensor's
+        seed does not depend on the number of workers. The coordinator
+        starts and stops the workers, forwards live parameter changes, and
+        aggregates the stats they report every report_every seconds.
+
+        Parameters:
+        config_path (str): Fleet config file, as for FleetPublisher.
+        workers (int): Worker processes; defaults to one per CPU.
+        seed (int): Base seed of the fleet.
+        inflight (int): In-flight window of each worker's connection.
+        report_every (float): Seconds between stats reports from the workers.
+        verify (bool): Also subscribe to every topic and count exact losses.
+        """
+        self.config_path = config_path
+        self.workers = workers or os.cpu_count()
+        self.seed = seed
+        self.inflight = inflight
+        self.report_every = report_every
+        self.verify = verify
+        self.errors = []
+        self.__processes = []
+        self.__conns = []
+        self.__stats = {}
+        self.__lock = threading.Lock()
+        self.__collector = None
+        self.__monitor = None
+        self.__started = None
+
+    def start(self, timeout=30):
+        """Start the workers and return once each has reported in."""
+        config, sensors = load_fleet(self.config_path)
+        if self.verify:
+            broker = config.get('broker', {})
+            self.__monitor = LossMonitor(broker.get('host', 'broker.hivemq.com'), int(broker.get('port', 1883)),
+                                         [s.topic for s in sensors], qos=int(config.get('qos', 0))).start()
+
+        ctx = multiprocessing.get_context('spawn')
+        for shard in range(self.workers):
+            parent, child = ctx.Pipe()
+            process = ctx.Process(target=shard_worker, name=f'shard-{shard}', daemon=True,
+                                  args=(child, self.config_path, shard, self.workers, self.seed,
+                                        self.inflight, self.report_every))
+            process.start()
+            self.__processes.append(process)
+            self.__conns.append(parent)
+        self.__started = time.monotonic()
+        self.__collector = threading.Thread(target=self.__collect, name='shard-stats', daemon=True)
+        self.__collector.start()
+
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            with self.__lock:
+                reported = len(self.__stats) + len(self.errors)
+            if reported >= self.workers:
+                break
+            time.sleep(0.05)
+        if self.errors:
+            self.stop()
+            raise ConnectionError('; '.join(self.errors))
+        return self
+
+    def __collect(self):
+        conns = list(self.__conns)
+        while conns:
+            for conn in wait(conns, timeout=0.5):
+                try:
+                    kind, payload = conn.recv()
+                except EOFError:
+                    conns.remove(conn)
+                    continue
+                with self.__lock:
+                    if kind == 'stats':
+                        self.__stats[payload['shard']] = payload
+                    else:
+                        self.errors.append(payload)
+                        logger.error('Worker error: %s', payload)
+
+    def set_params(self, topic_filter, **params):
+        """Change interval or simulator parameters of the matching sensors in every worker."""
+        unknown = set(params) - set(LIVE_PARAMS)
+        if unknown:
+            raise ValueError(f'Cannot change {", ".join(sorted(unknown))} while running')
+        for conn in self.__conns:
+            conn.send(('set', (topic_filter, params)))
+
+    def stop(self, timeout=10):
+        """Stop every worker and return the final aggregated stats."""
+        for conn in self.__conns:
+            try:
+                conn.send(('stop', None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.__processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        if self.__collector is not None:
+            self.__collector.join(timeout)
+        if self.__monitor is not None:
+            # Give the last messages time to arrive before counting them
+            time.sleep(1)
+            self.__monitor.stop()
+        return self.stats()
+
+    def stats(self):
+        """Totals across the workers, with lateness percentiles in ms."""
+        with self.__lock:
+            shards = list(self.__stats.values())
+        lateness = LatencyHistogram()
+        for shard in shards:
+            lateness.merge(shard['lateness'])
+        elapsed = time.monotonic() - self.__started if self.__started else 0
+        published = sum(s['published'] for s in shards)
+        stats = {
+            'workers': self.workers,
+            'sensors': sum(s['sensors'] for s in shards),
+            'published': published,
+            'published_per_s': round(published / elapsed, 1) if elapsed else 0.0,
+            'overruns': sum(s['overruns'] for s in shards),
+            'dropped': sum(s['dropped'] for s in shards),
+            'cpu_s': round(sum(s['cpu_s'] for s in shards), 3),
+            'lateness_ms': {label: round(lateness.percentile(q) / 1000, 3)
+                            for label, q in (('p50', 0.5), ('p99', 0.99), ('p999', 0.999))} if lateness.count else {},
+        }
+        if self.__monitor is not None:
+            stats.update(self.__monitor.stats())
+            expected = stats['received'] + stats['missing']
+            stats['loss'] = round(stats['missing'] / expected, 6) if expected else 0.0
+        return stats
+
+def _parse_command(line):
+    # "set <topic filter> key=value ..." or "stop"
+    words = line.split()
+    if not words:
+        return None, None
+    if words[0] == 'set' and len(words) >= 3:
+        params = {}
+        for word in words[2:]:
+            key, sep, value = word.partition('=')
+            if not sep:
+                raise ValueError(f'Expected key=value, got {word!r}')
+            if value.lower() in ('true', 'false'):
+                params[key] = value.lower() == 'true'
+            else:
+                params[key] = int(value) if value.lstrip('-').isdigit() else float(value)
+        return 'set', (words[1], params)
+    return words[0], None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publish a fleet from several worker processes')
+    parser.add_argument("--config", help="Fleet config file", default='group_5_fleet.json', type=str)
+    parser.add_argument("--workers", help="Worker processes (default: one per CPU)", type=int)
+    parser.add_argument("--seed", help="Base seed of the fleet", default=0, type=int)
+    parser.add_argument("--inflight", help="In-flight window per worker", default=100, type=int)
+    parser.add_argument("--duration", help="Seconds to run for", type=float)
+    parser.add_argument("--verify", help="Subscribe to the fleet and count exact losses", action='store_true')
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging('publisher.log', json_lines=args.log_json,
+                  sample_every=args.log_sample, max_per_second=args.log_rate)
+
+    publisher = ShardedPublisher(args.config, args.workers, seed=args.seed,
+                                 inflight=args.inflight, verify=args.verify).start()
+    print('Commands: "set <topic filter> key=value ...", "stop"', file=sys.stderr)
+    stopping = threading.Event()
+
+    def read_commands():
+        for line in sys.stdin:
+            try:
+                # A mistyped command is reported and the next one read
+                command, command_args = _parse_command(line)
+                if command == 'set':
+                    publisher.set_params(command_args[0], **command_args[1])
+                elif command == 'stop':
+                    break
+            except ValueError as e:
+                print(e, file=sys.stderr)
+        stopping.set()
+
+    threading.Thread(target=read_commands, daemon=True).start()
+    end = time.monotonic() + args.duration if args.duration else None
+    last = 0
+    try:
+        while not stopping.wait(1) and (end is None or time.monotonic() < end):
+            stats = publisher.stats()
+            print(f"{stats['published'] - last} readings/s from {stats['workers']} workers, "
+                  f"lateness {stats['lateness_ms']}", file=sys.stderr)
+            last = stats['published']
+    except KeyboardInterrupt:
+        pass
+    print(publisher.stop())
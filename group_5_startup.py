@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Third-party and heavyweight standard library modules that only the code
+# using them should load
+HEAVY = ('numpy', 'matplotlib', 'tkinter', 'paho', 'dotenv', 'smtplib', 'email.mime', 'asyncio', 'http.server')
+
+# Entry point: (import time budget in ms, RSS budget in MB over a bare
+# interpreter, modules it must not import). The simulator and ingestion
+# cores import with the standard library only; the rest may load what
+# their job needs and nothing else.
+BUDGETS = {
+    'group_5_data_generator': (25, 4, HEAVY),
+    'group_5_ingest': (60, 5, HEAVY),
+    'group_5_alerts': (50, 6, HEAVY),
+    'group_5_broker': (40, 6, HEAVY),
+    'group_5_subscriber': (100, 10, ('numpy', 'matplotlib', 'paho', 'dotenv', 'smtplib', 'email.mime', 'asyncio')),
+    'group_5_publisher': (150, 20, ('numpy', 'matplotlib', 'dotenv', 'smtplib', 'email.mime', 'asyncio')),
+    'group_5_fleet': (150, 16, ('numpy', 'matplotlib', 'tkinter', 'dotenv', 'smtplib', 'email.mime', 'asyncio')),
+    'group_5_engine': (200, 20, ('numpy', 'matplotlib', 'tkinter', 'dotenv', 'smtplib', 'email.mime')),
+    'group_5_gateway': (200, 20, ('numpy', 'matplotlib', 'tkinter', 'dotenv', 'smtplib', 'email.mime')),
+    'group_5_shards': (250, 25, ('numpy', 'matplotlib', 'tkinter', 'dotenv', 'smtplib', 'email.mime')),
+    'group_5_replay': (150, 16, ('numpy', 'matplotlib', 'tkinter', 'dotenv', 'smtplib', 'email.mime')),
+}
+
+# Run in a fresh interpreter: import one module, then report what it loaded
+PROBE = '''
+import sys, json, resource
+if sys.argv[1]:
+    __import__(sys.argv[1])
+print(json.dumps({"rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, "modules": sorted(sys.modules)}))
+'''
+
+def parse_importtime(text, module):
+    """
+    The cumulative import time of module in -X importtime output, in us,
+    and its direct imports by cumulative time, slowest first.
+    """
+    children = []
+    for line in text.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            # The header line
+            continue
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level == 0:
+            if name.strip() == module:
+                return int(cumulative), sorted(children, key=lambda child: -child[1])
+            children = []
+        elif level == 1:
+            children.append((name.strip(), int(cumulative)))
+    return None, []
+
+def measure(module, repeat=3):
+    """
+    Import module in fresh interpreters; the least of repeat runs is kept,
+    as the noise on a busy machine only ever adds.
+
+    Returns:
+    dict: import_ms, rss_kb (peak resident size), children (direct imports
+        as (name, ms), slowest first) and modules (everything loaded).
+    """
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE, module],
+                                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode != 0:
+            raise RuntimeError(f'Importing {module} failed:\n{result.stderr[-2000:]}')
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        micros, children = parse_importtime(result.stderr, module) if module else (0, [])
+        run = {'import_ms': (micros or 0) / 1000, 'rss_kb': probe['rss'],
+               'children': [(name, us / 1000) for name, us in children], 'modules': probe['modules']}
+        if best is None or run['import_ms'] < best['import_ms']:
+            best = dict(run, rss_kb=min(run['rss_kb'], best['rss_kb']) if best else run['rss_kb'])
+        else:
+            best['rss_kb'] = min(best['rss_kb'], run['rss_kb'])
+    return best
+
+def check(module, baseline_kb, repeat=3, scale=1.0):
+    """Measure one entry point against its budget; returns (result, list of problems)."""
+    time_budget, rss_budget, forbidden = BUDGETS[module]
+    result = measure(module, repeat)
+    result['rss_mb'] = (result['rss_kb'] - baseline_kb) / 1024
+    problems = []
+    if result['import_ms'] > time_budget * scale:
+        problems.append(f"import {result['import_ms']:.1f} ms > {time_budget * scale:.0f} ms")
+    if result['rss_mb'] > rss_budget * scale:
+        problems.append(f"RSS +{result['rss_mb']:.1f} MB > {rss_budget * scale:.0f} MB")
+    loaded = [name for name in forbidden if name in result['modules']]
+    if loaded:
+        problems.append(f"imports {', '.join(loaded)}")
+    return result, problems
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check every entry point against its import time and memory budget')
+    parser.add_argument("modules", help="Entry points to check; all of them by default", nargs='*')
+    parser.add_argument("--repeat", help="Fresh interpreters per entry point; the best run counts", default=3, type=int)
+    parser.add_argument("--scale", help="Multiply every budget, for slower machines", default=1.0, type=float)
+    parser.add_argument("--top", help="Slowest direct imports to list per entry point", default=3, type=int)
+    args = parser.parse_args()
+
+    baseline_kb = measure('', args.repeat)['rss_kb']
+    failed = 0
+    for module in args.modules or BUDGETS:
+        result, problems = check(module, baseline_kb, args.repeat, args.scale)
+        time_budget, rss_budget, _ = BUDGETS[module]
+        slowest = ', '.join(f'{name} {ms:.1f}' for name, ms in result['children'][:args.top])
+        print(f"{'FAIL' if problems else 'ok':>4} {module:<24} {result['import_ms']:7.1f} / {time_budget * args.scale:4.0f} ms "
+              f"{result['rss_mb']:6.1f} / {rss_budget * args.scale:3.0f} MB  [{slowest}]")
+        for problem in problems:
+            print(f'       {problem}')
+        failed += bool(problems)
+    sys.exit(1 if failed else 0)
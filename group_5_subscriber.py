@@ -1,116 +1,68 @@
 from tkinter import *
 from tkinter import messagebox
 from tkinter.ttk import *
-import paho.mqtt.client as mqtt
-import json
-import smtplib
-from email.mime.text import MIMEText
 from random import randint
 import time
-import os
-from dotenv import load_dotenv
 import logging
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, 
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    handlers=[
-                        logging.StreamHandler(),  # Logs to console
-                        logging.FileHandler("Subscriber.log")  # Logs to file
-                        
-                    ])
+import argparse
+
+from group_5_ingest import IngestEngine
+from group_5_aggregate import DEFAULT_WINDOWS
+from group_5_metrics import MetricsServer
+from group_5_logs import setup_logging, add_logging_arguments
+
 logging.getLogger('matplotlib').setLevel(logging.WARNING)
 logging.getLogger('PIL').setLevel(logging.WARNING)
 
 class TempClient(Tk):
-    def __init__(self):
+    # Number of most recent readings the plot shows until zoomed
+    plot_window = 20
+    # Most points drawn, whatever the span shown
+    plot_points = 1300
+    # Span change per mouse wheel step
+    zoom_step = 1.25
+
+    def __init__(self, history_size=100000, fps=20, alert_window=30, alert_rate=6,
+                 topic=None, share_group=None, archive=None, metrics_port=None, reorder_window=64,
+                 detectors=None, engine=None, aggregate=None, publish_aggregates=False, transport=None):
         super().__init__()
         self.title('Group5 - Sensor Client')
+        self.__default_topic = topic
+        self.__frame_ms = max(int(1000 / fps), 1)
+        # Ingestion runs at full speed off the Tk thread; the window only
+        # polls its snapshots, once per frame
+        self.__engine = engine if engine is not None else IngestEngine(
+            history_size=history_size, alert_window=alert_window, alert_rate=alert_rate, archive=archive,
+            reorder_window=reorder_window, detectors=detectors, share_group=share_group,
+            aggregate=aggregate, publish_aggregates=publish_aggregates, transport=transport)
+        self.metrics = self.__engine.metrics
+        if metrics_port is not None:
+            MetricsServer(self.metrics, metrics_port).start()
         self.create_vars()
 
         # Initialize UI
         self.initUI()
+        self.protocol('WM_DELETE_WINDOW', self.on_close)
+        self.after(self.__frame_ms, self.render)
 
-        # Initialize MQTT connection
-        mqttc = mqtt.Client(
-            mqtt.CallbackAPIVersion.VERSION2,
-            client_id='sub_demo',
-            protocol=mqtt.MQTTv5
-        )
-        mqttc.on_connect = self.on_connect
-        mqttc.on_disconnect = self.on_disconnect
-        mqttc.on_message = self.on_message
-        mqttc.on_subscribe = self.on_subscribe
-        mqttc.on_unsubscribe = self.on_unsubscribed
-        self.__mqttc = mqttc
-
-    def send_email_notification(self, subject, message):
+    def on_close(self):
+        # Unsubscribe, send pending alerts and write out the archive's buffers
         try:
-            sender_email = os.getenv('SENDER_EMAIL')
-            receiver_email = os.getenv('RECEIVER_EMAIL')
-            password = os.getenv('EMAIL_PASSWORD')
-            
-            msg = MIMEText(message)
-            msg['Subject'] = subject
-            msg['From'] = sender_email
-            msg['To'] = receiver_email
-            
-            with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-                server.login(sender_email, password)
-                server.send_message(msg)
-            logging.info(f"Email sent: {subject}")
-        except smtplib.SMTPException as e:
-            logging.error(f"SMTP error occurred: {e}")
-            messagebox.showerror("Email Error", "Failed to send email notification.")
-
-    def on_disconnect(self, client, userdata, flags, reason, properties):
-        logging.info('Disconnected.. \n Return code: ' + str(reason))
-
-    def on_unsubscribed(self, mqttc, userdata, mid, granted_qos):
-        logging.info('Unsubscribed')
-
-    def update_data(self, packetId, interval, newTemp):
-        # Check if there is lost transmission
-        lost = (packetId - self.__lastReceived) > (interval * 1000 * 1.1)
-        if (self.__lastReceived > 0 and lost):
-            logging.warning('Missing Detected!')
-            miss = self.__missing.get()
-            self.__missing.set(miss + 1)
-            try:
-                self.send_email_notification(
-                    'Missing Data Alert',
-                    f'Missing data detected. Packet ID: {packetId}'
-                )
-            except Exception as e:
-                logging.error(f"Error sending email notification: {e}")
-                messagebox.showerror("Notification Error", "Failed to send missing data alert email.")
+            if self.__button_name.get() == 'Stop':
+                self.__engine.stop()
+            self.__engine.close()
+        finally:
+            self.destroy()
 
-        self.__lastReceived = packetId
-
-        # Wild Data is not added to dataset
-        if (newTemp < -40 or newTemp > 40):
-            logging.warning('Wild Detected!')
-            wild = self.__wild.get()
-            self.__wild.set(wild + 1)
-            try:
-                self.send_email_notification(
-                    'Wild Data Alert',
-                    f'Wild data detected. Temperature: {newTemp}'
-                )
-            except Exception as e:
-                logging.error(f"Error sending email notification: {e}")
-                messagebox.showerror("Notification Error", "Failed to send wild data alert email.")
-            return
+    @property
+    def engine(self):
+        return self.__engine
 
-        if(len(self.__data) >= 20):
-            self.__data.pop(0)
+    def on_message(self, mqttc, userdata, msg):
+        self.__engine.on_message(mqttc, userdata, msg)
 
-        self.__data.append(newTemp)
-        self.update_plot()
+    def update_data(self, packetId, interval, newTemp, sensor=None, seq=None, run=None):
+        self.__engine.update_data(packetId, interval, newTemp, sensor, seq, run)
 
     def create_styles(self, parent=None):
         style = Style()
@@ -120,7 +72,23 @@ class TempClient(Tk):
         style.configure('TButton', font=('Arial', 14))
 
     def create_vars(self):
-        self.__data = []
+        # Sensor shown in the labels and plot, chosen on the Tk thread
+        self.__sensor = None
+        # Tk thread only: render copies the engine's snapshots into the Tk
+        # variables and redraws when the shown sensor's history has grown
+        self.__plot_dirty = False
+        self.__drawn = None
+        self.__rendered_at = None
+        self.__event_id = 0
+        # Errors reported by the engine so far, per title
+        self.__event_counts = {}
+        self.__status = StringVar()
+        # Plot view: span in ms (None for plot_window readings) and end
+        # timestamp (None to follow the newest reading); Tk thread only
+        self.__view_span = None
+        self.__view_end = None
+        self.__drag = None
+        self.__background = None
         self.__sensorName = StringVar()
         self.__packetId = StringVar(value='000000000000')
         self.__name = StringVar(value='Sensor Name')
@@ -128,11 +96,13 @@ class TempClient(Tk):
         self.__ipv4 = StringVar(value='0.0.0.0')
         self.__wild = IntVar(value=0)
         self.__missing = IntVar(value=0)
-        self.__lastReceived = -1
+        self.__view = StringVar()
         self.__button_name = StringVar(value='Start')
 
-        # dropdown options
-        self.__sensors_name = ["sensor1", "sensor2", "sensor3"]
+        # dropdown options, '+' subscribes to every single-level topic
+        self.__sensors_name = ["sensor1", "sensor2", "sensor3", "+", "fleet/+"]
+        if self.__default_topic and self.__default_topic not in self.__sensors_name:
+            self.__sensors_name.insert(0, self.__default_topic)
 
     def initUI(self):
         Canvas(width=1060, height=680).pack()
@@ -151,24 +121,49 @@ class TempClient(Tk):
         Label(container, textvariable=self.__wild, font='Arial 14').place(relx=0.85, rely=0.55)
         Label(container, text='Missing: ', font='Arial 14').place(relx=0.7, rely=0.65)
         Label(container, textvariable=self.__missing, font='Arial 14').place(relx=0.85, rely=0.65)
+        Label(container, text='Showing: ', font='Arial 14').place(relx=0.7, rely=0.74)
+        self.viewOptions = Combobox(container, textvariable=self.__view, width=15, state='readonly')
+        self.viewOptions.place(relx=0.83, rely=0.745)
+        self.viewOptions.bind('<<ComboboxSelected>>', self.on_view_selected)
         topicOptions = Combobox(container, values=self.__sensors_name, textvariable=self.__sensorName, width=15, style='TCombobox')
         topicOptions.place(relx=0.7, rely=0.82)
-        topicOptions.current(0)
+        if self.__default_topic:
+            topicOptions.set(self.__default_topic)
+        else:
+            topicOptions.current(0)
 
         self.startButton = Button(container, textvariable=self.__button_name, style='TButton', command=self.btn_on_click)
         self.startButton.place(relx=0.83, rely=0.82)
+        # Ingest errors can be steady (foreign traffic on a wildcard, say),
+        # so they are counted here instead of stacking up dialogs
+        Label(container, textvariable=self.__status, font='Arial 11', foreground='#b00020',
+              wraplength=980).place(relx=0.02, rely=0.93)
+
 
+        # Matplotlib and its Tk backend are the slowest imports here, so
+        # they wait until there is a window to draw in
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
         # Initialize Matplotlib Figure
         self.fig, self.ax = plt.subplots(figsize=(15, 10))
         self.ax.set_title("Temperature Data")
-        self.ax.set_xlabel("Data Points")
+        self.ax.set_xlabel("Seconds before latest reading")
         self.ax.set_ylabel("Temperature (°C)")
-        self.line, = self.ax.plot([], [], 'r-')
+        self.ax.set_xlim(-1, 0)
+        self.fig.subplots_adjust(left=0.1, right=0.95, top=0.9, bottom=0.2)
+        # The line is animated so full redraws leave it out of the background
+        self.line, = self.ax.plot([], [], 'r-', animated=True)
 
         # Embed the plot in the Tkinter window
         self.canvas = FigureCanvasTkAgg(self.fig, master=self)
         self.canvas.get_tk_widget().place(relx=0.05, rely=0.24, width=650, height=400)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        # Wheel zooms, dragging pans back in time, double click returns to live
+        self.canvas.mpl_connect('scroll_event', self.on_scroll)
+        self.canvas.mpl_connect('button_press_event', self.on_press)
+        self.canvas.mpl_connect('motion_notify_event', self.on_motion)
+        self.canvas.mpl_connect('button_release_event', self.on_release)
 
         self.create_styles()
 
@@ -176,61 +171,197 @@ class TempClient(Tk):
         if self.__button_name.get() == 'Start':
             # Set States
             self.__button_name.set('Stop')
-            self.__data.clear()
-            self.__lastReceived = -1
-            self.__wild.set(0)
-            self.__missing.set(0)
+            self.__engine.clear()
+            self.__event_counts.clear()
+            self.__status.set('')
+            self.__sensor = None
+            self.__drawn = None
+            self.reset_view()
+            self.__view.set('')
+            self.viewOptions['values'] = []
             try:
-                # Connect to Mqtt broker on specified host and port
-                self.__mqttc.connect(host='broker.hivemq.com', port=1883)
-                self.__mqttc.loop_start()
-                logging.info('Starting: %s', self.__sensorName.get())
+                # Connect through the configured transport (--transport or TRANSPORT_URL)
+                self.__engine.start(self.__sensorName.get())
             except Exception as e:
                 logging.error(f"Error connecting to MQTT broker: {e}")
                 messagebox.showerror("MQTT Connection Error", "Failed to connect to the MQTT broker.")
         else:
             self.__button_name.set('Start')
             try:
-                self.__mqttc.unsubscribe(topic=self.__sensorName.get())
-                self.__mqttc.loop_stop()
+                self.__engine.stop()
             except Exception as e:
                 logging.error(f"Error unsubscribing from topic: {e}")
                 messagebox.showerror("MQTT Error", "Failed to unsubscribe from the MQTT topic.")
 
-    def on_connect(self, mqttc, userdata, flags, rc, properties=None):
-        logging.info('Connected.. \n Return code: %s', str(rc))
-        try:
-            mqttc.subscribe(topic=self.__sensorName.get(), qos=0)
-        except Exception as e:
-            logging.error(f"Error subscribing to topic: {e}")
-            messagebox.showerror("MQTT Subscription Error", "Failed to subscribe to the MQTT topic.")
+    def on_view_selected(self, event=None):
+        self.__sensor = self.__view.get()
+        self.reset_view()
 
-    def on_message(self, mqttc, userdata, msg):
+    def reset_view(self):
+        self.__view_span = None
+        self.__view_end = None
+        self.__plot_dirty = True
+
+    def view_range(self):
+        # (start, end) timestamps shown, or None before the first reading
+        history = self.__engine.history
+        if self.__sensor not in history:
+            return None
+        newest, _ = history[self.__sensor].view(last=1)
+        if len(newest) == 0:
+            return None
+        span = self.__view_span
+        if span is None:
+            state = self.__engine.snapshot().sensors.get(self.__sensor)
+            latest = state.last_message if state is not None else None
+            interval = latest['interval'] if latest else 1
+            span = (self.plot_window - 1) * interval * 1000
+        end = int(newest[-1]) if self.__view_end is None else self.__view_end
+        return end - span, end
+
+    def on_scroll(self, event):
+        current = self.view_range()
+        if current is None:
+            return
+        start, end = current
+        factor = 1 / self.zoom_step if event.button == 'up' else self.zoom_step
+        self.__view_span = max((end - start) * factor, 1000)
+        if self.__view_end is not None and event.xdata is not None:
+            # Keep the time under the cursor where it is
+            anchor = end + event.xdata * 1000
+            self.__view_end = int(anchor + (end - anchor) * self.__view_span / (end - start))
+        self.__plot_dirty = True
+
+    def on_press(self, event):
+        current = self.view_range()
+        if event.button != 1 or event.inaxes is not self.ax or current is None:
+            return
+        if event.dblclick:
+            self.reset_view()
+            return
+        self.__drag = (event.x, current)
+
+    def on_motion(self, event):
+        if self.__drag is None:
+            return
+        x, (start, end) = self.__drag
+        shift = (event.x - x) / self.ax.bbox.width * (end - start)
+        newest, _ = self.__engine.history[self.__sensor].view(last=1)
+        self.__view_span = end - start
+        # Dragged back up to the newest reading follows it again
+        self.__view_end = None if end - shift >= newest[-1] else int(end - shift)
+        self.__plot_dirty = True
+
+    def on_release(self, event):
+        self.__drag = None
+
+    def render(self):
+        # Runs on the Tk thread at most once per frame, however fast
+        # messages arrive, and applies whatever changed since the last frame
         try:
-            message = json.loads(msg.payload)
-            self.__packetId.set(message['packetId'])
-            self.__name.set(message['name'])
-            self.__temp.set(message['temp'])
-            self.__ipv4.set(message['ipv4'])
-            self.update_data(message['packetId'], message['interval'], message['temp'])
-        except json.JSONDecodeError:
-            logging.error('JSON Decode Error: Unable to decode the message payload.')
-            messagebox.showerror("Data Error", "Failed to decode the received data.")
-        except KeyError as e:
-            logging.error(f"Missing key in JSON data: {e}")
-            messagebox.showerror("Data Error", f"Received data is missing key: {e}")
-
-    def on_subscribe(self, mqttc, userdata, mid, granted_qos, properties=None):
-        logging.info('Subscribed')
+            snapshot = self.__engine.snapshot()
+            sensors = snapshot.sensors
+            if len(sensors) != len(self.viewOptions['values']):
+                self.viewOptions['values'] = sorted(sensors)
+            if self.__sensor is None and sensors:
+                self.__sensor = next(iter(sensors))
+                self.__view.set(self.__sensor)
+                self.__plot_dirty = True
+            state = sensors.get(self.__sensor)
+            if state is not None:
+                latest = state.last_message
+                if latest is not None:
+                    # Only packetId, interval and temp are required of a reading
+                    self.__packetId.set(latest['packetId'])
+                    self.__name.set(latest.get('name', state.topic))
+                    self.__temp.set(latest['temp'])
+                    self.__ipv4.set(latest.get('ipv4', 'unknown'))
+                self.__wild.set(state.wild)
+                self.__missing.set(state.missing)
+                if state.appended != self.__drawn:
+                    self.__drawn = state.appended
+                    self.__plot_dirty = True
+            if self.__plot_dirty:
+                self.__plot_dirty = False
+                self.update_plot()
+            if state is not None:
+                self.record_render(state)
+            if snapshot.last_event != self.__event_id:
+                self.show_events()
+        finally:
+            self.after(self.__frame_ms, self.render)
+
+    def show_events(self):
+        # Non-modal: the newest error, and how many of each kind so far
+        events = self.__engine.events(self.__event_id)
+        if not events:
+            return
+        self.__event_id = events[-1].id
+        for event in events:
+            self.__event_counts[event.title] = self.__event_counts.get(event.title, 0) + 1
+        latest = events[-1]
+        counts = ', '.join(f'{title}: {count}' for title, count in self.__event_counts.items())
+        self.__status.set(f'{latest.title}: {latest.message}  [{counts}]')
+
+    def record_render(self, state):
+        # Only the shown sensor is drawn, so only it has render latencies;
+        # readings that arrived together since the last frame count once
+        received_at, sent_at = state.received_at, state.sent_at
+        if received_at is None or received_at == self.__rendered_at:
+            return
+        self.__rendered_at = received_at
+        now = time.time()
+        self.metrics.observe('subscriber_latency_seconds', now - received_at, sensor=state.topic, stage='render')
+        if sent_at is not None:
+            self.metrics.observe('subscriber_latency_seconds', now - sent_at, sensor=state.topic, stage='total')
 
     def update_plot(self):
         # Update plot with new data
-        self.line.set_xdata(range(len(self.__data)))
-        self.line.set_ydata(self.__data)
-        self.ax.relim()
-        self.ax.autoscale_view()
-        self.fig.subplots_adjust(left=0.1, right=0.95, top=0.9, bottom=0.2)
-        self.canvas.draw()
+        # Long spans come from the history's min/max levels, so drawing
+        # costs the same for the last minute or the last day
+        view = self.view_range()
+        if view is None:
+            return
+        start, end = view
+        timestamps, temps = self.__engine.history.window(self.__sensor, start, end, self.plot_points)
+        self.line.set_data((timestamps - end) / 1000, temps)
+        limits = self.plot_limits(temps)
+        xlim = (-(end - start) / 1000, 0)
+        if self.__view_end is None:
+            xlabel = "Seconds before latest reading"
+        else:
+            xlabel = f"Seconds before {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end / 1000))}"
+        if limits is not None or xlim != tuple(self.ax.get_xlim()) or xlabel != self.ax.get_xlabel():
+            # Axes change: full redraw, which refreshes the background
+            if limits is not None:
+                self.ax.set_ylim(limits)
+            self.ax.set_xlim(xlim)
+            self.ax.set_xlabel(xlabel)
+            self.canvas.draw()
+        elif self.__background is None:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.__background)
+            self.ax.draw_artist(self.line)
+            self.canvas.blit(self.ax.bbox)
+
+    def plot_limits(self, temps):
+        # New y limits when the data leaves the view or the padded view it
+        # needs is under half the current one, else None. The padding keeps
+        # small moves from re-laying out the axes.
+        if len(temps) == 0:
+            return None
+        low, high = float(temps.min()), float(temps.max())
+        pad = max((high - low) * 0.25, 0.5)
+        view_low, view_high = self.ax.get_ylim()
+        inside = low >= view_low and high <= view_high
+        if inside and (high - low + 2 * pad) * 2 >= view_high - view_low:
+            return None
+        return low - pad, high + pad
+
+    def on_draw(self, event):
+        self.__background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.line)
 
     def simulate_missing_data(self, packetId):
         # Simulate occasional missing data by skipping data points
@@ -238,5 +369,36 @@ class TempClient(Tk):
             time.sleep(randint(1, 3))
 
 if __name__ == '__main__':
-    tempClient = TempClient()
+    from dotenv import load_dotenv
+
+    # TRANSPORT_URL and the SMTP settings
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history-size", help="Readings kept per sensor", default=100000, type=int)
+    parser.add_argument("--fps", help="Maximum plot redraws per second", default=20, type=float)
+    parser.add_argument("--alert-window", help="Seconds alerts are collected into one email", default=30, type=float)
+    parser.add_argument("--alert-rate", help="Maximum alert emails per minute, 0 for none", default=6, type=float)
+    parser.add_argument("--topic", help="Topic or wildcard to subscribe to, e.g. 'sensor/+'", type=str)
+    parser.add_argument("--share-group", help="Shared subscription group to split load with other subscribers", type=str)
+    parser.add_argument("--archive", help="Directory to archive received readings in", type=str)
+    parser.add_argument("--metrics-port", help="Serve Prometheus metrics on this local port", type=int)
+    parser.add_argument("--reorder-window", help="Readings one may arrive late by before it counts as lost", default=64, type=int)
+    parser.add_argument("--detectors", help="JSON file configuring the wild data detectors per sensor", type=str)
+    parser.add_argument("--aggregate", help="Summarize readings over these windows, e.g. 1m or 1h/1m for sliding",
+                        nargs='*', metavar='WINDOW')
+    parser.add_argument("--publish-aggregates", help="Publish the summaries to <sensor>/agg/<window>",
+                        action='store_true')
+    parser.add_argument("--transport", help="mqtt://host:port, udp://host:port or loopback://hub; "
+                        "TRANSPORT_URL by default", type=str)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging('Subscriber.log', level=logging.DEBUG, console=True, json_lines=args.log_json,
+                  sample_every=args.log_sample, max_per_second=args.log_rate)
+    tempClient = TempClient(history_size=args.history_size, fps=args.fps,
+                            alert_window=args.alert_window, alert_rate=args.alert_rate,
+                            topic=args.topic, share_group=args.share_group, archive=args.archive,
+                            metrics_port=args.metrics_port, reorder_window=args.reorder_window,
+                            detectors=args.detectors,
+                            aggregate=(args.aggregate or DEFAULT_WINDOWS) if args.aggregate is not None else None,
+                            publish_aggregates=args.publish_aggregates, transport=args.transport)
     tempClient.mainloop()
\ No newline at end of file
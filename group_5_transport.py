@@ -0,0 +1,423 @@
+import os
+import time
+import queue
+import random
+import socket
+import struct
+import logging
+import argparse
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit, parse_qs
+
+from group_5_broker import topic_matches
+
+logger = logging.getLogger(__name__)
+
+# Where readings go unless told otherwise: --transport, else TRANSPORT_URL
+# from the environment or .env, else the public broker
+DEFAULT_URL = 'mqtt://broker.hivemq.com:1883'
+
+# What every transport hands a subscriber's handler, like paho's MQTTMessage
+Message = namedtuple('Message', ['topic', 'payload', 'qos'])
+
+# UDP datagrams: topic length, topic, payload
+DATAGRAM = struct.Struct('<H')
+
+def transport_url(url=None):
+    return url or os.getenv('TRANSPORT_URL', DEFAULT_URL)
+
+def _plain_filter(topic_filter):
+    # A shared subscription receives on its plain topic filter
+    if topic_filter.startswith('$share/'):
+        return topic_filter.split('/', 2)[2]
+    return topic_filter
+
+class _Subscriptions:
+    """Topic filters and their handlers, for transports without a broker to filter."""
+    def __init__(self):
+        self.handlers = {}
+
+    def deliver(self, client, msg):
+        for topic_filter, handler in list(self.handlers.items()):
+            if topic_matches(_plain_filter(topic_filter), msg.topic):
+                handler(client, None, msg)
+
+class MqttTransport:
+    # Same interface as Outbox, which wraps client for queueing and backoff
+    rate_scale = 1.0
+    backlog = 0
+
+    def __init__(self, host='broker.hivemq.com', port=1883, client_id=None, on_error=None):
+        """
+        Readings over an MQTT broker, through paho.
+
+        Subscriptions are remembered and made again on every connect, so a
+        reconnect does not lose them.
+
+        Parameters:
+        host (str): MQTT broker host.
+        port (int): MQTT broker port.
+        client_id (str): Client id; a unique one by default, since a
+            second client with the same id takes over the session.
+        on_error (callable): Called as on_error(title, message) when a
+            subscription fails, off the caller's thread.
+        """
+        # Only processes that use MQTT import paho
+        import paho.mqtt.client as mqtt
+
+        self.host = host
+        self.port = port
+        self.on_error = on_error
+        self.__mqtt = mqtt
+        self.client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=client_id or f'group5_{int(time.time())}_{random.randint(1000, 9999)}',
+            protocol=mqtt.MQTTv5
+        )
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.__handlers = {}
+        self.__running = False
+
+    def connect(self, background=False):
+        """Connect and start paho's network thread; in the background the first connect never raises."""
+        if background:
+            self.client.connect_async(host=self.host, port=self.port)
+        else:
+            self.client.connect(host=self.host, port=self.port)
+        if not self.__running:
+            self.client.loop_start()
+            self.__running = True
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        logger.info('Connected to %s:%d. Return code: %s', self.host, self.port, rc)
+        for topic_filter in self.__handlers:
+            self.__subscribe(topic_filter)
+
+    def on_disconnect(self, client, userdata, flags, reason, properties):
+        logger.info('Disconnected from %s:%d. Return code: %s', self.host, self.port, reason)
+
+    def __subscribe(self, topic_filter):
+        try:
+            rc, _ = self.client.subscribe(topic=topic_filter, qos=0)
+            if rc != self.__mqtt.MQTT_ERR_SUCCESS:
+                raise ValueError(self.__mqtt.error_string(rc))
+        except ValueError as e:
+            logger.error('Error subscribing to %s: %s', topic_filter, e)
+            if self.on_error is not None:
+                self.on_error("MQTT Subscription Error", "Failed to subscribe to the MQTT topic.")
+
+    def subscribe(self, topic_filter, handler):
+        """Call handler(client, userdata, msg) for every message matching topic_filter."""
+        self.__handlers[topic_filter] = handler
+        if len(self.__handlers) == 1:
+            # The broker only sends what was subscribed to
+            self.client.on_message = handler
+        else:
+            subscriptions = _Subscriptions()
+            subscriptions.handlers = self.__handlers
+            self.client.on_message = lambda client, userdata, msg: subscriptions.deliver(client, msg)
+        if self.client.is_connected():
+            self.__subscribe(topic_filter)
+
+    def unsubscribe(self, topic_filter):
+        if self.__handlers.pop(topic_filter, None) is not None and self.client.is_connected():
+            self.client.unsubscribe(topic=topic_filter)
+
+    def publish(self, topic, payload, qos=0):
+        return self.client.publish(topic, payload, qos=qos).rc == self.__mqtt.MQTT_ERR_SUCCESS
+
+    def close(self):
+        self.client.disconnect()
+        if self.__running:
+            self.client.loop_stop()
+            self.__running = False
+
+class LoopbackTransport:
+    rate_scale = 1.0
+    on_error = None
+    # Every LoopbackTransport on a hub, by hub name
+    hubs = {}
+
+    def __init__(self, hub='default', sync=False, queue_size=10000):
+        """
+        Readings between publishers and subscribers in the same process,
+        with no network, serialization beyond the codec, or broker.
+
+        Everything published on a hub goes to every subscriber on that hub
+        whose filter matches. With sync the handler runs inside publish on
+        the publisher's thread, so a whole pipeline can be profiled on one
+        thread. Otherwise each subscriber has a bounded queue and its own
+        delivery thread, and publish blocks while the queue is full.
+
+        Parameters:
+        hub (str): Name of the hub; transports only meet on the same hub.
+        sync (bool): Deliver inside publish.
+        queue_size (int): Messages queued per subscriber.
+        """
+        self.hub = hub
+        self.sync = sync
+        self.__subscriptions = _Subscriptions()
+        self.__queue = queue.Queue(queue_size)
+        self.__thread = None
+
+    @property
+    def backlog(self):
+        return self.__queue.qsize()
+
+    def connect(self, background=False):
+        LoopbackTransport.hubs.setdefault(self.hub, [])
+        if self not in LoopbackTransport.hubs[self.hub]:
+            LoopbackTransport.hubs[self.hub].append(self)
+
+    def subscribe(self, topic_filter, handler):
+        self.__subscriptions.handlers[topic_filter] = handler
+        if not self.sync and self.__thread is None:
+            self.__thread = threading.Thread(target=self.__deliver, name='loopback', daemon=True)
+            self.__thread.start()
+
+    def unsubscribe(self, topic_filter):
+        self.__subscriptions.handlers.pop(topic_filter, None)
+
+    def publish(self, topic, payload, qos=0):
+        msg = Message(topic, payload, qos)
+        for transport in LoopbackTransport.hubs.get(self.hub, ()):
+            if transport.__subscriptions.handlers:
+                transport.__receive(msg)
+        return True
+
+    def __receive(self, msg):
+        if self.sync:
+            self.__subscriptions.deliver(self, msg)
+        else:
+            self.__queue.put(msg)
+
+    def __deliver(self):
+        while True:
+            msg = self.__queue.get()
+            try:
+                if msg is None:
+                    break
+                self.__subscriptions.deliver(self, msg)
+            finally:
+                self.__queue.task_done()
+
+    def drain(self, timeout=5):
+        """Wait until every queued message was handled."""
+        end = time.monotonic() + timeout
+        while self.__queue.unfinished_tasks and time.monotonic() < end:
+            time.sleep(0.001)
+
+    def close(self):
+        transports = LoopbackTransport.hubs.get(self.hub, [])
+        if self in transports:
+            transports.remove(self)
+        if self.__thread is not None:
+            self.__queue.put(None)
+            self.__thread.join(1)
+            self.__thread = None
+
+class UdpTransport:
+    rate_scale = 1.0
+    backlog = 0
+    on_error = None
+
+    def __init__(self, host='127.0.0.1', port=9999, receive_buffer=4 * 1024 * 1024):
+        """
+        Readings as single UDP datagrams, sent straight to the subscriber.
+
+        There is no broker: publishers send to host:port, where the
+        subscriber listens and filters by topic itself. Datagrams that are
+        dropped, on the network or because the receive buffer overflowed,
+        are simply lost, which the subscriber's sequence tracking counts;
+        failed sends are counted in dropped. A reading must fit in one
+        datagram, so large batched frames may not.
+
+        Parameters:
+        host (str): Subscriber address.
+        port (int): Subscriber port.
+        receive_buffer (int): Socket receive buffer asked for, in bytes.
+        """
+        self.host = host
+        self.port = port
+        self.receive_buffer = receive_buffer
+        self.dropped = 0
+        self.__subscriptions = _Subscriptions()
+        self.__sock = None
+        self.__listener = None
+        self.__thread = None
+
+    def connect(self, background=False):
+        if self.__sock is None:
+            self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def subscribe(self, topic_filter, handler):
+        self.__subscriptions.handlers[topic_filter] = handler
+        if self.__listener is None:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+            listener.bind((self.host, self.port))
+            # Closing does not wake a blocked receive, so it checks back
+            listener.settimeout(0.5)
+            # A bound port of 0 is picked by the system
+            self.port = listener.getsockname()[1]
+            self.__listener = listener
+            self.__thread = threading.Thread(target=self.__receive, args=[listener], name='udp', daemon=True)
+            self.__thread.start()
+
+    def unsubscribe(self, topic_filter):
+        self.__subscriptions.handlers.pop(topic_filter, None)
+
+    def publish(self, topic, payload, qos=0):
+        topic = topic.encode()
+        try:
+            self.__sock.sendto(DATAGRAM.pack(len(topic)) + topic + payload, (self.host, self.port))
+            return True
+        except OSError as e:
+            self.dropped += 1
+            logger.error('UDP send error: %s', e)
+            return False
+
+    def __receive(self, listener):
+        buffer = bytearray(65536)
+        view = memoryview(buffer)
+        while True:
+            try:
+                size = listener.recv_into(buffer)
+            except socket.timeout:
+                if self.__listener is not listener:
+                    break
+                continue
+            except OSError:
+                break
+            if size < DATAGRAM.size:
+                continue
+            topic_len, = DATAGRAM.unpack_from(buffer)
+            start = DATAGRAM.size
+            topic = view[start:start + topic_len].tobytes().decode(errors='replace')
+            self.__subscriptions.deliver(self, Message(topic, view[start + topic_len:size].tobytes(), 0))
+
+    def close(self):
+        if self.__sock is not None:
+            self.__sock.close()
+            self.__sock = None
+        if self.__listener is not None:
+            listener, self.__listener = self.__listener, None
+            self.__thread.join(1)
+            listener.close()
+
+def open_transport(url=None, client_id=None):
+    """
+    A transport from a URL: mqtt://host:port, udp://host:port or
+    loopback://hub (with ?sync=1 to deliver inside publish). None reads
+    TRANSPORT_URL from the environment, else the public broker.
+
+    Every transport has connect(background), publish(topic, payload, qos),
+    subscribe(topic_filter, handler), unsubscribe(topic_filter) and close(),
+    and handlers are called paho style as handler(client, userdata, msg).
+    client_id is only used by MQTT.
+    """
+    parts = urlsplit(transport_url(url))
+    query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+    if parts.scheme == 'mqtt':
+        return MqttTransport(parts.hostname or 'broker.hivemq.com', parts.port or 1883, client_id)
+    if parts.scheme == 'udp':
+        return UdpTransport(parts.hostname or '127.0.0.1', parts.port if parts.port is not None else 9999)
+    if parts.scheme == 'loopback':
+        return LoopbackTransport(parts.netloc or 'default', sync=query.get('sync') == '1',
+                                 queue_size=int(query.get('queue', 10000)))
+    raise ValueError(f'Unknown transport: {parts.scheme!r}')
+
+def _bench(url, args):
+    # generate -> encode -> transport -> decode -> detect, all in this process.
+    # With a synchronous loopback the publish stage includes the whole
+    # subscriber side, which then runs on the same thread.
+    from types import SimpleNamespace
+    from group_5_codec import get_codec
+    from group_5_ingest import IngestEngine
+    from group_5_data_generator import SensorSimulator
+
+    # Alerts are counted but never emailed
+    # Opened here rather than from a URL, since run as a script this module
+    # and the group_5_transport the engine imports hold separate loopback hubs
+    engine = IngestEngine(history_size=args.readings, transport=open_transport(url),
+                          sender=SimpleNamespace(send=lambda subject, message: None))
+    engine.start('bench/#')
+    if isinstance(engine.transport, UdpTransport):
+        # Publish to the port the subscriber was given
+        url = f'udp://{engine.transport.host}:{engine.transport.port}'
+    publisher = open_transport(url)
+    publisher.connect()
+    if isinstance(publisher, MqttTransport):
+        while not (publisher.client.is_connected() and engine.transport.client.is_connected()):
+            time.sleep(0.01)
+        time.sleep(0.2)
+
+    codec = get_codec(args.codec)
+    sensors = [SensorSimulator(seed=i) for i in range(args.sensors)]
+    topics = [f'bench/sensor{i}' for i in range(args.sensors)]
+    stages = {'generate': 0.0, 'encode': 0.0, 'publish': 0.0}
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    for i in range(args.readings):
+        t0 = time.perf_counter()
+        index = i % args.sensors
+        temp = sensors[index].value
+        t1 = time.perf_counter()
+        seq = i // args.sensors + 1
+        data = codec.encode({"packetId": 1723396485000 + seq * 1000, "name": topics[index], "ipv4": '127.0.0.1',
+                             "temp": temp, "interval": 1, "seq": seq, "sentAt": time.time()})
+        t2 = time.perf_counter()
+        publisher.publish(topics[index], data)
+        t3 = time.perf_counter()
+        stages['generate'] += t1 - t0
+        stages['encode'] += t2 - t1
+        stages['publish'] += t3 - t2
+
+    # Wait for the readings still on their way, up to a second after the last one
+    received, idle = 0, time.monotonic()
+    while time.monotonic() - idle < 1:
+        total = sum(state.received for state in engine.snapshot().sensors.values())
+        if total >= args.readings:
+            break
+        if total != received:
+            received, idle = total, time.monotonic()
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    if profiler is not None:
+        import pstats
+        profiler.disable()
+        pstats.Stats(profiler).sort_stats('tottime').print_stats(12)
+
+    received = sum(state.received for state in engine.snapshot().sensors.values())
+    publisher.close()
+    engine.stop()
+    engine.close()
+    decode = engine.metrics.histogram('subscriber_latency_seconds', stage='decode')
+    transport = engine.metrics.histogram('subscriber_latency_seconds', stage='transport')
+    per_reading = ', '.join(f'{name} {seconds / args.readings * 1e6:.1f}' for name, seconds in stages.items())
+    print(f'{url:>28}: {received / elapsed:>9,.0f} readings/s, {received}/{args.readings} delivered; '
+          f'us/reading {per_reading}, decode p50 {decode.percentile(0.5):.1f}; '
+          f'transport p50 {transport.percentile(0.5):.0f} us')
+
+if __name__ == '__main__':
+    from group_5_logs import setup_logging
+
+    parser = argparse.ArgumentParser(description='Benchmark the whole reading pipeline in one process')
+    parser.add_argument("urls", help="Transports to compare, e.g. mqtt://127.0.0.1:1883", nargs='*',
+                        default=['loopback://bench?sync=1', 'loopback://bench', 'udp://127.0.0.1:0'])
+    parser.add_argument("--readings", default=50000, type=int)
+    parser.add_argument("--sensors", default=10, type=int)
+    parser.add_argument("--codec", default='json', choices=['json', 'compact', 'binary'])
+    parser.add_argument("--profile", help="Print where the time goes", action='store_true')
+    args = parser.parse_args()
+    # Errors only, to stderr: lost UDP readings would log a warning each
+    setup_logging(None, level=logging.ERROR, console=True)
+
+    for url in args.urls:
+        _bench(url, args)
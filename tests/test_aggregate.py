@@ -0,0 +1,75 @@
+import random
+import statistics
+
+import pytest
+
+from group_5_aggregate import Moments, SlidingWindow, TumblingWindow, parse_window
+
+def assert_moments(moments, values):
+    assert moments.count == len(values)
+    assert (moments.low, moments.high) == (min(values), max(values))
+    assert moments.mean == pytest.approx(statistics.fmean(values))
+    assert moments.stddev == pytest.approx(statistics.pstdev(values) if len(values) > 1 else 0.0, abs=1e-9)
+
+def stream(seed, count=5000):
+    # Irregular spacing with gaps longer than a window
+    rng, ts, readings = random.Random(seed), 1700000000000, []
+    for _ in range(count):
+        ts += rng.choice([0, 100, 250, 1000, 1000, 7000, 65000])
+        readings.append((ts, rng.gauss(20, 5)))
+    return readings
+
+def test_moments_merge():
+    rng = random.Random(1)
+    values = [1e6 + rng.gauss(0, 1) for _ in range(1000)]
+    for split in (0, 1, 500, 999, 1000):
+        left, right = Moments(), Moments()
+        for value in values[:split]:
+            left.add(value)
+        for value in values[split:]:
+            right.add(value)
+        left.merge(right)
+        assert_moments(left, values)
+
+@pytest.mark.parametrize('size', [1000, 60000])
+def test_tumbling_window_matches_brute_force(size):
+    window, readings, closed = TumblingWindow('w', size), stream(size), []
+    for ts, value in readings:
+        result = window.add(ts, value)
+        if result:
+            closed.append(result)
+    starts = sorted({ts - ts % size for ts, _ in readings})[:-1]
+    assert [start for start, _, _ in closed] == starts
+    for start, end, moments in closed:
+        assert end == start + size
+        assert_moments(moments, [value for ts, value in readings if start <= ts < end])
+
+@pytest.mark.parametrize('spec', ['1s/100ms', '10s/1s', '1m/1s', '1m/10s', '1s/1s'])
+def test_sliding_window_matches_brute_force(spec):
+    _, size, hop = parse_window(spec)
+    window, readings = SlidingWindow(spec, size, hop), stream(size // hop)
+    hops, reports = [], 0
+    for ts, value in readings:
+        result = window.add(ts, value)
+        if ts - ts % hop not in hops[-1:]:
+            # A reading in a new hop reports the window ending with the last one
+            assert (result is None) == (not hops)
+            hops.append(ts - ts % hop)
+        else:
+            assert result is None
+        if result:
+            start, end, moments = result
+            assert end - start == size and end == hops[-2] + hop
+            assert_moments(moments, [v for t, v in readings if start <= t < end])
+            reports += 1
+    assert reports == len(hops) - 1
+
+@pytest.mark.parametrize('spec,expected', [('1s', ('1s', 1000, None)), ('1h/1m', ('1h', 3600000, 60000)),
+                                           ('500ms', ('500ms', 500, None))])
+def test_parse_window(spec, expected):
+    assert parse_window(spec) == expected
+
+@pytest.mark.parametrize('spec', ['1x', 'm', '1m/7s', ''])
+def test_parse_window_rejects(spec):
+    with pytest.raises(ValueError):
+        parse_window(spec)
@@ -0,0 +1,91 @@
+import time
+
+import numpy as np
+import pytest
+
+from group_5_archive import FLAG_GAP, FLAG_WILD, Archive
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(3)
+    # Non-decreasing timestamps with repeats and long gaps
+    ts = 1700000000000 + np.cumsum(rng.choice([0, 1000, 1000, 1003, 250000], 20000))
+    temps = rng.normal(20, 3, len(ts))
+    flags = rng.choice([0, 0, 0, FLAG_WILD, FLAG_GAP], len(ts)).astype(np.uint8)
+    return ts, temps, flags
+
+@pytest.fixture
+def archive(tmp_path, data):
+    # Small index and buffer so queries cross many index entries and flushes
+    archive = Archive(str(tmp_path), index_every=64, buffer_size=100)
+    for ts, temp, flags in zip(*data):
+        archive.append('sensor/1', int(ts), float(temp), int(flags))
+    yield archive
+    archive.close()
+
+def test_count_and_reopen(tmp_path, archive, data):
+    assert archive.count('sensor/1') == len(data[0])
+    archive.close()
+    reopened = Archive(str(tmp_path))
+    assert reopened.sensors() == ['sensor/1']
+    for got, expected in zip(reopened.range('sensor/1'), data):
+        np.testing.assert_array_equal(got, expected)
+    reopened.close()
+
+def test_range_matches_brute_force(archive, data):
+    ts, temps, flags = data
+    rng = np.random.default_rng(4)
+    points = [None, ts[0], ts[-1], ts[-1] + 1, ts[0] - 1, *rng.integers(ts[0] - 5000, ts[-1] + 5000, 40)]
+    for _ in range(200):
+        start, end = rng.choice(len(points), 2)
+        start, end = points[start], points[end]
+        keep = np.ones(len(ts), bool)
+        if start is not None:
+            keep &= ts >= start
+        if end is not None:
+            keep &= ts < end
+        got = archive.range('sensor/1', start, end)
+        # An end before start is an empty range
+        if start is not None and end is not None and end < start:
+            assert all(len(column) == 0 for column in got)
+            continue
+        for column, expected in zip(got, (ts[keep], temps[keep], flags[keep])):
+            np.testing.assert_array_equal(column, expected)
+
+def test_unknown_sensor_is_empty(archive):
+    assert all(len(column) == 0 for column in archive.range('nope'))
+    assert len(archive.downsample('nope', 0, 10, 1)['ts']) == 0
+
+def brute_downsample(data, start, end, bucket_ms, include_wild):
+    ts, temps, flags = data
+    keep = (ts >= start) & (ts < end)
+    if not include_wild:
+        keep &= (flags & FLAG_WILD) == 0
+    buckets = {}
+    for t, value in zip(ts[keep], temps[keep]):
+        buckets.setdefault(start + (t - start) // bucket_ms * bucket_ms, []).append(value)
+    return buckets
+
+@pytest.mark.parametrize('include_wild', [False, True])
+@pytest.mark.parametrize('bucket_ms,chunk', [(1000, 1 << 20), (60000, 1 << 20), (60000, 7), (3600000, 1000)])
+def test_downsample_matches_brute_force(archive, data, bucket_ms, chunk, include_wild):
+    ts = data[0]
+    start, end = int(ts[100]) - 17, int(ts[-100])
+    got = archive.downsample('sensor/1', start, end, bucket_ms, include_wild=include_wild, chunk=chunk)
+    expected = brute_downsample(data, start, end, bucket_ms, include_wild)
+    np.testing.assert_array_equal(got['ts'], sorted(expected))
+    for i, bucket in enumerate(sorted(expected)):
+        values = expected[bucket]
+        assert got['count'][i] == len(values)
+        assert got['min'][i] == min(values) and got['max'][i] == max(values)
+        assert got['mean'][i] == pytest.approx(np.mean(values))
+
+def test_flush_timer(tmp_path):
+    archive = Archive(str(tmp_path), buffer_size=1000, flush_interval=0.05)
+    archive.append('s', 1, 20.0)
+    # Another reader sees the reading once the timer has written it
+    time.sleep(0.3)
+    reader = Archive(str(tmp_path))
+    assert reader.count('s') == 1
+    reader.close()
+    archive.close()
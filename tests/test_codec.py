@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+from group_5_codec import CodecError, FrameBatcher, PayloadDecoder, get_codec
+
+def reading(seq, temp, packet_id=1700000000000, name='Sensor 1', ipv4='10.0.0.1', interval=1.0, run=7):
+    return {
+        "packetId": packet_id,
+        "name": name,
+        "ipv4": ipv4,
+        "temp": temp,
+        "interval": interval,
+        "seq": seq,
+        "run": run,
+        # Whole microseconds, the resolution the binary codecs carry
+        "sentAt": (packet_id * 1000 + 123) / 1e6
+    }
+
+def readings(count, seed=1):
+    # Irregular timestamps and a noisy walk, so every delta-of-delta width is used
+    rng = random.Random(seed)
+    packet_id, temp, result = 1700000000000, 21.5, []
+    for seq in range(1, count + 1):
+        packet_id += rng.choice([1000, 1000, 1001, 999, 1500, 60000, 0])
+        temp += rng.gauss(0, 0.3)
+        result.append(reading(seq, temp, packet_id))
+    return result
+
+@pytest.mark.parametrize('name', ['json', 'compact'])
+def test_json_round_trip(name):
+    codec, decoder = get_codec(name), PayloadDecoder()
+    for msg in readings(20):
+        assert decoder.decode('t', codec.encode(msg)) == [msg]
+
+def test_binary_round_trip():
+    codec, decoder = get_codec('binary'), PayloadDecoder()
+    for msg in readings(250):
+        assert decoder.decode('t', codec.encode(msg)) == [msg]
+
+def test_binary_needs_metadata():
+    codec = get_codec('binary')
+    codec.encode(reading(1, 20.0))
+    with pytest.raises(CodecError):
+        PayloadDecoder().decode('t', codec.encode(reading(2, 20.0)))
+
+def test_binary_metadata_is_per_topic():
+    first, second, decoder = get_codec('binary'), get_codec('binary'), PayloadDecoder()
+    a, b = reading(1, 20.0, name='a', ipv4='10.0.0.1'), reading(1, 30.0, name='b', ipv4='10.0.0.2')
+    # Both encoders give their sensor id 0
+    assert decoder.decode('a', first.encode(a)) == [a]
+    assert decoder.decode('b', second.encode(b)) == [b]
+    assert decoder.decode('a', first.encode(a)) == [a]
+
+def test_metadata_resent_when_run_changes():
+    codec, decoder = get_codec('binary'), PayloadDecoder()
+    decoder.decode('t', codec.encode(reading(1, 20.0, run=7)))
+    assert decoder.decode('t', codec.encode(reading(1, 20.0, run=8)))[0]['run'] == 8
+
+@pytest.mark.parametrize('size', [1, 2, 3, 32, 200])
+def test_frame_round_trip(size):
+    batcher, decoder = FrameBatcher(max_readings=size, max_latency=1e9), PayloadDecoder()
+    stream = readings(size * 3 + 1, seed=size)
+    decoded = []
+    for msg in stream:
+        payload = batcher.add(msg, 0.0)
+        if payload is not None:
+            decoded += decoder.decode('t', payload)
+    for payload in batcher.flush():
+        decoded += decoder.decode('t', payload)
+    assert decoded == stream
+
+def test_frame_truncated():
+    batcher = FrameBatcher(max_readings=32, max_latency=1e9)
+    payload = [batcher.add(msg, 0.0) for msg in readings(32)][-1]
+    for cut in (1, 8, len(payload) // 2):
+        with pytest.raises(CodecError):
+            PayloadDecoder().decode('t', payload[:-cut])
+
+def test_frame_closes_on_latency():
+    batcher = FrameBatcher(max_readings=32, max_latency=2500)
+    assert batcher.add(reading(1, 20.0), 0.0) is None
+    assert batcher.next_due() == 2.5
+    assert batcher.flush_due(2.4) == []
+    frames = batcher.flush_due(2.5)
+    assert len(frames) == 1 and batcher.next_due() is None
+    assert PayloadDecoder().decode('t', frames[0]) == [reading(1, 20.0)]
+
+def test_frame_closes_on_interval_change():
+    batcher, decoder = FrameBatcher(max_readings=32, max_latency=1e9), PayloadDecoder()
+    assert batcher.add(reading(1, 20.0), 0.0) is None
+    payload = batcher.add(reading(2, 21.0, interval=2.0), 0.0)
+    assert decoder.decode('t', payload) == [reading(1, 20.0)]
+    assert decoder.decode('t', batcher.flush()[0]) == [reading(2, 21.0, interval=2.0)]
+
+@pytest.mark.parametrize('payload', [b'', b'not json', b'\xb5'])
+def test_undecodable(payload):
+    with pytest.raises(CodecError):
+        PayloadDecoder().decode('t', payload)
+
+def test_unknown_codec():
+    with pytest.raises(CodecError):
+        get_codec('xml')
@@ -0,0 +1,50 @@
+import random
+import statistics
+
+import pytest
+
+from group_5_detectors import MadDetector, RollingMedian, ZScoreDetector
+
+@pytest.mark.parametrize('window', [1, 2, 3, 10, 51])
+@pytest.mark.parametrize('ties', [False, True])
+def test_rolling_median_matches_brute_force(window, ties):
+    rng = random.Random(window)
+    rolling, values = RollingMedian(window), []
+    assert rolling.median is None
+    for _ in range(3000):
+        # Few distinct values exercise equal values leaving the window
+        value = rng.randint(0, 5) if ties else rng.gauss(20, 5)
+        rolling.add(value)
+        values.append(value)
+        assert len(rolling) == min(len(values), window)
+        assert rolling.median == statistics.median(values[-window:])
+
+def test_rolling_median_sorted_input():
+    # Ascending then descending input keeps every expired value on one side
+    rolling, values = RollingMedian(25), [*range(1000), *range(1000, 0, -1)]
+    for i, value in enumerate(values):
+        rolling.add(value)
+        assert rolling.median == statistics.median(values[max(0, i - 24):i + 1])
+
+def noisy(rng, count, level=20.0):
+    return [level + rng.gauss(0, 0.2) for _ in range(count)]
+
+def test_zscore_flags_spike_not_noise():
+    rng, detector = random.Random(1), ZScoreDetector()
+    assert not any(detector.update(ts, value) for ts, value in enumerate(noisy(rng, 500)))
+    assert detector.update(500, 40.0)
+    # The spike did not move the estimates
+    assert not detector.update(501, 20.0)
+
+def test_zscore_rebaselines_after_step():
+    rng, detector = random.Random(2), ZScoreDetector(rebaseline=10)
+    for ts, value in enumerate(noisy(rng, 200)):
+        detector.update(ts, value)
+    flags = [detector.update(200 + ts, value) for ts, value in enumerate(noisy(rng, 200, level=30.0))]
+    assert all(flags[:10]) and not any(flags[20:])
+
+def test_mad_flags_spike_not_noise():
+    rng, detector = random.Random(3), MadDetector(window=51)
+    assert not any(detector.update(ts, value) for ts, value in enumerate(noisy(rng, 500)))
+    assert detector.update(500, 40.0)
+    assert not detector.update(501, 20.0)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from group_5_history import HistoryStore, MinMaxPyramid, RingBuffer
+
+def test_ring_buffer_wraps():
+    buffer = RingBuffer(capacity=5)
+    assert len(buffer) == 0 and len(buffer.view()[0]) == 0
+    for i in range(13):
+        buffer.append(i, i / 2)
+        timestamps, temps = buffer.view()
+        expected = np.arange(max(0, i - 4), i + 1)
+        np.testing.assert_array_equal(timestamps, expected)
+        np.testing.assert_array_equal(temps, expected / 2)
+    np.testing.assert_array_equal(buffer.view(last=2)[0], [11, 12])
+    assert not buffer.view()[0].flags.writeable
+
+def test_ring_buffer_rejects_empty():
+    with pytest.raises(ValueError):
+        RingBuffer(capacity=0)
+
+@pytest.mark.parametrize('count', [1, 7, 8, 63, 64, 65, 1000, 5000])
+def test_pyramid_levels_match_brute_force(count):
+    factor, depth, capacity = 4, 3, 50
+    values = np.random.default_rng(count).normal(20, 5, count)
+    pyramid = MinMaxPyramid(factor, depth, capacity)
+    for i, value in enumerate(values):
+        pyramid.append(i * 10, value)
+
+    for k in range(1, depth + 1):
+        timestamps, lows, highs, dropped = pyramid.level(k)
+        complete = count // factor ** k
+        assert dropped == (complete >= capacity)
+        # The newest complete buckets, then the ones still filling
+        first = (complete - min(complete, capacity)) * factor ** k
+        assert timestamps[0] == first * 10
+        # Each bucket covers the readings up to the next one's start
+        bounds = [*(timestamps // 10), count]
+        for i, (low, high) in enumerate(zip(lows, highs)):
+            assert bounds[i] < bounds[i + 1]
+            assert (low, high) == (values[bounds[i]:bounds[i + 1]].min(), values[bounds[i]:bounds[i + 1]].max())
+
+def store_with(values, **kwargs):
+    store = HistoryStore(**kwargs)
+    for ts, value in enumerate(values):
+        store.append('s', ts, value)
+    return store
+
+def test_window_raw_when_small():
+    values = np.arange(100, dtype=float)
+    timestamps, temps = store_with(values, capacity=1000).window('s', 10, 19, max_points=100)
+    np.testing.assert_array_equal(timestamps, np.arange(10, 20))
+    np.testing.assert_array_equal(temps, values[10:20])
+
+def test_window_summary_keeps_spikes():
+    rng = np.random.default_rng(1)
+    values = rng.normal(20, 1, 100000)
+    values[12345] = 99.0
+    values[67890] = -99.0
+    store = store_with(values, capacity=10000, factor=8, depth=6, level_capacity=2048)
+    timestamps, temps = store.window('s', 0, 99999, max_points=1000)
+    assert len(temps) <= 1000
+    assert np.all(np.diff(timestamps) >= 0)
+    assert temps.max() == 99.0 and temps.min() == -99.0
+
+def test_window_includes_bucket_overlapping_start():
+    values = np.zeros(100000)
+    # Inside the bucket that begins before start
+    values[50001] = 99.0
+    store = store_with(values, capacity=1000, factor=8, depth=6, level_capacity=2048)
+    timestamps, temps = store.window('s', 50002, 99999, max_points=200)
+    assert temps.max() == 99.0
+
+def test_window_max_points_bound():
+    store = store_with(np.arange(200000, dtype=float), capacity=1000, factor=4, depth=3, level_capacity=100000)
+    for max_points in (10, 100, 1000):
+        timestamps, temps = store.window('s', None, None, max_points=max_points)
+        assert len(temps) <= max_points
+        # The newest readings are always covered
+        assert temps.max() == 199999
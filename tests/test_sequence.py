@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from group_5_sequence import (DUPLICATE, GAP, IN_ORDER, LATE, REORDERED, SequenceTracker,
+                              new_run_id)
+
+def observe_all(tracker, stream, run=None):
+    return [tracker.observe(seq, run) for seq in stream]
+
+def test_statuses():
+    tracker = SequenceTracker(window=8)
+    assert observe_all(tracker, [1, 2, 4, 3, 3, 20, 5]) == [IN_ORDER, IN_ORDER, GAP, REORDERED,
+                                                             DUPLICATE, GAP, LATE]
+    # 5 to 12 left the window unreceived; 13 to 19 are still open
+    assert (tracker.lost, tracker.missing, tracker.late) == (8, 15, 1)
+
+def test_hole_filled_inside_window_is_not_lost():
+    tracker = SequenceTracker(window=8)
+    observe_all(tracker, [1, 2, 3, 5, 6, 7, 8, 9, 10, 4, 11, 12, 13, 14, 15, 16])
+    assert (tracker.lost, tracker.missing, tracker.reordered) == (0, 0, 1)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_lossy_reordered_stream(seed):
+    rng = random.Random(seed)
+    window, stream, delayed, dropped, duplicates = 64, [], [], 0, 0
+    for seq in range(1, 20001):
+        if rng.random() < 0.02:
+            dropped += 1
+            continue
+        if rng.random() < 0.05:
+            delayed.append((seq + rng.randint(1, window // 2), seq))
+        else:
+            stream.append(seq)
+            if rng.random() < 0.01:
+                stream.append(seq)
+                duplicates += 1
+        while delayed and delayed[0][0] <= seq:
+            stream.append(delayed.pop(0)[1])
+    stream.extend(seq for _, seq in delayed)
+
+    tracker = SequenceTracker(window)
+    observe_all(tracker, stream)
+    assert tracker.missing == dropped
+    assert tracker.received == 20000 - dropped
+    assert (tracker.duplicates, tracker.late, tracker.resets) == (duplicates, 0, 0)
+
+def test_redelivered_burst_is_late():
+    tracker = SequenceTracker(window=64)
+    observe_all(tracker, [*range(1, 101), 30, 31, *range(101, 111)])
+    assert (tracker.resets, tracker.lost, tracker.missing, tracker.late) == (0, 0, 0, 2)
+
+def test_restarted_count_is_followed():
+    tracker = SequenceTracker(window=64)
+    statuses = observe_all(tracker, [*range(1, 101), *range(1, 11)])
+    assert statuses[-7:] == [IN_ORDER] * 7
+    assert (tracker.resets, tracker.lost, tracker.missing, tracker.late, tracker.highest) == (1, 0, 0, 0, 10)
+    assert tracker.received == 110
+
+def test_run_id_restart_inside_window():
+    tracker = SequenceTracker(window=64)
+    observe_all(tracker, range(1, 21), run=7)
+    statuses = observe_all(tracker, range(1, 21), run=8)
+    assert DUPLICATE not in statuses
+    assert (tracker.resets, tracker.received, tracker.missing) == (1, 40, 0)
+
+def test_run_id_restart_counts_open_holes():
+    tracker = SequenceTracker(window=64)
+    observe_all(tracker, [1, 2, 5], run=7)
+    tracker.observe(1, run=8)
+    assert (tracker.lost, tracker.missing, tracker.resets) == (2, 2, 1)
+
+def test_new_run_id():
+    assert all(0 < new_run_id() < 1 << 32 for _ in range(100))